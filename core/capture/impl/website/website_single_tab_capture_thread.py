@@ -2,15 +2,22 @@ __doc__="网站抓取进程"
 __author__="Li Qingyun"
 __date__="2025-03-09"
 
+from pathlib import Path
 from time import sleep, time
 
 from core.capture.interface.capture_thread import CaptureThread
 from core.extension.const.extension_type import ExtensionType
 from core.extension.interface.extension import Extension
 from core.filter.connections_filter import ConnectionsFilter
+from core.filter.online_connections_filter import OnlineConnectionsFilter
+from core.filter.pcap_filter_worker_pool import PcapFilterWorkerPool
+from core.filter.rotated_capture_filter import RotatedCaptureFilter
 from core.request.interface.request_thread import RequestThread
 from core.sniffer.connection.connection_tracker_thread import ConnectionTrackerThread
 from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.sniffer.shared.shared_capture_service import SharedCaptureService
+from core.sniffer.util.capture_profile_util import CaptureProfileUtil
+from core.sniffer.util.capture_filter_util import CaptureFilterUtil
 from core.util.io.log_util import LogUtil
 from core.util.io.path_util import PathUtil
 from core.util.network.network_interface_util import NetworkInterfaceUtil
@@ -34,7 +41,8 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
                  extension_config:dict=None,
                  request_config: dict=None,
                  sniffer_config: dict=None,
-                 sniffer_conn_tracker_config: dict=None
+                 sniffer_conn_tracker_config: dict=None,
+                 filter_worker_pool: PcapFilterWorkerPool=None
                  ):
         """
 
@@ -46,6 +54,7 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         :param request_config:                  请求配置
         :param sniffer_config:                  流量嗅探器配置
         :param sniffer_conn_tracker_config:     ConnectionTracker配置
+        :param filter_worker_pool:              后台过滤进程池(为None时在抓取线程内同步过滤)
         """
 
         # 初始化配置
@@ -63,6 +72,7 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         self.url = url                                  # 本次抓取的url
         self.url_for_dir = UrlUtil.get_main_domain(url) # 仅保留https://后的主域名的url, 为目录设计(目录中不能含有 / ? 等特殊字符)
         self.output_main_dir = output_main_dir          # 输出文件的主目录
+        self.filter_worker_pool = filter_worker_pool    # 后台过滤进程池
 
         # 进程内共享的参数
         self.__create_time_str = TimeUtil.now_time_str()    # 本次抓取进程的创建时间
@@ -75,10 +85,15 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         self.request_thread = None                  # 请求线程
         self.sniffer: TrafficSniffer = None         # 流量嗅探器
         self.sniffer_conn_tracker_thread = None     # ConnectionTracker线程
+        self.online_filter = None                   # 在线过滤线程(filter_config.online 开启时)
+        self.rotated_filter = None                  # 分片过滤线程(sniffer_config.rotation 开启时)
 
         # 进程传递出来信息
         self.extension_info = None          # 扩展加载后回传的信息(如代理端口, 代理PID等)
         self.request_thread_info = None     # 请求线程创建后回传的信息(如浏览器PID等)
+        self.filter_future = None           # 后台过滤的 Future(同步过滤或未过滤时为None)
+        self.capture_stats = None           # 嗅探器的抓包统计(CaptureStats, 拿不到时为None)
+        self.__capture_profile_applied = False  # 是否已按抓包模板截断 pcap
 
         pass
 
@@ -236,18 +251,16 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         if self.sniffer_config is None:
             self.sniffer_config = {}
 
-        # 2.2 如果是代理且没有指定表达式/参数, 需要把远程地址和端口生成一个过滤表达式传入TrafficSniffer
-        # if self.__is_extension_proxy() and self.sniffer_config.get('filter_expr') is None and self.sniffer_config.get('params') is None:
-        #     # 主动创建一个但是没有传入 sniffer_config
-        #     params = {}
-        #     remote_addr = self.extension_info.get('protocol_stack').remote_address
-        #     remote_port = self.extension_info.get('protocol_stack').remote_port
-        #     params['host'] = remote_addr
-        #     params['port'] = remote_port
-        #     params['tcp']  = True
-        #     params['udp']  = False
-        #     params['icmp'] = False
-        #     self.sniffer_config.update({'params': params})
+        # 2.2 没有指定过滤表达式/参数时, 自动生成抓包过滤器(sniffer_config.auto_filter 为 False/'off' 时不生成)
+        #     代理只抓代理服务器的 地址+端口, 直连排除本机噪声(或 'target' 只抓目标域名的地址)
+        #     sniffer_config 由同一任务的所有抓取共用, 复制一份再修改, 避免上一次生成的过滤器留到下一次
+        self.sniffer_config = dict(self.sniffer_config)
+        if self.sniffer_config.get('filter_expr') is None and self.sniffer_config.get('params') is None:
+            protocol_stack = self.extension_config.get('protocol_stack') if self.__is_extension_proxy() else None
+            self.sniffer_config.update(CaptureFilterUtil.build_sniffer_filter(sniffer_config=self.sniffer_config,
+                                                                              url=self.url,
+                                                                              protocol_stack=protocol_stack,
+                                                                              logger_name=self.task_name))
 
         # 2.3 如果配置中没有指定保存目录, 就把生成的pcap目录设置进去
         self.sniffer_config.update({'output_file_path': self.__pcap_path})
@@ -259,8 +272,14 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
             self.sniffer_config.update({'network_interface': active_physical_interface})
 
         # 2.3 根据 sniffer_config 创建
-        self.sniffer = TrafficSniffer.creat_sniffer_by_config(task_name=self.task_name,
-                                                              config=self.sniffer_config)
+        #     TaskManager 启动了共享抓包服务时, 从网卡的共享抓包中切片(sniffer_config.shared_capture 为 False 时不使用)
+        use_shared_capture = SharedCaptureService().is_running() and self.sniffer_config.get('shared_capture', True)
+        if use_shared_capture:
+            self.sniffer = SharedCaptureService().create_sniffer(task_name=self.task_name,
+                                                                 config=self.sniffer_config)
+        else:
+            self.sniffer = TrafficSniffer.creat_sniffer_by_config(task_name=self.task_name,
+                                                                  config=self.sniffer_config)
         # end if
         if getattr(self.sniffer, 'filter_expr', None):
             LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 使用过滤表达式: {self.sniffer.filter_expr}")
@@ -270,12 +289,21 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         # 3. 启动 TrafficSniffer 线程
         self.sniffer.start_sniffer()
 
-        # 3.1 等待 Sniffer 真正就绪，避免遗漏最早的握手包
-        warmup_seconds = 0.5
-        if self.sniffer_config is not None:
-            warmup_seconds = self.sniffer_config.get('warmup_seconds', warmup_seconds)
+        # 3.1 等待 Sniffer 真正就绪，避免遗漏最早的握手包(共享抓包已经在运行, 不需要等待)
+        #     检测嗅探器的就绪信号(tcpdump/dumpcap 的输出或文件头, scapy 的 socket 打开), 最多等待 ready_timeout
+        if use_shared_capture:
+            return
+        ready_timeout = self.sniffer_config.get('ready_timeout', 5.0)
+        start_ts = time()
+        if self.sniffer.wait_until_ready(ready_timeout) is True:
+            LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] Sniffer 已就绪 ({time() - start_ts:.2f}s)")
+        else:
+            LogUtil().warning(self.task_name, f"[WebsiteCaptureThread] 未确认 Sniffer 就绪, 继续抓取(可能遗漏最早的包)")
+
+        # 3.2 额外的固定等待(可选, 默认不等待)
+        warmup_seconds = self.sniffer_config.get('warmup_seconds', 0)
         if warmup_seconds and warmup_seconds > 0:
-            LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 等待 Sniffer 就绪 {warmup_seconds}s")
+            LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 额外等待 {warmup_seconds}s")
             sleep(warmup_seconds)
 
         pass
@@ -326,6 +354,70 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
 
         pass
 
+
+    def __get_filter_config(self):
+        """
+        过滤配置(可选)
+            嗅探配置中的 compression 会合并进过滤配置, 过滤写出时直接压缩
+        :return: dict 或 None
+        """
+        if self.sniffer_config is None:
+            return None
+        filter_config = self.sniffer_config.get('filter_config')
+        compression = self.sniffer_config.get('compression')
+        if compression is not None:
+            filter_config = dict(filter_config or {})
+            filter_config.setdefault('compression', compression)
+        return filter_config
+
+
+    def __start_online_filter(self):
+        """
+        启动在线过滤(抓包的同时过滤, 抓包结束后不需要再完整读一遍 pcap)
+            只做连接匹配, 需要时间窗口/拆分/统计时仍使用离线过滤
+        :return:
+        """
+        filter_config = self.__get_filter_config()
+        if filter_config is None or filter_config.get('online', False) is False:
+            return
+        if self.sniffer is None or self.sniffer_conn_tracker_thread is None:
+            return
+        if self.rotated_filter is not None:
+            LogUtil().warning(self.task_name, f"[WebsiteCaptureThread] 轮转抓包时已经逐个分片过滤, 不启动在线过滤")
+            return
+        if filter_config.get('time_window') or filter_config.get('split_flows') or filter_config.get('stats') \
+                or filter_config.get('compression', 'none') != 'none':
+            LogUtil().warning(self.task_name, f"[WebsiteCaptureThread] 在线过滤不支持 time_window/split_flows/stats/compression, 使用离线过滤")
+            return
+
+        LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 正在启动在线过滤")
+        self.online_filter = OnlineConnectionsFilter(
+            task_name=self.task_name,
+            pcap_path=self.sniffer.get_pcap_path(),
+            tracker=self.sniffer_conn_tracker_thread,
+            lookback_seconds=filter_config.get('online_lookback_seconds', 2.0)
+        )
+        self.online_filter.start()
+
+    def __start_rotated_filter(self):
+        """
+        启动分片过滤(轮转抓包时, 抓包的同时逐个过滤已关闭的分片)
+            没有 ConnectionTracker 时也要启动, 抓包结束后由它把分片拼接回 pcap
+        :return:
+        """
+        if self.sniffer is None or self.sniffer.is_rotating() is False:
+            return
+
+        LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 正在启动分片过滤 (分片目录: {self.sniffer.chunk_dir})")
+        self.rotated_filter = RotatedCaptureFilter(
+            task_name=self.task_name,
+            sniffer=self.sniffer,
+            tracker=self.sniffer_conn_tracker_thread,
+            config=self.__get_filter_config(),
+            settle_seconds=self.sniffer.rotation.get('settle_seconds', 2.0)
+        )
+        self.rotated_filter.start()
+
     def __visit_website(self):
         """
         访问网站(启动request进程)
@@ -381,9 +473,39 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         pass
 
 
+    def __record_capture_stats(self):
+        """
+        记录嗅探器的抓包统计(抓到/收到/丢弃的包数), 写出到 pcap 旁的 <文件名>_capture_stats.json
+            有丢包时记录警告, 说明并发数或缓冲区大小(-B)需要调整
+        :return:
+        """
+        if self.sniffer is None:
+            return
+        self.capture_stats = self.sniffer.get_capture_stats()
+        if self.capture_stats is None:
+            return
+        self.capture_stats.capture_profile = str(self.sniffer.capture_profile)
+        if CaptureProfileUtil.needs_truncator(self.sniffer.capture_profile):
+            self.capture_stats.snaplen = self.sniffer.snaplen
+
+        pcap_path = Path(self.sniffer.get_pcap_path())
+        stats_path = pcap_path.with_name(f"{pcap_path.stem}_capture_stats.json")
+        try:
+            self.capture_stats.write_json(str(stats_path))
+        except OSError as e:
+            LogUtil().warning(self.task_name, f"[WebsiteCaptureThread] 写出抓包统计失败: {e}")
+
+        if self.capture_stats.dropped:
+            LogUtil().warning(self.task_name, f"[WebsiteCaptureThread] 抓包时有丢包: {self.capture_stats.to_dict()}")
+        else:
+            LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 抓包统计: {self.capture_stats}")
+
     def __wait_for_tail_capture(self):
         """
         额外的尾部捕获等待，用于尽量捕获 FIN/RST 等关闭包
+            固定等待 tail_capture_seconds: 此时 __wait_for_connections_quiet 已经等到没有活跃连接, 本机 close() 后连接也会马上从进程的连接表中消失,
+            连接表无法说明对端的 FIN/ACK/RST 已经到达, 不能据此提前结束(高延迟链路上会漏掉关闭包)
+            嗅探器停止时会先发送 SIGINT 等它把缓冲区写入文件(见 OuterSubProcessHelper.stop_signal), 这里不需要为写盘留时间
         :return:
         """
         tail_seconds = 1.0
@@ -440,9 +562,24 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         pass
 
 
+    def __apply_capture_profile(self):
+        """
+        按抓包模板截断 pcap(只有 tcpdump/dumpcap 的 headers+tls-handshake 需要, 其他情况写入时已截断)
+            截断会改变记录的偏移, 必须在在线过滤/分片拼接结束后、离线过滤(可能压缩)之前进行, 只执行一次
+        :return:
+        """
+        if self.__capture_profile_applied or self.sniffer is None:
+            return
+        self.__capture_profile_applied = True
+        if self.sniffer.needs_post_truncation():
+            CaptureProfileUtil.truncate_pcap(self.sniffer.get_pcap_path(), self.sniffer.capture_profile, self.task_name,
+                                             snaplen=self.sniffer.snaplen)
+
+
     def __filter_pcap(self):
         """
         根据ConnectionTracker跟踪的连接, 过滤pcap文件
+            有后台过滤进程池时, 只提交连接列表快照, 不等待过滤完成(结果见 filter_future)
             注: 如果是代理, 无需过滤
         :return:
         """
@@ -453,7 +590,18 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
 
         LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 正在过滤 pcap 文件")
 
+        # 轮转抓包: 分片在抓包期间已经过滤, 只需过滤剩余分片并拼接
+        #           需要完整文件的配置(统计/拆分/索引/压缩)再在拼接后的文件上过滤一遍
+        filter_config = self.__get_filter_config()
+        if self.rotated_filter is not None:
+            self.rotated_filter.finish()
+            self.__apply_capture_profile()
+            filter_config = self.rotated_filter.final_pass_config
+            if filter_config is None:
+                return
+
         if self.sniffer is None or self.sniffer_conn_tracker_thread is None:
+            self.__apply_capture_profile()
             LogUtil().warning(self.task_name, f"[WebsiteCaptureThread] 缺少 Sniffer 或 ConnectionTracker, 跳过过滤")
             return
 
@@ -461,8 +609,26 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         pcap_path = self.sniffer.get_pcap_path()
         conns = self.sniffer_conn_tracker_thread.get_connections_list()  # 只取Connection对象列表, 不要原dict
 
+        # 在线过滤已经处理了抓包期间的数据, 只需收尾
+        if self.online_filter is not None:
+            if self.online_filter.finish() is True:
+                self.__apply_capture_profile()
+                return
+            LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 在线过滤未完成, 改为离线过滤")
+
+        # 离线过滤前按抓包模板截断
+        self.__apply_capture_profile()
+
+        # 交给后台进程池过滤
+        if self.filter_worker_pool is not None:
+            self.filter_future = self.filter_worker_pool.submit(pcap_path=pcap_path,
+                                                                connections_list=conns,
+                                                                config=filter_config)
+            LogUtil().debug(self.task_name, f"[WebsiteCaptureThread] 已提交后台过滤: {pcap_path}")
+            return
+
         # 根据 TrafficSniffer 抓的包与连接列表, 过滤pcap文件
-        ConnectionsFilter.filter_pcap(pcap_path=pcap_path, connections_list=conns)
+        ConnectionsFilter.filter_pcap(pcap_path=pcap_path, connections_list=conns, config=filter_config)
         pass
 
 
@@ -482,8 +648,10 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         # 3. 创建请求线程(非阻塞)
         self.__create_request_thread()
 
-        # 4. 启动连接追踪(非阻塞)
+        # 4. 启动连接追踪(非阻塞), 需要时同时启动分片过滤/在线过滤
         self.__start_connection_tracker()
+        self.__start_rotated_filter()
+        self.__start_online_filter()
 
         # 5. 访问网站(阻塞)
         self.__visit_website()
@@ -497,8 +665,9 @@ class WebsiteSingleTabCaptureThread(CaptureThread):
         # 8. 额外尾部等待，捕获 FIN/RST
         self.__wait_for_tail_capture()
 
-        # 9. 关闭嗅探进程
+        # 9. 关闭嗅探进程, 记录抓包统计
         self.__stop_sniffer()
+        self.__record_capture_stats()
 
         # 10. 过滤pcap文件
         self.__filter_pcap()
@@ -0,0 +1,292 @@
+__doc__ = "离线批量重新过滤输出目录下的 pcap"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-14"
+
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List
+
+from tqdm import tqdm
+
+from core.filter.connections_filter import ConnectionsFilter
+from core.sniffer.connection.connection_tracker_thread import ConnectionTrackerThread
+from core.util.io.log_util import LogUtil
+from core.util.pcap.pcap_codec import PcapCodecUtil
+
+
+class BatchRefilter:
+    """
+    离线批量重新过滤
+        遍历输出目录(output_dir/<domain>/<direct|proxy>/.../<时间>/), 把每个 pcap 与 ConnectionTracker 保存的连接日志配对,
+        用进程池并行执行 ConnectionsFilter
+        每完成一个文件就追加一行到日志文件(jsonl), 中断后再次运行会跳过已成功的文件
+    """
+
+    JOURNAL_FILE_NAME = 'refilter_journal.jsonl'    # 断点续跑日志(放在输出目录下)
+
+    # 结果状态
+    STATUS_OK = 'ok'                # 过滤成功
+    STATUS_FAILED = 'failed'        # 过滤出错
+    STATUS_NO_LOG = 'no_log'        # 找不到连接日志
+    STATUS_SKIPPED = 'skipped'      # 之前已经成功过滤, 本次跳过
+
+    def __init__(self,
+                 output_dir: str,
+                 filter_config: dict = None,
+                 max_workers: int = None,
+                 restart: bool = False,
+                 logger_name: str = 'main'
+                 ):
+        """
+        :param output_dir: 输出主目录
+        :param filter_config: 传给 ConnectionsFilter 的过滤配置(可为None)
+        :param max_workers: 进程数(默认 CPU 核数)
+        :param restart: 是否忽略之前的进度, 全部重新过滤
+        :param logger_name: 日志记录器名称
+        """
+        self.output_dir = Path(output_dir)
+        self.filter_config = filter_config
+        self.max_workers = max_workers if max_workers else os.cpu_count()
+        self.restart = restart
+        self.logger_name = logger_name
+
+        self.journal_path = self.output_dir / BatchRefilter.JOURNAL_FILE_NAME
+
+
+    @staticmethod
+    def find_connection_log(pcap_path: Path):
+        """
+        找到与 pcap 配对的连接日志
+            WebsiteSingleTabCaptureThread 的命名规则:
+                pcap:     <domain>_<时间>.pcap
+                连接日志: <domain>_<pid>_<时间>.log
+            按规则找不到时, 退回到同目录下任意一个内容是连接列表的 .log/.json 文件
+        :param pcap_path: pcap 文件路径(可以是压缩文件)
+        :return: 连接日志路径, 找不到返回 None
+        """
+        directory = pcap_path.parent
+        time_str = directory.name
+        stem = PcapCodecUtil.strip_suffix(pcap_path).stem
+        candidates = []
+
+        # 1. 按命名规则查找
+        if stem.endswith(f"_{time_str}"):
+            domain = stem[:-len(time_str) - 1]
+            candidates += sorted(directory.glob(f"{glob.escape(domain)}_*_{glob.escape(time_str)}.log"))
+
+        # 2. 同目录下的其他日志
+        candidates += sorted(directory.glob("*.log")) + sorted(directory.glob("*.json"))
+
+        for candidate in candidates:
+            if BatchRefilter._is_connection_log(candidate):
+                return candidate
+        return None
+
+
+    @staticmethod
+    def _is_connection_log(file_path: Path) -> bool:
+        """
+        判断文件是否是 ConnectionTracker 保存的连接日志(JSON 列表)
+            代理等扩展的日志也会放在同一个目录, 需要区分
+        :param file_path: 文件路径
+        :return: bool
+        """
+        try:
+            with open(file_path, 'r') as file:
+                if file.read(1) != '[':
+                    return False
+                file.seek(0)
+                data = json.load(file)
+        except (OSError, ValueError, UnicodeDecodeError):
+            return False
+        if not isinstance(data, list):
+            return False
+        return len(data) == 0 or (isinstance(data[0], dict) and 'local' in data[0] and 'remote' in data[0])
+
+
+    def find_pairs(self) -> List[tuple]:
+        """
+        遍历输出目录, 找出所有 (pcap, 连接日志) 对(包括压缩的 pcap/pcapng)
+        :return: [(pcap 路径, 连接日志路径或None)]
+        """
+        pairs = []
+        pcap_paths = []
+        for suffix in [''] + PcapCodecUtil.get_suffixes():
+            pcap_paths += list(self.output_dir.rglob(f'*.pcap{suffix}')) + list(self.output_dir.rglob(f'*.pcapng{suffix}'))
+        for pcap_path in sorted(pcap_paths):
+            pairs.append((pcap_path, BatchRefilter.find_connection_log(pcap_path)))
+        return pairs
+
+
+    def _load_finished(self) -> set:
+        """
+        读取已成功过滤的文件
+        :return: pcap 相对路径集合
+        """
+        finished = set()
+        if self.restart or not self.journal_path.exists():
+            return finished
+        with open(self.journal_path, 'r') as file:
+            for line in file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # 上次中断时可能写了半行
+                    continue
+                if result.get('status') == BatchRefilter.STATUS_OK:
+                    finished.add(result.get('pcap'))
+                    # 压缩后文件名会变化
+                    if result.get('output') is not None:
+                        finished.add(result.get('output'))
+        return finished
+
+
+    @staticmethod
+    def _refilter_one(pcap_path: str, log_path: str, filter_config: dict) -> dict:
+        """
+        过滤单个 pcap(在子进程中执行)
+        :param pcap_path: pcap 文件路径
+        :param log_path: 连接日志路径
+        :param filter_config: 过滤配置
+        :return: 结果 dict
+        """
+        start_ts = time.time()
+        result = {
+            'status': BatchRefilter.STATUS_OK,
+            'connections': None,
+            'kept': None,
+            'total': None,
+            'output': None,
+            'seconds': None,
+            'error': None,
+        }
+        try:
+            conns = ConnectionTrackerThread.load_connections_from_file(log_path)
+            result['connections'] = len(conns)
+            conn_filter = ConnectionsFilter(pcap_path=pcap_path, connections_list=conns, config=filter_config)
+            result['kept'], result['total'] = conn_filter.filter()
+            if conn_filter.output_path is not None:
+                result['output'] = str(conn_filter.output_path)
+        except Exception as e:
+            result['status'] = BatchRefilter.STATUS_FAILED
+            result['error'] = f"{type(e).__name__}: {e}"
+        result['seconds'] = round(time.time() - start_ts, 3)
+        return result
+
+
+    def run(self) -> List[dict]:
+        """
+        执行批量过滤
+        :return: 每个文件的结果列表
+        """
+        pairs = self.find_pairs()
+        finished = self._load_finished()
+        LogUtil().debug(self.logger_name, f"[BatchRefilter] 共找到 {len(pairs)} 个 pcap, 之前已完成 {len(finished)} 个")
+
+        results = []
+        jobs = []
+        for pcap_path, log_path in pairs:
+            relative_pcap = str(pcap_path.relative_to(self.output_dir))
+            result = {'pcap': relative_pcap, 'log': None if log_path is None else str(log_path.relative_to(self.output_dir))}
+            if relative_pcap in finished:
+                result['status'] = BatchRefilter.STATUS_SKIPPED
+                results.append(result)
+            elif log_path is None:
+                result['status'] = BatchRefilter.STATUS_NO_LOG
+                results.append(result)
+            else:
+                jobs.append(result)
+
+        with open(self.journal_path, 'a') as journal, \
+                ProcessPoolExecutor(max_workers=self.max_workers) as executor, \
+                tqdm(total=len(jobs), desc='Refiltering', unit='file') as progress_bar:
+            futures = {}
+            for job in jobs:
+                future = executor.submit(BatchRefilter._refilter_one,
+                                         str(self.output_dir / job['pcap']),
+                                         str(self.output_dir / job['log']),
+                                         self.filter_config)
+                futures[future] = job
+
+            for future in as_completed(futures):
+                job = futures[future]
+                job.update(future.result())
+                if job.get('output') is not None:
+                    job['output'] = str(Path(job['output']).relative_to(self.output_dir))
+                results.append(job)
+
+                # 每完成一个就落盘, 中断后可以续跑
+                journal.write(json.dumps(job) + '\n')
+                journal.flush()
+
+                if job['status'] != BatchRefilter.STATUS_OK:
+                    progress_bar.write(f"[失败] {job['pcap']}: {job['error']}")
+                    LogUtil().warning(self.logger_name, f"[BatchRefilter] 过滤失败 {job['pcap']}: {job['error']}")
+                progress_bar.update(1)
+
+        return results
+
+
+    @staticmethod
+    def print_summary(results: List[dict]):
+        """
+        打印每个文件的结果和汇总
+        :param results: run 的返回值
+        :return:
+        """
+        counts = {}
+        kept_sum = 0
+        total_sum = 0
+        for result in sorted(results, key=lambda r: r['pcap']):
+            status = result['status']
+            counts[status] = counts.get(status, 0) + 1
+            if status == BatchRefilter.STATUS_OK:
+                kept_sum += result['kept'] or 0
+                total_sum += result['total'] or 0
+                print(f"[{status}] {result['pcap']} (连接数: {result['connections']}, "
+                      f"保留包数: {result['kept']}/{result['total']}, 耗时: {result['seconds']}s)")
+            elif status == BatchRefilter.STATUS_FAILED:
+                print(f"[{status}] {result['pcap']}: {result['error']}")
+            else:
+                print(f"[{status}] {result['pcap']}")
+
+        print(f"共 {len(results)} 个 pcap: " + ", ".join(f"{status}={count}" for status, count in counts.items()))
+        print(f"本次保留包数: {kept_sum}/{total_sum}")
+
+
+
+# 使用示例: python -m core.filter.batch_refilter output/ --workers 8 --engine numpy
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线批量重新过滤输出目录下的 pcap")
+    parser.add_argument('output_dir', help="输出主目录")
+    parser.add_argument('--workers', type=int, default=None, help="进程数(默认 CPU 核数)")
+    parser.add_argument('--engine', default=None, help="过滤引擎(scapy/raw/numpy/bpf)")
+    parser.add_argument('--output-mode', default=None, help="输出方式(rewrite/verbatim)")
+    parser.add_argument('--time-window', action='store_true', help="只保留落在连接存活时间内的包")
+    parser.add_argument('--time-window-slack', type=float, default=None, help="存活时间两端放宽的秒数")
+    parser.add_argument('--compression', default=None, help="输出的压缩格式(gzip/lzma/none, 默认与输入相同)")
+    parser.add_argument('--restart', action='store_true', help="忽略之前的进度, 全部重新过滤")
+    args = parser.parse_args()
+
+    config = {}
+    if args.engine is not None:
+        config['engine'] = args.engine
+    if args.output_mode is not None:
+        config['output_mode'] = args.output_mode
+    if args.time_window:
+        config['time_window'] = True
+    if args.time_window_slack is not None:
+        config['time_window_slack'] = args.time_window_slack
+    if args.compression is not None:
+        config['compression'] = args.compression
+
+    refilter = BatchRefilter(output_dir=args.output_dir,
+                             filter_config=config,
+                             max_workers=args.workers,
+                             restart=args.restart)
+    BatchRefilter.print_summary(refilter.run())
@@ -0,0 +1,98 @@
+__doc__ = "连接存活时间区间索引"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-16"
+
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, List
+
+from core.sniffer.connection.model.connection import Connection
+
+
+class ConnectionIntervalIndex:
+    """
+    连接存活时间区间索引
+        每个四元组(正反向各一份)对应一组按开始时间排序、互不重叠的时间区间
+        查询时在该四元组的区间里二分查找, 单次查询 O(log k), k 为该四元组的区间数
+        区间来自 ConnectionTracker 记录的 first_seen / last_seen / status_history, 两端各放宽 slack 秒:
+            - tracker 轮询发现连接前, SYN 等握手包已经发出
+            - 连接从进程里消失后, 仍可能有 FIN/ACK 等关闭包
+        追踪结束时仍处于活跃状态的连接, 区间没有结束时间
+    """
+
+    def __init__(self, connections_list: List[Connection], slack: float = 1.0):
+        """
+        :param connections_list: Connection 对象列表
+        :param slack: 区间两端放宽的秒数
+        """
+        self.slack = slack
+        # 四元组 -> (开始时间列表, 结束时间列表)
+        self._index: Dict[tuple, tuple] = {}
+        self._build(connections_list)
+
+
+    @staticmethod
+    def get_connection_interval(conn: Connection):
+        """
+        连接的存活时间区间(不含 slack)
+        :param conn: Connection
+        :return: (开始时间戳, 结束时间戳), 仍活跃的连接结束时间为 inf
+        """
+        start = conn.first_seen
+        end = conn.last_seen
+        for history in conn.status_history:
+            try:
+                timestamp = datetime.fromisoformat(history['timestamp']).timestamp()
+            except (KeyError, TypeError, ValueError):
+                continue
+            start = min(start, timestamp)
+            end = max(end, timestamp)
+
+        if conn.active:
+            end = float('inf')
+        return start, end
+
+
+    def _build(self, connections_list: List[Connection]):
+        """
+        建立索引
+        :param connections_list: Connection 对象列表
+        :return:
+        """
+        # 1. 收集每个四元组的区间
+        intervals = {}
+        for conn in connections_list:
+            start, end = ConnectionIntervalIndex.get_connection_interval(conn)
+            interval = (start - self.slack, end + self.slack)
+            forward = (conn.local_ip, conn.local_port, conn.remote_ip, conn.remote_port)
+            backward = (conn.remote_ip, conn.remote_port, conn.local_ip, conn.local_port)
+            intervals.setdefault(forward, []).append(interval)
+            intervals.setdefault(backward, []).append(interval)
+
+        # 2. 排序并合并重叠的区间, 保证结束时间也是递增的
+        for key, key_intervals in intervals.items():
+            key_intervals.sort()
+            starts = []
+            ends = []
+            for start, end in key_intervals:
+                if len(ends) > 0 and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._index[key] = (starts, ends)
+
+
+    def contains(self, key: tuple, timestamp: float) -> bool:
+        """
+        判断数据包是否落在四元组的存活区间内
+        :param key: (src_ip, src_port, dst_ip, dst_port)
+        :param timestamp: 数据包时间戳(秒)
+        :return: bool
+        """
+        entry = self._index.get(key)
+        if entry is None:
+            return False
+        starts, ends = entry
+        position = bisect_right(starts, timestamp) - 1
+        return position >= 0 and timestamp <= ends[position]
@@ -0,0 +1,160 @@
+__doc__ = "过滤时统计每个连接的流量"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-19"
+
+import csv
+import json
+from typing import List
+
+from core.sniffer.connection.model.connection import Connection
+from core.util.pcap.packet_key_util import PacketKeyUtil
+
+
+class ConnectionStatsCollector:
+    """
+    过滤时统计每个连接的流量
+        在过滤遍历每个包的同一个循环里累加, 不需要再重新扫描 pcap
+        每个连接统计两个方向(out: local→remote, in: remote→local)的包数和字节数(按线上原始长度),
+        首末包时间戳, 以及 SYN/FIN/RST 包数; 另外统计未保留(丢弃)的包数和字节数
+    """
+
+    CSV_FIELDS = ['connection', 'local_ip', 'local_port', 'remote_ip', 'remote_port',
+                  'out_packets', 'out_bytes', 'in_packets', 'in_bytes',
+                  'first_packet_ts', 'last_packet_ts', 'syn', 'fin', 'rst',
+                  'total_packets', 'total_bytes']
+    DROPPED_ROW_NAME = '(dropped)'      # CSV 中丢弃流量汇总行的连接名
+
+    def __init__(self, connections_list: List[Connection]):
+        """
+        :param connections_list: Connection 对象列表
+        """
+        self._stats = {}        # Connection.key -> 统计
+        self._directions = {}   # 四元组 -> (Connection.key, 方向)
+        for conn in connections_list:
+            if conn.key not in self._stats:
+                self._stats[conn.key] = {
+                    'connection': conn.key,
+                    'local': {'ip': conn.local_ip, 'port': conn.local_port},
+                    'remote': {'ip': conn.remote_ip, 'port': conn.remote_port},
+                    'out': {'packets': 0, 'bytes': 0},
+                    'in': {'packets': 0, 'bytes': 0},
+                    'first_packet_ts': None,
+                    'last_packet_ts': None,
+                    'syn': 0,
+                    'fin': 0,
+                    'rst': 0,
+                }
+            self._directions[(conn.local_ip, conn.local_port, conn.remote_ip, conn.remote_port)] = (conn.key, 'out')
+            self._directions[(conn.remote_ip, conn.remote_port, conn.local_ip, conn.local_port)] = (conn.key, 'in')
+
+        self.kept = {'packets': 0, 'bytes': 0}
+        self.dropped = {'packets': 0, 'bytes': 0}
+
+
+    def add_kept(self, key: tuple, timestamp, length: int, tcp_flags=None):
+        """
+        统计一个保留的包
+        :param key: 数据包四元组
+        :param timestamp: 时间戳(秒), 可为None
+        :param length: 包长度(字节)
+        :param tcp_flags: TCP 标志位, 不是 TCP 时为None
+        :return:
+        """
+        self.kept['packets'] += 1
+        self.kept['bytes'] += length
+
+        direction = self._directions.get(key)
+        if direction is None:
+            return
+        flow_key, flow_direction = direction
+        stats = self._stats[flow_key]
+        stats[flow_direction]['packets'] += 1
+        stats[flow_direction]['bytes'] += length
+
+        if timestamp is not None:
+            if stats['first_packet_ts'] is None or timestamp < stats['first_packet_ts']:
+                stats['first_packet_ts'] = timestamp
+            if stats['last_packet_ts'] is None or timestamp > stats['last_packet_ts']:
+                stats['last_packet_ts'] = timestamp
+
+        if tcp_flags is not None:
+            if tcp_flags & PacketKeyUtil.TCP_FLAG_SYN:
+                stats['syn'] += 1
+            if tcp_flags & PacketKeyUtil.TCP_FLAG_FIN:
+                stats['fin'] += 1
+            if tcp_flags & PacketKeyUtil.TCP_FLAG_RST:
+                stats['rst'] += 1
+
+
+    def add_dropped(self, length: int):
+        """
+        统计一个未保留的包
+        :param length: 包长度(字节)
+        :return:
+        """
+        self.dropped['packets'] += 1
+        self.dropped['bytes'] += length
+
+
+    def to_dict(self, source_name: str = None) -> dict:
+        """
+        统计结果
+        :param source_name: 源文件名
+        :return: dict
+        """
+        return {
+            'source': source_name,
+            'total': {
+                'packets': self.kept['packets'] + self.dropped['packets'],
+                'bytes': self.kept['bytes'] + self.dropped['bytes'],
+            },
+            'kept': self.kept,
+            'dropped': self.dropped,
+            'connections': list(self._stats.values()),
+        }
+
+
+    def write_json(self, file_path: str, source_name: str = None):
+        """
+        写出 JSON
+        :param file_path: 文件路径
+        :param source_name: 源文件名
+        :return:
+        """
+        with open(file_path, 'w') as file:
+            json.dump(self.to_dict(source_name), file, indent=2)
+
+
+    def write_csv(self, file_path: str):
+        """
+        写出 CSV(每个连接一行, 最后一行是丢弃流量的汇总)
+        :param file_path: 文件路径
+        :return:
+        """
+        with open(file_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=ConnectionStatsCollector.CSV_FIELDS)
+            writer.writeheader()
+            for stats in self._stats.values():
+                writer.writerow({
+                    'connection': stats['connection'],
+                    'local_ip': stats['local']['ip'],
+                    'local_port': stats['local']['port'],
+                    'remote_ip': stats['remote']['ip'],
+                    'remote_port': stats['remote']['port'],
+                    'out_packets': stats['out']['packets'],
+                    'out_bytes': stats['out']['bytes'],
+                    'in_packets': stats['in']['packets'],
+                    'in_bytes': stats['in']['bytes'],
+                    'first_packet_ts': stats['first_packet_ts'],
+                    'last_packet_ts': stats['last_packet_ts'],
+                    'syn': stats['syn'],
+                    'fin': stats['fin'],
+                    'rst': stats['rst'],
+                    'total_packets': stats['out']['packets'] + stats['in']['packets'],
+                    'total_bytes': stats['out']['bytes'] + stats['in']['bytes'],
+                })
+            writer.writerow({
+                'connection': ConnectionStatsCollector.DROPPED_ROW_NAME,
+                'total_packets': self.dropped['packets'],
+                'total_bytes': self.dropped['bytes'],
+            })
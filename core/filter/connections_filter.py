@@ -3,6 +3,7 @@ __author__="Li Qingyun"
 __date__="2025-03-07"
 
 import stat
+from contextlib import nullcontext
 
 from scapy.all import *
 from scapy.layers.inet import TCP, UDP, IP
@@ -12,30 +13,145 @@ from typing import List
 
 from scapy.layers.l2 import Ether
 
+from core.filter.connection_interval_index import ConnectionIntervalIndex
+from core.filter.connection_stats_collector import ConnectionStatsCollector
+from core.filter.const.filter_engine_type import FilterEngineType
+from core.filter.const.filter_output_mode import FilterOutputMode
 from core.sniffer.connection.model.connection import Connection
 from core.util.io.log_util import LogUtil
+from core.util.pcap.packet_key_util import PacketKeyUtil
+from core.util.pcap.pcap_codec import PcapCodecUtil
+from core.util.pcap.pcap_flow_index import PcapFlowIndex, PcapFlowIndexWriter
+from core.util.pcap.pcap_flow_splitter import PcapFlowSplitter
+from core.util.pcap.pcap_range_writer import PcapRangeWriter
+from core.util.pcap.pcap_repair_util import PcapRepairUtil
+from core.util.pcap.pcap_record_reader import PcapRecordReader, PCAP_GLOBAL_HEADER_LEN, PCAP_RECORD_HEADER_LEN
+from core.util.pcap.pcapng_block_reader import PcapngBlockReader
 
 
 class ConnectionsFilter:
-    def __init__(self, pcap_path: str, connections_list: List[Connection]):
+    def __init__(self, pcap_path: str, connections_list: List[Connection], config: dict = None):
         """
         :param pcap_path: 要过滤的 pcap 文件路径
         :param connections_list: Connection 对象列表
+        :param config: 过滤配置(可为None)
+                        - engine: 过滤引擎(FilterEngineType 或其字符串值, 默认 raw)
+                        - streaming: scapy 引擎是否使用流式过滤(默认 True, 内存占用与 pcap 大小无关)
+                        - output_mode: 输出方式(FilterOutputMode 或其字符串值, 默认 rewrite)
+                                       verbatim 时按字节区间原样复制命中的记录, 保留原始链路层类型
+                        - bpf_max_expr_length: bpf 引擎单个表达式的最大长度(默认 8192), 超过后拆分成多段过滤
+                        - time_window: 是否只保留落在连接存活时间内的包(默认 False)
+                        - time_window_slack: 存活时间两端放宽的秒数(默认 1.0)
+                        - split_flows: 过滤的同时按连接拆分成多个 pcap(默认 False, 使用 raw 引擎)
+                        - split_dir: 拆分输出目录(默认 pcap 同目录下的 <文件名>_flows)
+                        - split_max_open_files: 拆分时同时打开的文件数上限(默认 64)
+                        - stats: 过滤的同时统计每个连接的流量, 写出到 pcap 旁的 <文件名>_stats.json/csv(默认 False)
+                        - stats_format: 统计文件格式 json / csv / both(默认 json)
+                        - flow_index: 过滤的同时建立连接索引, 写出到 pcap 旁的 <文件名>_flow_index.bin(默认 False, 使用 raw 引擎)
+                        - flow_index_bucket_seconds: 索引时间表每个桶的秒数(默认 1.0)
+                        - repair: 过滤前是否检测并截断末尾不完整的记录(默认 True, 嗅探器被结束时最后一条记录可能只写了一半)
+                        - compression: 输出的压缩格式 gzip / lzma / none(默认与输入相同), 压缩时输出为 <文件名>.gz/.xz 并删除原文件
         """
         self.pcap_path = Path(pcap_path)
+        self._plain_path = PcapCodecUtil.strip_suffix(self.pcap_path)     # 去掉压缩后缀的路径
         self.connections = connections_list
         self._connection_set = self._build_connection_set()
 
+        # 过滤配置
+        if config is None:
+            config = {}
+        self.engine = FilterEngineType(config.get('engine', FilterEngineType.RAW))
+        self.streaming = config.get('streaming', True)
+        self.output_mode = FilterOutputMode(config.get('output_mode', FilterOutputMode.REWRITE))
+        self.bpf_max_expr_length = config.get('bpf_max_expr_length', 8192)
+
+        # 时间窗口匹配: 同一四元组在连接存活时间之外的包(如其他进程复用了相同端口)不保留
+        self._interval_index = None
+        if config.get('time_window', False) is True:
+            self._interval_index = ConnectionIntervalIndex(self.connections, slack=config.get('time_window_slack', 1.0))
+
+        # 按连接拆分
+        self.split_flows = config.get('split_flows', False)
+        self.split_dir = config.get('split_dir', str(self.pcap_path.with_name(f"{self._plain_path.stem}_flows")))
+        self.split_max_open_files = config.get('split_max_open_files', PcapFlowSplitter.DEFAULT_MAX_OPEN_FILES)
+
+        # 连接流量统计(在过滤的同一次遍历中收集)
+        self._stats = ConnectionStatsCollector(self.connections) if config.get('stats', False) is True else None
+        self.stats_format = config.get('stats_format', 'json')
+
+        # 连接索引(在过滤的同一次遍历中建立, 记录每个连接的记录在输出文件中的偏移)
+        self.flow_index = config.get('flow_index', False)
+        self.flow_index_bucket_seconds = config.get('flow_index_bucket_seconds', PcapFlowIndexWriter.DEFAULT_BUCKET_SECONDS)
+
+        # 过滤前修复被截断的文件
+        self.repair = config.get('repair', True)
+
+        # 压缩输出(过滤写出时直接压缩, 不需要再写一遍文件)
+        self.compression = config.get('compression')
+        PcapCodecUtil.get_codec(self.compression)   # 提前检查压缩格式是否支持
+
+        # 过滤结果
+        self.kept_count = None      # 保留包数
+        self.total_count = None     # 读取包数
+        self.output_path = None     # 输出文件路径(压缩格式变化时与 pcap_path 不同)
+        self.repaired_bytes = 0     # 修复时截断的字节数
+
 
     @staticmethod
-    def filter_pcap(pcap_path: str, connections_list: List[Connection]):
+    def filter_pcap(pcap_path: str, connections_list: List[Connection], config: dict = None):
         """
         外部可以直接调用这个静态方法：过滤 pcap 文件
         :param pcap_path: 要过滤的 pcap 文件路径
         :param connections_list: Connection 对象列表
+        :param config: 过滤配置(可为None)
+        :return: (保留包数, 读取包数)
         """
-        conn_filter = ConnectionsFilter(pcap_path, connections_list)
-        conn_filter.filter_and_overwrite()
+        conn_filter = ConnectionsFilter(pcap_path, connections_list, config)
+        return conn_filter.filter()
+
+
+    def filter(self):
+        """
+        按配置选择过滤引擎, 执行过滤并覆盖原始文件
+        :return: (保留包数, 读取包数)
+        """
+        if self.repair is True:
+            # 只读记录头, 耗时与记录数成正比
+            repaired = PcapRepairUtil.repair(str(self.pcap_path))
+            if repaired is not None:
+                self.repaired_bytes = repaired[1]
+
+        if (self.split_flows is True or self.flow_index is True) and self.engine != FilterEngineType.RAW:
+            # 拆分和建立索引需要逐条拿到记录和四元组, 由 raw 引擎完成
+            LogUtil().debug('main', f"[ConnectionsFilter] 按连接拆分/建立连接索引只支持 raw 引擎, 使用 raw 引擎")
+            self.filter_and_overwrite_raw()
+        elif self._stats is not None and self.engine in (FilterEngineType.NUMPY, FilterEngineType.BPF):
+            # 统计需要在逐包遍历中收集, numpy/bpf 引擎没有逐包的循环
+            LogUtil().debug('main', f"[ConnectionsFilter] 流量统计不支持 {self.engine} 引擎, 使用 raw 引擎")
+            self.filter_and_overwrite_raw()
+        elif self._is_compressed_io() and self.engine in (FilterEngineType.NUMPY, FilterEngineType.BPF):
+            # mmap 和 tcpdump 都只能处理未压缩的文件
+            LogUtil().debug('main', f"[ConnectionsFilter] 压缩文件不支持 {self.engine} 引擎, 使用 raw 引擎")
+            self.filter_and_overwrite_raw()
+        elif self.engine == FilterEngineType.BPF:
+            self.filter_and_overwrite_bpf()
+        elif self.engine == FilterEngineType.NUMPY:
+            self.filter_and_overwrite_numpy()
+        elif self.engine == FilterEngineType.RAW:
+            self.filter_and_overwrite_raw()
+        elif self.output_mode == FilterOutputMode.VERBATIM:
+            # scapy 读取时拿不到记录在文件中的偏移, 原样输出由 raw 引擎完成
+            LogUtil().debug('main', f"[ConnectionsFilter] 原样输出不支持 scapy 引擎, 使用 raw 引擎")
+            self.filter_and_overwrite_raw()
+        elif self.streaming is True:
+            self.filter_and_overwrite_streaming()
+        else:
+            self.filter_and_overwrite()
+
+        if self._stats is not None:
+            self._write_stats()
+
+        return self.kept_count, self.total_count
 
 
     def _build_connection_set(self) -> set:
@@ -65,6 +181,20 @@ class ConnectionsFilter:
         return conn_set
 
 
+    def _is_kept(self, key: tuple, timestamp: float) -> bool:
+        """
+        判断数据包是否保留
+        :param key: 数据包四元组
+        :param timestamp: 数据包时间戳(秒), 仅在时间窗口匹配时使用(为None表示没有时间戳, 不检查)
+        :return: bool
+        """
+        if key not in self._connection_set:
+            return False
+        if self._interval_index is None or timestamp is None:
+            return True
+        return self._interval_index.contains(key, timestamp)
+
+
     def _get_packet_key(self, pkt: Packet) -> tuple:
         """
         从数据包提取四元组
@@ -111,13 +241,16 @@ class ConnectionsFilter:
     def filter_and_overwrite(self):
         """执行过滤并覆盖原始文件"""
         # 读取原始数据包
-        packets = rdpcap(str(self.pcap_path))
+        packets = rdpcap(PcapCodecUtil.open_file(str(self.pcap_path)))
 
         # 过滤数据包
         filtered = []
         for pkt in packets:
             key = self._get_packet_key(pkt)
-            if key and key in self._connection_set:
+            kept = self._is_kept(key, float(pkt.time))
+            if self._stats is not None:
+                self._collect_scapy_stats(kept, key, pkt)
+            if kept:
                 # 确保数据包包含链路层类型
                 if not pkt.haslayer(Ether):
                     pkt = Ether() / pkt  # 添加 Ether 层
@@ -125,7 +258,419 @@ class ConnectionsFilter:
 
         # 安全写入临时文件
         temp_path = self.pcap_path.with_suffix(".tmp")
-        wrpcap(str(temp_path), filtered, linktype=1)
+        wrpcap(self._open_output(temp_path), filtered, linktype=1)
+
+        # 用临时文件替换原文件
+        self._replace_with_temp_file(temp_path, kept_count=len(filtered), total_count=len(packets))
+
+
+    def filter_and_overwrite_streaming(self):
+        """
+        流式过滤并覆盖原始文件
+            逐包读取(PcapReader), 命中的包立即写入临时文件(PcapWriter)
+            不再把整个 pcap 读入内存, 内存占用与 pcap 大小无关
+        """
+        temp_path = self.pcap_path.with_suffix(".tmp")
+
+        total_count = 0     # 读取的包数
+        kept_count = 0      # 保留的包数
+        with PcapReader(PcapCodecUtil.open_file(str(self.pcap_path))) as reader, \
+                PcapWriter(self._open_output(temp_path), linktype=1, sync=False) as writer:
+            for pkt in reader:
+                total_count += 1
+                key = self._get_packet_key(pkt)
+                kept = self._is_kept(key, float(pkt.time))
+                if self._stats is not None:
+                    self._collect_scapy_stats(kept, key, pkt)
+                if kept:
+                    # 确保数据包包含链路层类型
+                    if not pkt.haslayer(Ether):
+                        pkt = Ether() / pkt  # 添加 Ether 层
+                    writer.write(pkt)
+                    kept_count += 1
+
+        # 用临时文件替换原文件
+        self._replace_with_temp_file(temp_path, kept_count=kept_count, total_count=total_count)
+
+
+    def filter_and_overwrite_raw(self):
+        """
+        快速流式过滤并覆盖原始文件
+            直接读取 pcap 记录的原始字节, 按固定偏移提取四元组(PacketKeyUtil), 不解析整个包
+            原始字节无法解析的包回退到 scapy
+            rewrite 输出: 以太网记录原样写出, 其他链路层的记录仍然补上 Ether 层(与 scapy 路径输出一致)
+            verbatim 输出: 保留原始全局头, 按字节区间复制命中的记录(PcapRangeWriter), 不重新编码
+            split_flows: 同一次遍历中把命中的记录原样写入每个连接各自的 pcap(PcapFlowSplitter)
+            flow_index: 同一次遍历中记录每条输出记录的连接、偏移和时间戳, 写出连接索引(PcapFlowIndexWriter)
+            pcapng 由 filter_and_overwrite_pcapng 处理, 其他格式回退到 scapy 流式过滤
+        """
+        if not PcapRecordReader.is_pcap_file(str(self.pcap_path)):
+            if PcapngBlockReader.is_pcapng_file(str(self.pcap_path)):
+                self.filter_and_overwrite_pcapng()
+                return
+            LogUtil().debug('main', f"[ConnectionsFilter] {self.pcap_path} 不是经典 pcap 格式, 回退到 scapy 流式过滤")
+            if self.split_flows is True or self.flow_index is True:
+                LogUtil().warning('main', f"[ConnectionsFilter] {self.pcap_path} 不是经典 pcap 格式, 不按连接拆分/建立连接索引")
+            self.filter_and_overwrite_streaming()
+            return
+
+        temp_path = self.pcap_path.with_suffix(".tmp")
+
+        total_count = 0     # 读取的包数
+        kept_count = 0      # 保留的包数
+        verbatim = self.output_mode == FilterOutputMode.VERBATIM
+        flow_key_map = self._build_flow_key_map() if self.split_flows is True or self.flow_index is True else None
+        index_writer = PcapFlowIndexWriter(self.flow_index_bucket_seconds) if self.flow_index is True else None
+        output_offset = PCAP_GLOBAL_HEADER_LEN  # 下一条输出记录在输出文件中的偏移(两种输出的全局头都是 24 字节)
+        with PcapRecordReader(str(self.pcap_path)) as reader, \
+                self._open_raw_writer(reader, temp_path) as writer, \
+                self._open_flow_splitter(reader) as splitter:
+            link_type = reader.link_type
+            for record in reader:
+                total_count += 1
+
+                pkt = None
+                key = PacketKeyUtil.extract_key(link_type, record.data)
+                if key is None:
+                    # 原始字节解析失败, 回退到 scapy
+                    pkt = self._dissect_record(link_type, record.data)
+                    key = self._get_packet_key(pkt)
+
+                timestamp = reader.timestamp_of(record)
+                kept = self._is_kept(key, timestamp)
+                if self._stats is not None:
+                    self._collect_raw_stats(kept, key, timestamp, record.wirelen, link_type, record.data)
+                if not kept:
+                    continue
+
+                if splitter is not None:
+                    # 原样写入连接各自的文件
+                    splitter.write(flow_key_map[key], reader.pack_record_header(record), record.data)
+
+                output_length = record.length
+                if verbatim:
+                    # 原样复制记录头和数据
+                    writer.add_range(record.offset, record.length)
+                elif link_type == PacketKeyUtil.LINKTYPE_ETHERNET:
+                    # 以太网记录直接写出原始字节, 不重新编码
+                    writer.write_packet(record.data, sec=record.ts_sec, usec=record.ts_frac,
+                                        caplen=record.caplen, wirelen=record.wirelen)
+                else:
+                    if pkt is None:
+                        pkt = self._dissect_record(link_type, record.data)
+                    # 确保数据包包含链路层类型
+                    if not pkt.haslayer(Ether):
+                        pkt = Ether() / pkt  # 添加 Ether 层
+                    # 先编码成字节, 以便得到输出记录的长度
+                    pkt_bytes = bytes(pkt)
+                    writer.write_packet(pkt_bytes, sec=record.ts_sec, usec=record.ts_frac)
+                    output_length = PCAP_RECORD_HEADER_LEN + len(pkt_bytes)
+
+                if index_writer is not None:
+                    index_writer.add(flow_key_map[key], output_offset, output_length, timestamp)
+                output_offset += output_length
+                kept_count += 1
+
+        # 用临时文件替换原文件
+        self._replace_with_temp_file(temp_path, kept_count=kept_count, total_count=total_count)
+
+        if index_writer is not None:
+            index_path = PcapFlowIndex.get_index_path(self.pcap_path)
+            index_writer.write(str(index_path))
+            LogUtil().debug('main', f"[ConnectionsFilter] 已写出连接索引: {index_path} (记录数: {index_writer.record_count})")
+
+
+    def filter_and_overwrite_pcapng(self):
+        """
+        pcapng 按块过滤并覆盖原始文件
+            PcapngBlockReader 逐块读取, 每个数据包按其接口的链路层类型提取四元组、按接口的时间戳精度计算时间戳
+            SHB/IDB/NRB/ISB 及注释等非数据包块全部保留, 命中的数据包块(EPB 等)按字节区间原样复制(PcapRangeWriter), 不重新编码
+            输出始终是 pcapng(与 output_mode 无关), 多接口和各接口的链路层类型都不变
+            注: 暂不支持按连接拆分
+        """
+        if self.split_flows is True or self.flow_index is True:
+            LogUtil().warning('main', f"[ConnectionsFilter] {self.pcap_path} 是 pcapng 格式, 不按连接拆分/建立连接索引")
+
+        temp_path = self.pcap_path.with_suffix(".tmp")
+
+        total_count = 0     # 读取的包数
+        kept_count = 0      # 保留的包数
+        with PcapngBlockReader(str(self.pcap_path)) as reader, \
+                PcapRangeWriter(str(self.pcap_path), str(temp_path), b'', codec=self._get_output_codec()) as writer:
+            for block in reader:
+                # 非数据包块原样保留
+                if not block.is_packet:
+                    writer.add_range(block.offset, block.length)
+                    continue
+                total_count += 1
+
+                key = None
+                if block.link_type is not None:
+                    key = PacketKeyUtil.extract_key(block.link_type, block.data)
+                    if key is None:
+                        # 原始字节解析失败, 回退到 scapy
+                        key = self._get_raw_packet_key_by_scapy(block.link_type, block.data)
+
+                kept = self._is_kept(key, block.timestamp)
+                if self._stats is not None:
+                    self._collect_raw_stats(kept, key, block.timestamp, block.wirelen, block.link_type, block.data)
+                if not kept:
+                    continue
+
+                writer.add_range(block.offset, block.length)
+                kept_count += 1
+
+            if reader.truncated:
+                LogUtil().warning('main', f"[ConnectionsFilter] {self.pcap_path} 末尾有不完整的块, 已丢弃")
+
+        # 用临时文件替换原文件
+        self._replace_with_temp_file(temp_path, kept_count=kept_count, total_count=total_count)
+
+
+    def _collect_raw_stats(self, kept: bool, key: tuple, timestamp, length: int, link_type: int, data: bytes):
+        """
+        统计一个原始记录(raw 引擎)
+        :param kept: 是否保留
+        :param key: 四元组
+        :param timestamp: 时间戳
+        :param length: 线上原始长度
+        :param link_type: 链路层类型
+        :param data: 记录数据
+        :return:
+        """
+        if kept:
+            self._stats.add_kept(key, timestamp, length, PacketKeyUtil.get_tcp_flags(link_type, data))
+        else:
+            self._stats.add_dropped(length)
+
+
+    def _collect_scapy_stats(self, kept: bool, key: tuple, pkt: Packet):
+        """
+        统计一个 scapy 数据包(scapy 引擎)
+        :param kept: 是否保留
+        :param key: 四元组
+        :param pkt: scapy Packet
+        :return:
+        """
+        length = getattr(pkt, 'wirelen', None) or len(pkt)
+        if kept:
+            tcp_flags = int(pkt[TCP].flags) if pkt.haslayer(TCP) else None
+            self._stats.add_kept(key, float(pkt.time), length, tcp_flags)
+        else:
+            self._stats.add_dropped(length)
+
+
+    def _write_stats(self):
+        """
+        写出连接流量统计文件
+        :return:
+        """
+        # 文件名中常带有域名(含 '.'), 不能用 with_suffix
+        stats_name = f"{self._plain_path.stem}_stats"
+        source_path = self.output_path if self.output_path is not None else self.pcap_path
+        if self.stats_format in ('json', 'both'):
+            self._stats.write_json(str(self.pcap_path.with_name(f"{stats_name}.json")), source_name=source_path.name)
+        if self.stats_format in ('csv', 'both'):
+            self._stats.write_csv(str(self.pcap_path.with_name(f"{stats_name}.csv")))
+        LogUtil().debug('main', f"[ConnectionsFilter] 已写出连接流量统计: {self.pcap_path.with_name(stats_name)}")
+
+
+    def _open_raw_writer(self, reader: PcapRecordReader, temp_path: Path):
+        """
+        按输出方式创建 raw 引擎的写入器
+        :param reader: 源文件的 PcapRecordReader
+        :param temp_path: 临时文件路径
+        :return: PcapRangeWriter(verbatim) 或 PcapWriter(rewrite)
+        """
+        if self.output_mode == FilterOutputMode.VERBATIM:
+            return PcapRangeWriter(str(self.pcap_path), str(temp_path), reader.global_header,
+                                   codec=self._get_output_codec())
+
+        writer = PcapWriter(self._open_output(temp_path), linktype=1, nano=reader.nano, sync=False)
+        # write_packet 不会自动写全局头, 这里先写入
+        writer.write_header(None)
+        return writer
+
+
+    def _get_output_codec(self):
+        """
+        输出文件的压缩编解码器
+        :return: PcapCodec, 不压缩返回 None
+        """
+        if self.compression is None:
+            # 未配置时保持输入的压缩格式
+            return PcapCodecUtil.detect_codec(str(self.pcap_path))
+        return PcapCodecUtil.get_codec(self.compression)
+
+
+    def _get_output_path(self) -> Path:
+        """
+        输出文件路径: 去掉原压缩后缀, 加上输出的压缩后缀, 例: a.pcap -> a.pcap.gz
+        :return: Path
+        """
+        codec = self._get_output_codec()
+        if codec is None:
+            return self._plain_path
+        return self._plain_path.with_name(self._plain_path.name + codec.suffix)
+
+
+    def _is_compressed_io(self) -> bool:
+        """
+        输入或输出是否是压缩文件
+        :return: bool
+        """
+        return PcapCodecUtil.detect_codec(str(self.pcap_path)) is not None or self._get_output_codec() is not None
+
+
+    def _open_output(self, temp_path: Path):
+        """
+        打开 scapy 写入器的输出(需要压缩时返回边写边压缩的文件对象)
+        :param temp_path: 临时文件路径
+        :return: 文件路径或文件对象
+        """
+        codec = self._get_output_codec()
+        if codec is None:
+            return str(temp_path)
+        return codec.open(str(temp_path), 'wb')
+
+
+    def _open_flow_splitter(self, reader: PcapRecordReader):
+        """
+        创建按连接拆分的写入器
+        :param reader: 源文件的 PcapRecordReader
+        :return: PcapFlowSplitter, 不拆分时返回空的上下文
+        """
+        if self.split_flows is not True:
+            return nullcontext(None)
+        return PcapFlowSplitter(output_dir=self.split_dir,
+                                global_header=reader.global_header,
+                                source_name=self.pcap_path.name,
+                                max_open_files=self.split_max_open_files)
+
+
+    def _build_flow_key_map(self) -> dict:
+        """
+        四元组(正反向) -> Connection.key, 按连接拆分时用于确定文件
+        :return: dict
+        """
+        flow_key_map = {}
+        for conn in self.connections:
+            flow_key_map[(conn.local_ip, conn.local_port, conn.remote_ip, conn.remote_port)] = conn.key
+            flow_key_map[(conn.remote_ip, conn.remote_port, conn.local_ip, conn.local_port)] = conn.key
+        return flow_key_map
+
+
+    def filter_and_overwrite_numpy(self):
+        """
+        向量化过滤并覆盖原始文件
+            mmap 映射 pcap, 用 NumPy 一次性取出所有包的 ip/端口列并与连接集合匹配(NumpyFilterEngine)
+            命中的记录按字节区间原样复制, 保留原始全局头和链路层类型(始终是 verbatim 输出)
+            注: 仅支持未压缩的经典 pcap, 其他格式交给 raw 引擎(pcapng 按块过滤, 其余回退到 scapy 流式过滤); 没有安装 numpy 时回退到 raw 引擎
+        """
+        if self._is_compressed_io() or not PcapRecordReader.is_pcap_file(str(self.pcap_path)):
+            self.filter_and_overwrite_raw()
+            return
+
+        try:
+            from core.filter.engine.numpy_filter_engine import NumpyFilterEngine
+        except ImportError:
+            LogUtil().warning('main', f"[ConnectionsFilter] 未安装 numpy, 回退到 raw 引擎")
+            self.filter_and_overwrite_raw()
+            return
+
+        temp_path = self.pcap_path.with_suffix(".tmp")
+        engine = NumpyFilterEngine(pcap_path=str(self.pcap_path),
+                                   connection_set=self._connection_set,
+                                   fallback_key_func=self._get_raw_packet_key_by_scapy,
+                                   interval_index=self._interval_index)
+        kept_count, total_count = engine.filter_to(str(temp_path))
+
+        # 用临时文件替换原文件
+        self._replace_with_temp_file(temp_path, kept_count=kept_count, total_count=total_count)
+
+
+    def filter_and_overwrite_bpf(self):
+        """
+        BPF 过滤并覆盖原始文件
+            把连接列表编译成 BPF 表达式, 由 tcpdump -r/-w 在内核同款的 BPF 虚拟机里匹配, 不经过 Python(BpfFilterEngine)
+            tcpdump 原样写出命中的记录, 保留原始链路层类型(始终是 verbatim 输出)
+            注: 找不到 tcpdump 或 tcpdump 执行失败时回退到 raw 引擎; 连接列表为空、启用时间窗口匹配或读写压缩文件时同样交给 raw 引擎
+        """
+        if len(self._connection_set) == 0 or self._is_compressed_io():
+            # 空表达式会匹配所有包, 不能交给 tcpdump
+            self.filter_and_overwrite_raw()
+            return
+
+        if self._interval_index is not None:
+            # BPF 表达式无法表示每个连接的时间窗口
+            LogUtil().debug('main', f"[ConnectionsFilter] 时间窗口匹配不支持 bpf 引擎, 使用 raw 引擎")
+            self.filter_and_overwrite_raw()
+            return
+
+        from core.filter.engine.bpf_filter_engine import BpfFilterEngine
+
+        try:
+            engine = BpfFilterEngine(pcap_path=str(self.pcap_path),
+                                     connections_list=self.connections,
+                                     max_expr_length=self.bpf_max_expr_length)
+        except FileNotFoundError as e:
+            LogUtil().warning('main', f"[ConnectionsFilter] 找不到 tcpdump, 回退到 raw 引擎: {e}")
+            self.filter_and_overwrite_raw()
+            return
+
+        temp_path = self.pcap_path.with_suffix(".tmp")
+        try:
+            kept_count, total_count = engine.filter_to(str(temp_path))
+        except RuntimeError as e:
+            LogUtil().warning('main', f"[ConnectionsFilter] BPF 过滤失败, 回退到 raw 引擎: {e}")
+            if temp_path.exists():
+                temp_path.unlink()
+            self.filter_and_overwrite_raw()
+            return
+
+        # 用临时文件替换原文件
+        self._replace_with_temp_file(temp_path, kept_count=kept_count, total_count=total_count)
+
+
+    @staticmethod
+    def _dissect_record(link_type: int, data: bytes) -> Packet:
+        """
+        用 scapy 解析一条原始记录
+        :param link_type: pcap 链路层类型
+        :param data: 记录数据
+        :return: scapy Packet
+        """
+        try:
+            layer_cls = conf.l2types.num2layer[link_type]
+        except KeyError:
+            layer_cls = conf.raw_layer
+        try:
+            return layer_cls(data)
+        except Exception:
+            # 与 scapy PcapReader 的处理一致: 解析失败的包当作原始数据
+            return conf.raw_layer(data)
+
+
+    def _get_raw_packet_key_by_scapy(self, link_type: int, data: bytes) -> tuple:
+        """
+        用 scapy 解析原始记录并提取四元组(原始字节解析失败时的回退方法)
+        :param link_type: pcap 链路层类型
+        :param data: 记录数据
+        :return:
+        """
+        return self._get_packet_key(self._dissect_record(link_type, data))
+
+
+    def _replace_with_temp_file(self, temp_path: Path, kept_count: int, total_count: int):
+        """
+        用过滤后的临时文件原子化替换原文件
+        :param temp_path: 临时文件路径
+        :param kept_count: 保留包数
+        :param total_count: 原始包数
+        """
+        self.kept_count = kept_count
+        self.total_count = total_count
+        output_path = self._get_output_path()
 
         # 等待一段时间，确保文件句柄被释放
         time.sleep(0.2)  # 可根据实际情况调整延迟时间
@@ -135,9 +680,13 @@ class ConnectionsFilter:
         while retry_count < max_retries:
             try:
                 # 原子化替换原文件
-                temp_path.replace(self.pcap_path)
+                temp_path.replace(output_path)
+                if output_path != self.pcap_path:
+                    # 压缩格式变化, 删除原文件
+                    self.pcap_path.unlink()
+                self.output_path = output_path
                 LogUtil().debug('main',
-                                f"已过滤并覆盖文件: {self.pcap_path} (保留包数: {len(filtered)}/{len(packets)})")
+                                f"已过滤并覆盖文件: {output_path} (保留包数: {kept_count}/{total_count})")
                 break
             except PermissionError:
                 retry_count += 1
@@ -0,0 +1,2 @@
+from .filter_engine_type import FilterEngineType
+from .filter_output_mode import FilterOutputMode
\ No newline at end of file
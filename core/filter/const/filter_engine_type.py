@@ -0,0 +1,18 @@
+__doc__ = "pcap 过滤引擎类型"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-10"
+
+import enum
+
+
+class FilterEngineType(enum.Enum):
+    """
+    pcap 过滤引擎类型
+    """
+    SCAPY = 'scapy'     # scapy 完整解析每个包(最慢, 兼容性最好)
+    RAW = 'raw'         # 直接读取原始头部字段, 解析失败再回退到 scapy
+    NUMPY = 'numpy'     # mmap + NumPy 向量化匹配, 原样写出命中的记录(需要安装 numpy)
+    BPF = 'bpf'         # 把连接编译成 BPF 表达式交给 tcpdump -r 过滤, 原样写出命中的记录(需要 tcpdump)
+
+    def __str__(self):
+        return self.value
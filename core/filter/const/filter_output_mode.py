@@ -0,0 +1,16 @@
+__doc__ = "pcap 过滤结果的输出方式"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-12"
+
+import enum
+
+
+class FilterOutputMode(enum.Enum):
+    """
+    pcap 过滤结果的输出方式
+    """
+    REWRITE = 'rewrite'     # 重新编码: 非以太网的包补上 Ether 层, 统一写成 linktype=1
+    VERBATIM = 'verbatim'   # 原样复制: 保留原始全局头和链路层类型, 按字节区间复制命中的记录
+
+    def __str__(self):
+        return self.value
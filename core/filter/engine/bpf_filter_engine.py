@@ -0,0 +1,220 @@
+__doc__ = "tcpdump BPF pcap 过滤引擎"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-13"
+
+import heapq
+import os
+import struct
+import subprocess
+from typing import List
+
+from core.sniffer.connection.model.connection import Connection
+from core.sniffer.impl.tcpdump.tcpdump_util import TcpdumpUtil
+from core.util.io.log_util import LogUtil
+from core.util.pcap.pcap_record_reader import PcapRecordReader, PCAP_GLOBAL_HEADER_LEN, PCAP_RECORD_HEADER_LEN
+
+
+class BpfFilterEngine:
+    """
+    tcpdump BPF pcap 过滤引擎
+        把连接列表编译成一个 BPF 表达式, 交给 `tcpdump -r in.pcap -w out.pcap -F expr` 过滤, 整个匹配过程不经过 Python
+            表达式通过 -F 文件传入, 不受命令行长度限制; 不再用 Python 读一遍原文件计数, 读取包数为 None
+        表达式过长(libpcap 编译优化的耗时随长度快速增长)时按连接拆分成多段, 分别过滤后按 (时间戳, 段序号) 归并成一个文件
+        每段表达式都带 vlan 分支, 带 802.1Q 标签的包与 raw/numpy 引擎一样保留
+        tcpdump 原样复制命中的记录, 输出保留原始链路层类型
+    """
+
+    DEFAULT_MAX_EXPR_LENGTH = 8192      # 单个表达式的最大长度(字符)
+
+    def __init__(self,
+                 pcap_path: str,
+                 connections_list: List[Connection],
+                 max_expr_length: int = DEFAULT_MAX_EXPR_LENGTH,
+                 logger_name: str = 'main'
+                 ):
+        """
+        :param pcap_path: 要过滤的 pcap 文件路径
+        :param connections_list: Connection 对象列表
+        :param max_expr_length: 单个表达式的最大长度, 超过后拆分
+        :param logger_name: 日志记录器名称
+        :raise FileNotFoundError: 找不到 tcpdump
+        """
+        self.pcap_path = str(pcap_path)
+        self.connections = connections_list
+        self.max_expr_length = max_expr_length
+        self.logger_name = logger_name
+
+        # tcpdump 指令位置(找不到时抛 FileNotFoundError, 由调用方回退)
+        self.tcpdump_cmd = TcpdumpUtil.get_tcpdump_cmd()
+
+
+    @staticmethod
+    def build_connection_expr(local_ip, local_port, remote_ip, remote_port) -> str:
+        """
+        单个连接(双向)的 BPF 表达式
+        :return: 表达式字符串
+        """
+        forward = f"src host {local_ip} and src port {local_port} and dst host {remote_ip} and dst port {remote_port}"
+        backward = f"src host {remote_ip} and src port {remote_port} and dst host {local_ip} and dst port {local_port}"
+        return f"(({forward}) or ({backward}))"
+
+
+    @staticmethod
+    def with_vlan(expr: str) -> str:
+        """
+        加上 vlan 分支: 不带标签的包按原表达式匹配, 带 802.1Q 标签的包跳过标签后再匹配
+        :param expr: 表达式
+        :return: 表达式字符串
+        """
+        return f"({expr}) or (vlan and ({expr}))"
+
+
+    def build_filter_exprs(self) -> List[str]:
+        """
+        把连接列表编译成 BPF 表达式
+            正反向相同的连接只保留一个, 保证每个包最多命中一段表达式
+            表达式长度(不含 vlan 分支)超过 max_expr_length 时拆分成多段
+        :return: 表达式列表
+        """
+        # 1. 去重(不区分方向)
+        endpoints_set = set()
+        for conn in self.connections:
+            endpoints = tuple(sorted([(str(conn.local_ip), int(conn.local_port)),
+                                      (str(conn.remote_ip), int(conn.remote_port))]))
+            endpoints_set.add(endpoints)
+
+        # 2. 逐个拼接, 超长则开始新的一段
+        exprs = []
+        current_parts = []
+        current_length = 0
+        for (ip_a, port_a), (ip_b, port_b) in sorted(endpoints_set):
+            part = BpfFilterEngine.build_connection_expr(ip_a, port_a, ip_b, port_b)
+            if current_parts and current_length + len(part) + 4 > self.max_expr_length:
+                exprs.append(BpfFilterEngine.with_vlan(' or '.join(current_parts)))
+                current_parts = []
+                current_length = 0
+            current_parts.append(part)
+            current_length += len(part) + 4
+        if current_parts:
+            exprs.append(BpfFilterEngine.with_vlan(' or '.join(current_parts)))
+
+        return exprs
+
+
+    def filter_to(self, output_path: str):
+        """
+        过滤并写出到指定文件
+        :param output_path: 输出文件路径
+        :return: (保留包数, None), 不统计读取包数(需要在 Python 中遍历整个原文件)
+        :raise RuntimeError: tcpdump 执行失败
+        """
+        exprs = self.build_filter_exprs()
+        if len(exprs) == 0:
+            raise ValueError("[BpfFilterEngine] 连接列表为空, 无法生成过滤表达式")
+
+        # 纳秒精度的 pcap 需要让 tcpdump 也按纳秒写出
+        nano = False
+        if PcapRecordReader.is_pcap_file(self.pcap_path):
+            with PcapRecordReader(self.pcap_path) as reader:
+                nano = reader.nano
+
+        if len(exprs) == 1:
+            self._run_tcpdump(exprs[0], output_path, nano)
+        else:
+            LogUtil().debug(self.logger_name, f"[BpfFilterEngine] 表达式过长, 拆分为 {len(exprs)} 段过滤")
+            chunk_paths = [f"{output_path}.bpf{index}" for index in range(len(exprs))]
+            try:
+                for expr, chunk_path in zip(exprs, chunk_paths):
+                    self._run_tcpdump(expr, chunk_path, nano)
+                BpfFilterEngine._merge_by_timestamp(chunk_paths, output_path)
+            finally:
+                for chunk_path in chunk_paths:
+                    if os.path.exists(chunk_path):
+                        os.remove(chunk_path)
+
+        return self._count_records(output_path), None
+
+
+    def _run_tcpdump(self, expr: str, output_path: str, nano: bool):
+        """
+        执行 tcpdump -r -w -F
+        :param expr: BPF 表达式
+        :param output_path: 输出文件路径
+        :param nano: 是否按纳秒精度写出
+        :return:
+        """
+        expr_path = f"{output_path}.expr"
+        with open(expr_path, 'w') as f:
+            f.write(expr)
+
+        cmd = self.tcpdump_cmd + ['-r', self.pcap_path, '-w', output_path, '-n', '-F', expr_path]
+        if nano:
+            cmd += ['--time-stamp-precision', 'nano']
+
+        try:
+            result = subprocess.run(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=False,
+                check=False,
+            )
+        finally:
+            os.remove(expr_path)
+        if result.returncode != 0:
+            message = result.stderr.decode(errors='ignore').strip()
+            raise RuntimeError(f"[BpfFilterEngine] tcpdump 过滤失败(返回码 {result.returncode}): {message}")
+
+
+    @staticmethod
+    def _merge_by_timestamp(chunk_paths: List[str], output_path: str):
+        """
+        把多段过滤结果按 (时间戳, 段序号) 归并成一个文件
+            每段内部仍是原始顺序; 抓包时间戳不单调时, 不同段之间的记录顺序可能与原文件不同
+        :param chunk_paths: 各段输出文件
+        :param output_path: 合并后的文件
+        :return:
+        """
+        readers = [PcapRecordReader(path) for path in chunk_paths]
+        try:
+            def keyed(reader_index, reader):
+                for record in reader:
+                    yield record.ts_sec, record.ts_frac, reader_index, record
+
+            with open(output_path, 'wb', buffering=1024 * 1024) as out:
+                out.write(readers[0].global_header)
+                merged = heapq.merge(*[keyed(index, reader) for index, reader in enumerate(readers)],
+                                     key=lambda item: item[:3])
+                for _, _, reader_index, record in merged:
+                    out.write(readers[reader_index].pack_record_header(record))
+                    out.write(record.data)
+        finally:
+            for reader in readers:
+                reader.close()
+
+
+    @staticmethod
+    def _count_records(pcap_path: str):
+        """
+        统计经典 pcap 的记录数(只读记录头, 用 seek 跳过数据)
+        :param pcap_path: 文件路径
+        :return: 记录数, 不是经典 pcap(如 pcapng)时返回 None
+        """
+        if not PcapRecordReader.is_pcap_file(pcap_path):
+            return None
+        file_size = os.path.getsize(pcap_path)
+        count = 0
+        with open(pcap_path, 'rb') as f:
+            endian = PcapRecordReader.parse_global_header(f.read(PCAP_GLOBAL_HEADER_LEN))[0]
+            record_header = struct.Struct(endian + 'IIII')
+            while True:
+                header = f.read(PCAP_RECORD_HEADER_LEN)
+                if len(header) < PCAP_RECORD_HEADER_LEN:
+                    break
+                caplen = record_header.unpack(header)[2]
+                if f.tell() + caplen > file_size:
+                    # 末尾不完整的记录不计入
+                    break
+                f.seek(caplen, 1)
+                count += 1
+        return count
@@ -0,0 +1,411 @@
+__doc__ = "NumPy 向量化 pcap 过滤引擎"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-11"
+
+import mmap
+import os
+import socket
+import struct
+from array import array
+from typing import Callable
+
+import numpy as np
+
+from core.filter.connection_interval_index import ConnectionIntervalIndex
+from core.util.pcap.packet_key_util import PacketKeyUtil
+from core.util.pcap.pcap_range_writer import PcapRangeWriter
+from core.util.pcap.pcap_record_reader import PcapRecordReader, PCAP_GLOBAL_HEADER_LEN, PCAP_RECORD_HEADER_LEN
+
+
+class NumpyFilterEngine:
+    """
+    NumPy 向量化 pcap 过滤引擎
+        1. mmap 映射 pcap 文件, 一次遍历记录头得到所有记录的偏移
+        2. 按链路层/IP 头的固定偏移, 向量化地取出 src/dst ip 和端口列
+        3. 把 ip 映射为连接集合里的编号, 与端口一起打包成 64 位整数, 用 np.isin 与连接集合匹配
+        4. 命中的记录按字节区间原样复制(PcapRangeWriter, 保留原始全局头和链路层类型, 不重新编码)
+        向量化部分由 NumPy 在 C 中执行(大部分会释放 GIL), 不会长时间阻塞其他任务线程
+        IPv6 扩展头/双层 VLAN 等少数情况逐条交给 PacketKeyUtil, 仍解析失败的再交给 fallback_key_func
+        启用时间窗口匹配时, 四元组命中的记录再逐条按时间戳检查连接存活区间
+    """
+
+    # 地址族前缀(把 IPv4/IPv6 统一成 17 字节的 key, 两者不会互相冲突)
+    _FAMILY_V4 = b'\x04'
+    _FAMILY_V6 = b'\x06'
+
+    def __init__(self,
+                 pcap_path: str,
+                 connection_set: set,
+                 fallback_key_func: Callable = None,
+                 interval_index: ConnectionIntervalIndex = None
+                 ):
+        """
+        :param pcap_path: pcap 文件路径(仅支持经典 pcap)
+        :param connection_set: 四元组集合(ConnectionsFilter._build_connection_set 的结果)
+        :param fallback_key_func: 原始字节解析失败时的回退方法, 参数 (link_type, data), 返回四元组
+        :param interval_index: 连接存活区间索引(为None时不检查时间窗口)
+        """
+        self.pcap_path = str(pcap_path)
+        self.connection_set = connection_set
+        self.fallback_key_func = fallback_key_func
+        self.interval_index = interval_index
+
+
+    def filter_to(self, output_path: str):
+        """
+        过滤并写出到指定文件
+        :param output_path: 输出文件路径
+        :return: (保留包数, 读取包数)
+        """
+        file_size = os.path.getsize(self.pcap_path)
+        with open(self.pcap_path, 'rb') as f:
+            global_header = f.read(PCAP_GLOBAL_HEADER_LEN)
+            parsed = PcapRecordReader.parse_global_header(global_header)
+            if parsed is None:
+                raise ValueError(f"[NumpyFilterEngine] 不是有效的 pcap 文件: {self.pcap_path}")
+            endian, nano, _, link_type = parsed
+
+            # 没有任何记录, 只写全局头
+            if file_size <= PCAP_GLOBAL_HEADER_LEN:
+                with open(output_path, 'wb') as out:
+                    out.write(global_header)
+                return 0, 0
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                record_offsets, caplens = self._scan_record_offsets(mm, endian, file_size)
+                keep_mask = self._match_records(mm, link_type, record_offsets, caplens)
+                if self.interval_index is not None:
+                    keep_mask = self._match_time_window(mm, endian, nano, link_type, record_offsets, caplens, keep_mask)
+            finally:
+                mm.close()
+
+        kept_count = self._write_kept_records(global_header, record_offsets, caplens, keep_mask, output_path)
+
+        return kept_count, len(record_offsets)
+
+
+    @staticmethod
+    def _scan_record_offsets(mm: mmap.mmap, endian: str, file_size: int):
+        """
+        遍历记录头, 得到每条记录的偏移和 caplen
+            末尾不完整的记录会被丢弃
+        :return: (记录偏移数组, caplen 数组)
+        """
+        unpack_caplen = struct.Struct(endian + 'I').unpack_from
+        offsets = array('q')
+        caplens = array('q')
+
+        offset = PCAP_GLOBAL_HEADER_LEN
+        while offset + PCAP_RECORD_HEADER_LEN <= file_size:
+            caplen = unpack_caplen(mm, offset + 8)[0]
+            end = offset + PCAP_RECORD_HEADER_LEN + caplen
+            if end > file_size:
+                break
+            offsets.append(offset)
+            caplens.append(caplen)
+            offset = end
+
+        return np.frombuffer(offsets, dtype=np.int64), np.frombuffer(caplens, dtype=np.int64)
+
+
+    def _match_records(self, mm: mmap.mmap, link_type: int, record_offsets, caplens):
+        """
+        向量化匹配所有记录
+        :return: bool 数组, True 表示保留
+        """
+        count = len(record_offsets)
+        keep_mask = np.zeros(count, dtype=bool)
+        if count == 0:
+            return keep_mask
+
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        try:
+            last_index = len(buf) - 1
+
+            def u8(pos):
+                return buf[np.minimum(pos, last_index)].astype(np.int64)
+
+            def u16(pos):
+                return (u8(pos) << 8) | u8(pos + 1)
+
+            data_offsets = record_offsets + PCAP_RECORD_HEADER_LEN
+            # scalar: 需要逐条处理的记录; vector: 可以向量化处理的 IP 记录
+            scalar = np.zeros(count, dtype=bool)
+
+            # 1. 链路层, 得到网络层偏移和 IP 版本
+            l3_offsets, is_ip, link_scalar = self._locate_l3(link_type, data_offsets, caplens, u8, u16)
+            scalar |= link_scalar
+            version = np.where(is_ip, u8(l3_offsets) >> 4, 0)
+            rel_l3 = l3_offsets - data_offsets
+
+            # 2. IPv4
+            is_v4 = is_ip & (version == 4)
+            v4_short = is_v4 & (caplens < rel_l3 + 20)
+            ihl = (u8(l3_offsets) & 0x0F) * 4
+            v4_bad_ihl = is_v4 & ~v4_short & (ihl < 20)
+            scalar |= v4_short | v4_bad_ihl
+            is_v4 &= ~(v4_short | v4_bad_ihl)
+            protocol_v4 = u8(l3_offsets + 9)
+            fragment_offset = ((u8(l3_offsets + 6) & 0x1F) << 8) | u8(l3_offsets + 7)
+            v4_ports = is_v4 & (fragment_offset == 0) & \
+                       ((protocol_v4 == PacketKeyUtil.PROTO_TCP) | (protocol_v4 == PacketKeyUtil.PROTO_UDP))
+
+            # 3. IPv6 (仅无扩展头的情况向量化, 有扩展头的逐条处理)
+            is_v6 = is_ip & (version == 6)
+            v6_short = is_v6 & (caplens < rel_l3 + 40)
+            scalar |= v6_short
+            is_v6 &= ~v6_short
+            next_header = u8(l3_offsets + 6)
+            v6_direct = (next_header == PacketKeyUtil.PROTO_TCP) | (next_header == PacketKeyUtil.PROTO_UDP)
+            v6_ext = np.isin(next_header, (PacketKeyUtil.IPV6_EXT_HOP_BY_HOP,
+                                           PacketKeyUtil.IPV6_EXT_ROUTING,
+                                           PacketKeyUtil.IPV6_EXT_FRAGMENT,
+                                           PacketKeyUtil.IPV6_EXT_AH,
+                                           PacketKeyUtil.IPV6_EXT_DEST_OPTS,
+                                           PacketKeyUtil.IPV6_EXT_MOBILITY))
+            scalar |= is_v6 & v6_ext
+            v6_ports = is_v6 & v6_direct
+
+            # 其他 IP 版本号(原始字节无法确定协议)逐条处理
+            scalar |= is_ip & ~link_scalar & (version != 4) & (version != 6)
+
+            # 4. 传输层偏移, 端口需要完整落在 caplen 内
+            l4_offsets = np.where(v4_ports, l3_offsets + ihl, l3_offsets + 40)
+            has_ports = v4_ports | v6_ports
+            ports_short = has_ports & (caplens < (l4_offsets - data_offsets) + 4)
+            scalar |= ports_short
+            vector = has_ports & ~ports_short
+
+            # 5. 向量化匹配
+            vector_index = np.nonzero(vector)[0]
+            if len(vector_index) > 0:
+                keep_mask[vector_index] = self._match_vector(
+                    buf,
+                    l3_offsets[vector_index],
+                    l4_offsets[vector_index],
+                    is_v4[vector_index],
+                    u16,
+                )
+
+            # 6. 逐条处理剩余记录
+            for index in np.nonzero(scalar & ~vector)[0]:
+                start = int(data_offsets[index])
+                data = mm[start:start + int(caplens[index])]
+                key = PacketKeyUtil.extract_key(link_type, data)
+                if key is None and self.fallback_key_func is not None:
+                    key = self.fallback_key_func(link_type, data)
+                keep_mask[index] = key in self.connection_set
+        finally:
+            # 释放对 mmap 的引用, 否则 mmap 无法关闭
+            del buf
+
+        return keep_mask
+
+
+    def _match_time_window(self, mm: mmap.mmap, endian: str, nano: bool, link_type: int,
+                           record_offsets, caplens, keep_mask):
+        """
+        对四元组已命中的记录, 按时间戳检查连接存活区间
+            时间戳向量化取出, 四元组逐条重新提取(只处理命中的记录)
+        :return: bool 数组, True 表示保留
+        """
+        kept_index = np.nonzero(keep_mask)[0]
+        if len(kept_index) == 0:
+            return keep_mask
+
+        header_dtype = np.dtype([('ts_sec', endian + 'u4'), ('ts_frac', endian + 'u4')])
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        try:
+            positions = record_offsets[kept_index, None] + np.arange(8)
+            headers = buf[positions].copy().view(header_dtype).ravel()
+        finally:
+            del buf
+        timestamps = headers['ts_sec'] + headers['ts_frac'] / (1e9 if nano else 1e6)
+
+        for index, timestamp in zip(kept_index, timestamps):
+            start = int(record_offsets[index]) + PCAP_RECORD_HEADER_LEN
+            data = mm[start:start + int(caplens[index])]
+            key = PacketKeyUtil.extract_key(link_type, data)
+            if key is None and self.fallback_key_func is not None:
+                key = self.fallback_key_func(link_type, data)
+            keep_mask[index] = self.interval_index.contains(key, float(timestamp))
+
+        return keep_mask
+
+
+    @staticmethod
+    def _locate_l3(link_type: int, data_offsets, caplens, u8, u16):
+        """
+        按链路层类型计算网络层偏移
+        :return: (网络层偏移数组, 是否为 IP 的 bool 数组, 需要逐条处理的 bool 数组)
+        """
+        count = len(data_offsets)
+        scalar = np.zeros(count, dtype=bool)
+
+        if link_type == PacketKeyUtil.LINKTYPE_ETHERNET:
+            ether_type = u16(data_offsets + 12)
+            vlan = np.isin(ether_type, PacketKeyUtil.ETHERTYPE_VLAN)
+            ether_type = np.where(vlan, u16(data_offsets + 16), ether_type)
+            header_len = np.where(vlan, 18, 14)
+            # 双层 VLAN 或头部被截断的逐条处理
+            scalar |= (vlan & np.isin(ether_type, PacketKeyUtil.ETHERTYPE_VLAN)) | (caplens < header_len)
+            is_ip = ~scalar & ((ether_type == PacketKeyUtil.ETHERTYPE_IPV4) | (ether_type == PacketKeyUtil.ETHERTYPE_IPV6))
+            return data_offsets + header_len, is_ip, scalar
+
+        if link_type in (PacketKeyUtil.LINKTYPE_LINUX_SLL, PacketKeyUtil.LINKTYPE_LINUX_SLL2):
+            if link_type == PacketKeyUtil.LINKTYPE_LINUX_SLL:
+                ether_type, header_len = u16(data_offsets + 14), 16
+            else:
+                ether_type, header_len = u16(data_offsets), 20
+            scalar |= caplens < header_len
+            is_ip = ~scalar & ((ether_type == PacketKeyUtil.ETHERTYPE_IPV4) | (ether_type == PacketKeyUtil.ETHERTYPE_IPV6))
+            return data_offsets + header_len, is_ip, scalar
+
+        if link_type in (PacketKeyUtil.LINKTYPE_RAW, PacketKeyUtil.LINKTYPE_IPV4, PacketKeyUtil.LINKTYPE_IPV6) \
+                or link_type in PacketKeyUtil.DLT_RAW_ALIASES:
+            header_len = 0
+        elif link_type in (PacketKeyUtil.LINKTYPE_NULL, PacketKeyUtil.LINKTYPE_LOOP):
+            header_len = 4
+        else:
+            # 未知链路层全部逐条处理
+            return data_offsets, np.zeros(count, dtype=bool), np.ones(count, dtype=bool)
+
+        # 没有以太网类型字段, 直接根据 IP 版本号判断
+        scalar |= caplens < header_len + 1
+        is_ip = ~scalar
+        return data_offsets + header_len, is_ip, scalar
+
+
+    def _match_vector(self, buf, l3_offsets, l4_offsets, is_v4, u16):
+        """
+        向量化匹配已定位到端口的 IP 记录
+        :return: bool 数组
+        """
+        # 1. 取出 ip 列, 统一成 17 字节(地址族 + 16 字节地址)
+        src_ips = self._gather_ips(buf, l3_offsets, is_v4, 12, 8)
+        dst_ips = self._gather_ips(buf, l3_offsets, is_v4, 16, 24)
+        src_ports = u16(l4_offsets)
+        dst_ports = u16(l4_offsets + 2)
+
+        # 2. 连接集合中出现的 ip, 排序后用于编号
+        known_ips, conn_keys = self._build_connection_keys()
+        if len(known_ips) == 0:
+            return np.zeros(len(l3_offsets), dtype=bool)
+
+        src_ids = self._ip_ids(known_ips, src_ips)
+        dst_ids = self._ip_ids(known_ips, dst_ips)
+        both_known = (src_ids >= 0) & (dst_ids >= 0)
+
+        # 3. 打包成 64 位 key 并匹配
+        packet_keys = NumpyFilterEngine._pack_keys(src_ids, src_ports, dst_ids, dst_ports, len(known_ips))
+        return both_known & np.isin(packet_keys, conn_keys)
+
+
+    @staticmethod
+    def _gather_ips(buf, l3_offsets, is_v4, v4_field_offset: int, v6_field_offset: int):
+        """
+        向量化取出 ip 地址
+        :return: S17 数组
+        """
+        count = len(l3_offsets)
+        result = np.zeros((count, 17), dtype=np.uint8)
+
+        v4_index = np.nonzero(is_v4)[0]
+        if len(v4_index) > 0:
+            positions = l3_offsets[v4_index, None] + v4_field_offset + np.arange(4)
+            result[v4_index, 0] = NumpyFilterEngine._FAMILY_V4[0]
+            result[v4_index, 13:17] = buf[positions]
+
+        v6_index = np.nonzero(~is_v4)[0]
+        if len(v6_index) > 0:
+            positions = l3_offsets[v6_index, None] + v6_field_offset + np.arange(16)
+            result[v6_index, 0] = NumpyFilterEngine._FAMILY_V6[0]
+            result[v6_index, 1:17] = buf[positions]
+
+        return result.view('S17').ravel()
+
+
+    def _build_connection_keys(self):
+        """
+        把连接集合转换成向量化使用的 key
+        :return: (排序后的已知 ip 数组, 连接 key 数组)
+        """
+        tuples = []
+        for src_ip, src_port, dst_ip, dst_port in self.connection_set:
+            src = NumpyFilterEngine._ip_to_bytes(src_ip)
+            dst = NumpyFilterEngine._ip_to_bytes(dst_ip)
+            if src is None or dst is None or src_port is None or dst_port is None:
+                continue
+            tuples.append((src, int(src_port), dst, int(dst_port)))
+
+        known_ips = np.unique(np.array([t[0] for t in tuples] + [t[2] for t in tuples], dtype='S17'))
+        if len(tuples) == 0:
+            return known_ips, np.zeros(0, dtype=np.uint64)
+
+        src_ids = np.searchsorted(known_ips, np.array([t[0] for t in tuples], dtype='S17')).astype(np.int64)
+        dst_ids = np.searchsorted(known_ips, np.array([t[2] for t in tuples], dtype='S17')).astype(np.int64)
+        src_ports = np.array([t[1] for t in tuples], dtype=np.int64)
+        dst_ports = np.array([t[3] for t in tuples], dtype=np.int64)
+        return known_ips, NumpyFilterEngine._pack_keys(src_ids, src_ports, dst_ids, dst_ports, len(known_ips))
+
+
+    @staticmethod
+    def _ip_to_bytes(ip: str):
+        """
+        ip 字符串转成 17 字节 key
+        :return: bytes, 无法解析返回 None
+        """
+        try:
+            if ':' in ip:
+                return NumpyFilterEngine._FAMILY_V6 + socket.inet_pton(socket.AF_INET6, ip)
+            return NumpyFilterEngine._FAMILY_V4 + bytes(12) + socket.inet_aton(ip)
+        except (OSError, TypeError):
+            return None
+
+
+    @staticmethod
+    def _ip_ids(known_ips, ips):
+        """
+        ip 在已知 ip 数组中的编号
+        :return: int64 数组, 不在连接集合中的为 -1
+        """
+        index = np.searchsorted(known_ips, ips)
+        clipped = np.minimum(index, len(known_ips) - 1)
+        return np.where(known_ips[clipped] == ips, clipped, -1).astype(np.int64)
+
+
+    @staticmethod
+    def _pack_keys(src_ids, src_ports, dst_ids, dst_ports, ip_count: int):
+        """
+        (src ip 编号, src 端口, dst ip 编号, dst 端口) 打包成一个 64 位整数
+            ip 编号组合占高 32 位, 两个端口占低 32 位
+        """
+        pair_ids = src_ids.astype(np.uint64) * np.uint64(ip_count) + dst_ids.astype(np.uint64)
+        ports = (src_ports.astype(np.uint64) << np.uint64(16)) | dst_ports.astype(np.uint64)
+        return (pair_ids << np.uint64(32)) | ports
+
+
+    def _write_kept_records(self, global_header: bytes, record_offsets, caplens, keep_mask, output_path: str):
+        """
+        写出保留的记录
+            连续的保留记录在文件中也是连续的, 合并成一段后按字节区间复制
+        :return: 保留包数
+        """
+        kept_index = np.nonzero(keep_mask)[0]
+
+        with PcapRangeWriter(self.pcap_path, output_path, global_header) as writer:
+            if len(kept_index) == 0:
+                return 0
+
+            # 按编号断点切分成若干段
+            breaks = np.nonzero(np.diff(kept_index) != 1)[0] + 1
+            run_starts = np.concatenate(([kept_index[0]], kept_index[breaks]))
+            run_ends = np.concatenate((kept_index[breaks - 1], [kept_index[-1]]))
+
+            for first, last in zip(run_starts, run_ends):
+                start = int(record_offsets[first])
+                end = int(record_offsets[last] + PCAP_RECORD_HEADER_LEN + caplens[last])
+                writer.add_range(start, end - start)
+
+        return len(kept_index)
@@ -0,0 +1,232 @@
+__doc__ = "抓包过程中在线过滤 pcap"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-20"
+
+import os
+import struct
+from collections import deque
+from pathlib import Path
+
+from core.filter.connections_filter import ConnectionsFilter
+from core.sniffer.connection.connection_tracker_thread import ConnectionTrackerThread
+from core.util.io.log_util import LogUtil
+from core.util.multithreading.better_thread import BetterThread
+from core.util.pcap.packet_key_util import PacketKeyUtil
+from core.util.pcap.pcap_record_reader import PcapRecordReader, PCAP_GLOBAL_HEADER_LEN, PCAP_RECORD_HEADER_LEN
+
+
+class OnlineConnectionsFilter(BetterThread):
+    """
+    在线过滤线程
+        抓包过程中持续读取(tail)嗅探器正在写入的 pcap, 只解析已经完整写入的记录,
+        与 ConnectionTrackerThread 实时的 connections_dict 匹配, 命中的记录原样写入临时文件
+        连接可能在它的首批包(如 SYN)之后才被 tracker 轮询到, 所以每条记录先在回看缓冲区里等待 lookback_seconds
+        (按包时间戳), 超出窗口后再用当时的连接集合判定, 输出顺序与原文件一致
+        停止抓包后调用 finish(): 读完剩余记录, 用最终的连接集合判定缓冲区, 替换原文件
+        注: 仅支持经典 pcap, 其他格式(如 dumpcap 默认的 pcapng) finish 返回 False, 由调用方改为离线过滤
+    """
+
+    def __init__(self,
+                 task_name: str,
+                 pcap_path: str,
+                 tracker: ConnectionTrackerThread,
+                 lookback_seconds: float = 2.0,
+                 poll_interval: float = 0.2
+                 ):
+        """
+        :param task_name: 任务名
+        :param pcap_path: 嗅探器输出的 pcap 路径
+        :param tracker: 连接追踪线程(读取其 connections_dict)
+        :param lookback_seconds: 回看缓冲区的时长(秒)
+        :param poll_interval: 读取新数据的间隔(秒)
+        """
+        super().__init__(name='OnlineConnectionsFilter', daemon=True)
+        self.task_name = task_name
+        self.pcap_path = Path(pcap_path)
+        self.tracker = tracker
+        self.lookback_seconds = lookback_seconds
+        self.poll_interval = poll_interval
+
+        # 输入
+        self._file = None
+        self._pending_bytes = bytearray()   # 已读取但还不是完整记录的字节
+        self._record_header_struct = None
+        self._frac_per_sec = 1e6
+        self._link_type = None
+        self.unsupported = False            # 文件不是经典 pcap
+        self._scapy_key_filter = ConnectionsFilter(pcap_path, [])   # 原始字节解析失败时用它的 scapy 回退方法
+
+        # 输出
+        self._temp_path = self.pcap_path.with_suffix(".online.tmp")
+        self._output = None
+
+        # 连接集合(tracker 只会新增连接, 数量变化时重建)
+        self._connection_set = set()
+        self._connection_count = 0
+
+        # 回看缓冲区: (时间戳, 四元组, 记录字节)
+        self._lookback = deque()
+
+        self.kept_count = 0
+        self.total_count = 0
+        self.error = None
+
+
+    def run(self):
+        try:
+            while self.stop_event.is_set() is False and self.unsupported is False:
+                self._poll()
+                self.stop_event.wait(self.poll_interval)
+        except Exception as e:
+            self.error = e
+            LogUtil().error(self.task_name, f"[OnlineConnectionsFilter] 在线过滤出错: {e}")
+
+
+    def finish(self) -> bool:
+        """
+        抓包停止后调用: 读完剩余记录, 判定回看缓冲区中的所有记录, 用过滤结果替换原文件
+        :return: 是否完成(False 表示不支持或出错, 调用方应改为离线过滤)
+        """
+        self.stop()
+        self.join()
+
+        try:
+            if self.error is None and self.unsupported is False:
+                self._poll()
+                self._refresh_connection_set()
+                self._decide(flush_all=True)
+        except Exception as e:
+            self.error = e
+            LogUtil().error(self.task_name, f"[OnlineConnectionsFilter] 在线过滤出错: {e}")
+        finally:
+            self.clear()
+
+        if self.error is not None or self.unsupported is True or self._output is None:
+            if self._temp_path.exists():
+                self._temp_path.unlink()
+            return False
+
+        self._temp_path.replace(self.pcap_path)
+        if len(self._pending_bytes) > 0:
+            LogUtil().warning(self.task_name,
+                              f"[OnlineConnectionsFilter] 文件末尾有不完整的记录, 已丢弃 {len(self._pending_bytes)} 字节")
+        LogUtil().debug(self.task_name,
+                        f"[OnlineConnectionsFilter] 已过滤并覆盖文件: {self.pcap_path} (保留包数: {self.kept_count}/{self.total_count})")
+        return True
+
+
+    def _poll(self):
+        """
+        读取新写入的数据, 解析完整的记录并判定超出回看窗口的记录
+        :return:
+        """
+        if self._file is None and not self._open_input():
+            return
+
+        chunk = self._file.read()
+        if chunk:
+            self._pending_bytes += chunk
+            self._refresh_connection_set()
+            self._parse_records()
+            self._decide(flush_all=False)
+
+
+    def _open_input(self) -> bool:
+        """
+        打开输入文件并解析全局头(文件还没创建或全局头还没写完时返回 False)
+        :return: bool
+        """
+        if not self.pcap_path.exists() or os.path.getsize(self.pcap_path) < PCAP_GLOBAL_HEADER_LEN:
+            return False
+
+        file = open(self.pcap_path, 'rb')
+        global_header = file.read(PCAP_GLOBAL_HEADER_LEN)
+        parsed = PcapRecordReader.parse_global_header(global_header)
+        if parsed is None:
+            file.close()
+            self.unsupported = True
+            LogUtil().debug(self.task_name, f"[OnlineConnectionsFilter] {self.pcap_path} 不是经典 pcap 格式, 不进行在线过滤")
+            return False
+
+        endian, nano, _, self._link_type = parsed
+        self._record_header_struct = struct.Struct(endian + 'IIII')
+        self._frac_per_sec = 1e9 if nano else 1e6
+        self._file = file
+
+        self._output = open(self._temp_path, 'wb', buffering=1024 * 1024)
+        self._output.write(global_header)
+        return True
+
+
+    def _parse_records(self):
+        """
+        从已读取的字节中解析完整的记录, 放入回看缓冲区
+        :return:
+        """
+        buffer = self._pending_bytes
+        position = 0
+        while len(buffer) - position >= PCAP_RECORD_HEADER_LEN:
+            ts_sec, ts_frac, caplen, _ = self._record_header_struct.unpack_from(buffer, position)
+            end = position + PCAP_RECORD_HEADER_LEN + caplen
+            if end > len(buffer):
+                break
+            record_bytes = bytes(buffer[position:end])
+            data = record_bytes[PCAP_RECORD_HEADER_LEN:]
+
+            key = PacketKeyUtil.extract_key(self._link_type, data)
+            if key is None:
+                # 原始字节解析失败, 回退到 scapy
+                key = self._scapy_key_filter._get_raw_packet_key_by_scapy(self._link_type, data)
+
+            self._lookback.append((ts_sec + ts_frac / self._frac_per_sec, key, record_bytes))
+            self.total_count += 1
+            position = end
+
+        del buffer[:position]
+
+
+    def _refresh_connection_set(self):
+        """
+        连接数量变化时重建连接集合
+        :return:
+        """
+        conns = list(self.tracker.connections_dict.values())
+        if len(conns) == self._connection_count:
+            return
+        connection_set = set()
+        for conn in conns:
+            connection_set.add((conn.local_ip, conn.local_port, conn.remote_ip, conn.remote_port))
+            connection_set.add((conn.remote_ip, conn.remote_port, conn.local_ip, conn.local_port))
+        self._connection_set = connection_set
+        self._connection_count = len(conns)
+
+
+    def _decide(self, flush_all: bool):
+        """
+        判定回看缓冲区中超出窗口的记录(命中的写入输出文件)
+        :param flush_all: 是否判定全部记录(抓包结束时)
+        :return:
+        """
+        if len(self._lookback) == 0:
+            return
+        newest_ts = self._lookback[-1][0]
+        while len(self._lookback) > 0:
+            timestamp, key, record_bytes = self._lookback[0]
+            if not flush_all and newest_ts - timestamp < self.lookback_seconds:
+                break
+            self._lookback.popleft()
+            if key in self._connection_set:
+                self._output.write(record_bytes)
+                self.kept_count += 1
+
+
+    def clear(self):
+        """
+        关闭文件
+        :return:
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._output is not None:
+            self._output.close()
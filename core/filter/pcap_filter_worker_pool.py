@@ -0,0 +1,100 @@
+__doc__ = "后台 pcap 过滤进程池"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-15"
+
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List
+
+from core.filter.connections_filter import ConnectionsFilter
+from core.sniffer.connection.model.connection import Connection
+from core.util.io.log_util import LogUtil
+
+
+def _init_worker(enable_log: bool, log_dir: str):
+    """
+    子进程初始化
+        子进程与主进程在同一个进程组, 终端的 Ctrl-C 也会发给子进程, 忽略 SIGINT, 由主进程决定如何收尾(在途的过滤照常完成)
+        spawn 出的子进程里 LogUtil 是新的单例, 复制主进程的日志配置
+    :param enable_log: 是否启用日志记录
+    :param log_dir: 日志路径
+    :return:
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    LogUtil().enable_log = enable_log
+    LogUtil().set_log_dir(log_dir)
+
+
+class PcapFilterWorkerPool:
+    """
+    后台 pcap 过滤进程池
+        抓取线程把 pcap 路径和连接列表快照交给进程池后立即返回, 过滤在后台进程中执行, 不再占用抓取流程的时间
+        同时在途(排队+执行中)的任务数有上限, 达到上限时 submit 阻塞, 避免过滤跟不上抓取时任务无限堆积
+    """
+
+    DEFAULT_MAX_WORKERS = 2     # 默认进程数
+    DEFAULT_MAX_PENDING = 4     # 默认最大在途任务数
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, max_pending: int = DEFAULT_MAX_PENDING):
+        """
+        :param max_workers: 进程数
+        :param max_pending: 最大在途任务数(不小于进程数)
+        """
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+
+        # 使用 spawn 启动子进程: 主进程里有多个线程(抓取/面板/日志), fork 可能复制到被其他线程持有的锁
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker,
+                                             initargs=(LogUtil().enable_log, LogUtil().log_dir))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+
+    def submit(self, pcap_path: str, connections_list: List[Connection], config: dict = None) -> Future:
+        """
+        提交一个过滤任务(在途任务已满时阻塞)
+        :param pcap_path: pcap 文件路径
+        :param connections_list: 连接列表(会复制一份快照)
+        :param config: 过滤配置
+        :return: Future, 结果是 (保留包数, 读取包数)
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(ConnectionsFilter.filter_pcap, pcap_path, list(connections_list), config)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+    def shutdown(self, wait: bool = True):
+        """
+        关闭进程池
+        :param wait: 是否等待在途任务完成
+        :return:
+        """
+        self._executor.shutdown(wait=wait)
+
+
+    @staticmethod
+    def create_worker_pool_by_config(config: dict):
+        """
+        根据过滤配置创建进程池
+        :param config: filter_config
+                        - background: 是否后台过滤(默认 True)
+                        - background_workers: 进程数
+                        - background_max_pending: 最大在途任务数
+        :return: PcapFilterWorkerPool, 不启用后台过滤时返回 None
+        """
+        if config is None:
+            config = {}
+        if config.get('background', True) is not True:
+            return None
+        return PcapFilterWorkerPool(
+            max_workers=config.get('background_workers', PcapFilterWorkerPool.DEFAULT_MAX_WORKERS),
+            max_pending=config.get('background_max_pending', PcapFilterWorkerPool.DEFAULT_MAX_PENDING)
+        )
@@ -0,0 +1,253 @@
+__doc__ = "轮转抓包的分片过滤"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-25"
+
+import os
+import shutil
+import struct
+import time
+from pathlib import Path
+
+from scapy.layers.l2 import Ether
+
+from core.filter.connections_filter import ConnectionsFilter
+from core.sniffer.connection.connection_tracker_thread import ConnectionTrackerThread
+from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.util.io.log_util import LogUtil
+from core.util.multithreading.better_thread import BetterThread
+from core.util.pcap.packet_key_util import PacketKeyUtil
+from core.util.pcap.pcap_record_reader import PcapRecordReader, PCAP_GLOBAL_HEADER_LEN, PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC
+from core.util.pcap.pcap_repair_util import PcapRepairUtil
+
+
+class RotatedCaptureFilter(BetterThread):
+    """
+    轮转抓包的分片过滤线程
+        嗅探器按秒数/大小轮转写出分片(见 TrafficSniffer.rotation), 抓包的同时逐个过滤已经关闭的分片,
+        抓包结束时只剩最后几个分片需要处理, 不用在结束后再完整读一遍整个抓包
+        分片关闭(出现了下一个分片)且最后修改时间超过 settle_seconds 后才过滤, 给 tracker 留出发现新连接的时间
+        停止抓包后调用 finish(): 用最终的连接列表过滤剩余分片, 按顺序拼接成嗅探器的 pcap_path, 删除分片目录
+        注: 统计/拆分/连接索引/压缩需要完整的输出文件, 这些配置留给 final_pass_config, 由调用方在拼接后的(已过滤的)文件上再过滤一遍
+    """
+
+    # 拼接后需要在完整文件上再处理的配置
+    FINAL_PASS_KEYS = ('stats', 'split_flows', 'flow_index', 'compression')
+
+    def __init__(self,
+                 task_name: str,
+                 sniffer: TrafficSniffer,
+                 tracker: ConnectionTrackerThread = None,
+                 config: dict = None,
+                 settle_seconds: float = 2.0,
+                 poll_interval: float = 1.0
+                 ):
+        """
+        :param task_name: 任务名
+        :param sniffer: 轮转抓包的嗅探器
+        :param tracker: 连接追踪线程(为None时只拼接分片, 不过滤)
+        :param config: 过滤配置(同 ConnectionsFilter, 可为None)
+        :param settle_seconds: 分片关闭后等待多久再过滤(秒)
+        :param poll_interval: 检查新分片的间隔(秒)
+        """
+        super().__init__(name='RotatedCaptureFilter', daemon=True)
+        self.task_name = task_name
+        self.sniffer = sniffer
+        self.tracker = tracker
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+
+        # 分片的过滤配置去掉需要完整文件的部分
+        config = dict(config) if config is not None else {}
+        self.chunk_config = {key: value for key, value in config.items() if key not in RotatedCaptureFilter.FINAL_PASS_KEYS}
+        self.final_pass_config = None
+        if any(config.get(key) not in (None, False, 'none') for key in RotatedCaptureFilter.FINAL_PASS_KEYS):
+            self.final_pass_config = config
+
+        self._processed = set()     # 已经处理过的分片
+        self.kept_count = 0
+        self.total_count = 0
+        self.error = None
+
+
+    def run(self):
+        try:
+            while self.stop_event.is_set() is False:
+                self._process_chunks(final=False)
+                self.stop_event.wait(self.poll_interval)
+        except Exception as e:
+            self.error = e
+            LogUtil().error(self.task_name, f"[RotatedCaptureFilter] 分片过滤出错: {e}")
+
+
+    def finish(self) -> bool:
+        """
+        抓包停止后调用: 过滤剩余分片并拼接成嗅探器的 pcap_path
+            即使分片过滤出错也会拼接(出错的分片按原样拼接), 保证抓到的数据不丢
+        :return: 分片是否全部过滤成功
+        """
+        self.stop()
+        self.join()
+
+        try:
+            self._process_chunks(final=True)
+        except Exception as e:
+            self.error = e
+            LogUtil().error(self.task_name, f"[RotatedCaptureFilter] 分片过滤出错: {e}")
+
+        chunks = self.sniffer.list_chunk_paths()
+        pcap_path = self.sniffer.get_pcap_path()
+        self._concatenate_chunks(chunks, pcap_path)
+        self.clear()
+
+        if self.tracker is not None:
+            LogUtil().debug(self.task_name,
+                            f"[RotatedCaptureFilter] 已过滤并拼接 {len(chunks)} 个分片: {pcap_path} "
+                            f"(保留包数: {self.kept_count}/{self.total_count})")
+        else:
+            LogUtil().debug(self.task_name, f"[RotatedCaptureFilter] 已拼接 {len(chunks)} 个分片: {pcap_path}")
+        return self.error is None
+
+
+    def _process_chunks(self, final: bool):
+        """
+        过滤可以处理的分片
+        :param final: 是否抓包已结束(所有分片都已关闭)
+        :return:
+        """
+        if self.tracker is None:
+            return
+        chunks = self.sniffer.list_chunk_paths()
+        if not final:
+            # 最后一个分片还在写入
+            chunks = chunks[:-1]
+
+        for chunk in chunks:
+            if chunk in self._processed:
+                continue
+            if not final and time.time() - os.path.getmtime(chunk) < self.settle_seconds:
+                # 分片按顺序关闭, 后面的分片也还没到时间
+                break
+            if os.path.getsize(chunk) > 0:
+                # tracker 线程还在插入新连接, 取一份快照再遍历
+                conns = list(self.tracker.get_connections_list())
+                kept, total = ConnectionsFilter.filter_pcap(pcap_path=str(chunk),
+                                                            connections_list=conns,
+                                                            config=self.chunk_config)
+                self.kept_count += kept or 0
+                self.total_count += total or 0
+            self._processed.add(chunk)
+
+
+    def _concatenate_chunks(self, chunks: list, output_path: str):
+        """
+        按顺序拼接分片
+            经典 pcap: 只写一个全局头, 之后的分片跳过全局头
+                各分片的字节序/时间戳精度/链路层类型一致时直接复制记录;
+                不一致时(如某个分片过滤失败, 保留了原始链路层类型, 其他分片已被重写为以太网)逐条重新编码成输出格式,
+                不能把格式不同的记录直接接在全局头后面
+            pcapng: 每个分片都是完整的 section, 直接首尾相接
+        :param chunks: 分片路径列表(已排序)
+        :param output_path: 输出文件路径
+        :return:
+        """
+        # 嗅探器被结束时, 最后一个分片末尾可能不完整
+        for chunk in chunks:
+            PcapRepairUtil.repair(str(chunk), self.task_name)
+
+        headers = {}
+        for chunk in chunks:
+            with open(chunk, 'rb') as f:
+                headers[chunk] = f.read(PCAP_GLOBAL_HEADER_LEN)
+        first_header, output_format = RotatedCaptureFilter._choose_output_format(list(headers.values()))
+
+        header_written = False
+        with open(output_path, 'wb') as out:
+            for chunk in chunks:
+                header = headers[chunk]
+                parsed = PcapRecordReader.parse_global_header(header)
+                if parsed is None:
+                    # pcapng 或空文件
+                    with open(chunk, 'rb') as f:
+                        shutil.copyfileobj(f, out, 1024 * 1024)
+                    continue
+
+                if not header_written:
+                    out.write(first_header)
+                    header_written = True
+                endian, nano, _, link_type = parsed
+                if (endian, nano, link_type) == output_format:
+                    with open(chunk, 'rb') as f:
+                        f.seek(PCAP_GLOBAL_HEADER_LEN)
+                        shutil.copyfileobj(f, out, 1024 * 1024)
+                else:
+                    LogUtil().warning(self.task_name,
+                                      f"[RotatedCaptureFilter] 分片 {Path(chunk).name} 的格式与输出不一致, 逐条重新编码后拼接")
+                    self._reencode_chunk(str(chunk), out, output_format)
+
+
+    @staticmethod
+    def _choose_output_format(headers: list):
+        """
+        确定拼接后的全局头
+            所有经典 pcap 分片的 字节序+精度+链路层类型 一致时沿用第一个分片的全局头;
+            否则使用第一个分片的字节序和精度, 链路层类型一致时沿用, 不一致时统一为以太网(与 rewrite 输出一致)
+        :param headers: 各分片开头的 24 个字节
+        :return: (全局头字节, (字节序, 是否纳秒, 链路层类型)), 没有经典 pcap 分片时为 (None, None)
+        """
+        pcap_headers = [(header, PcapRecordReader.parse_global_header(header)) for header in headers]
+        pcap_headers = [(header, parsed) for header, parsed in pcap_headers if parsed is not None]
+        if len(pcap_headers) == 0:
+            return None, None
+
+        first_header, (endian, nano, _, link_type) = pcap_headers[0]
+        formats = {(parsed[0], parsed[1], parsed[3]) for _, parsed in pcap_headers}
+        if len(formats) == 1:
+            return first_header, (endian, nano, link_type)
+
+        if len({parsed[3] for _, parsed in pcap_headers}) > 1:
+            link_type = PacketKeyUtil.LINKTYPE_ETHERNET
+        snaplen = max(parsed[2] for _, parsed in pcap_headers)
+        magic = PCAP_MAGIC_NSEC if nano else PCAP_MAGIC_USEC
+        header = struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, snaplen, link_type)
+        return header, (endian, nano, link_type)
+
+
+    @staticmethod
+    def _reencode_chunk(chunk: str, out, output_format: tuple):
+        """
+        把分片的记录按输出格式重新编码后写出
+            字节序/时间戳精度直接换算; 链路层类型不同时(输出为以太网)用 scapy 解析并补上 Ether 层
+        :param chunk: 分片路径
+        :param out: 输出文件对象
+        :param output_format: (字节序, 是否纳秒, 链路层类型)
+        :return:
+        """
+        endian, nano, link_type = output_format
+        record_header = struct.Struct(endian + 'IIII')
+        with PcapRecordReader(chunk) as reader:
+            for record in reader:
+                data, caplen, wirelen = record.data, record.caplen, record.wirelen
+                if reader.link_type != link_type:
+                    pkt = ConnectionsFilter._dissect_record(reader.link_type, data)
+                    if not pkt.haslayer(Ether):
+                        pkt = Ether() / pkt
+                    data = bytes(pkt)
+                    wirelen += len(data) - caplen
+                    caplen = len(data)
+
+                ts_frac = record.ts_frac
+                if reader.nano and not nano:
+                    ts_frac //= 1000
+                elif not reader.nano and nano:
+                    ts_frac *= 1000
+                out.write(record_header.pack(record.ts_sec, ts_frac, caplen, wirelen))
+                out.write(data)
+
+
+    def clear(self):
+        """
+        删除分片目录
+        :return:
+        """
+        if self.sniffer.chunk_dir is not None:
+            shutil.rmtree(self.sniffer.chunk_dir, ignore_errors=True)
@@ -6,7 +6,7 @@ import socket
 import json
 from datetime import datetime
 
-from typing import Dict
+from typing import Dict, List
 
 from core.sniffer.connection.model.connection import Connection
 from core.util.io.log_util import LogUtil
@@ -162,6 +162,31 @@ class ConnectionTrackerThread(BetterThread):
         LogUtil().debug(self.task_name, f"[ConnectionTracker] 连接历史已保存至 {self.log_file_name}")
 
 
+    @staticmethod
+    def load_connections_from_file(log_file_path: str) -> List[Connection]:
+        """
+        从 _save_to_file 保存的 JSON 文件读取连接列表
+        :param log_file_path: 连接日志文件路径
+        :return: Connection 列表
+        """
+        with open(log_file_path, 'r') as file:
+            data = json.load(file)
+
+        connections = []
+        for item in data:
+            connections.append(Connection(
+                local_ip=item['local']['ip'],
+                local_port=int(item['local']['port']),
+                remote_ip=item['remote']['ip'],
+                remote_port=int(item['remote']['port']),
+                status_history=item.get('status_history', []),
+                first_seen=datetime.fromisoformat(item['first_seen']).timestamp(),
+                last_seen=datetime.fromisoformat(item['last_seen']).timestamp(),
+                active=item.get('active', False)
+            ))
+        return connections
+
+
     def _start_monitor(self):
         """启动监控循环"""
         try:
@@ -0,0 +1,3 @@
+from .sniffer_backend_type import SnifferBackendType
+from .capture_filter_mode import CaptureFilterMode
+from .capture_profile import CaptureProfile
@@ -0,0 +1,31 @@
+__doc__ = "自动抓包过滤器模式"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-30"
+
+import enum
+
+
+class CaptureFilterMode(enum.Enum):
+    """
+    自动抓包过滤器模式(sniffer_config.auto_filter)
+        只在没有指定 filter_expr/params 时生效
+    """
+    AUTO = 'auto'       # 代理: 只抓代理服务器的 地址+端口; 直连: 只抓 TCP/UDP, 排除 SSH/DHCP/mDNS/SSDP 等本机噪声和组播
+    TARGET = 'target'   # 代理同 auto; 直连: 只抓目标域名解析出的 A/AAAA 地址(页面引用的第三方资源会被丢弃)
+    OFF = 'off'         # 不生成, 抓取网卡上的全部流量
+
+    @staticmethod
+    def parse(value):
+        """
+        解析配置值, 兼容 True(auto) / False / None(off)
+        :param value: 配置值
+        :return: CaptureFilterMode
+        """
+        if value is True:
+            return CaptureFilterMode.AUTO
+        if value is False or value is None:
+            return CaptureFilterMode.OFF
+        return CaptureFilterMode(str(value))
+
+    def __str__(self):
+        return self.value
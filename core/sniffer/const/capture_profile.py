@@ -0,0 +1,28 @@
+__doc__ = "抓包模板"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-31"
+
+import enum
+
+
+class CaptureProfile(enum.Enum):
+    """
+    抓包模板(sniffer_config.capture_profile): 决定每个包保存多少字节, 记录头中始终保留包的原始长度
+    """
+    FULL = 'full'                                   # 保存完整的包
+    HEADERS = 'headers'                             # 只保存协议头(链路层 + IP + TCP/UDP 头, 含选项)
+    HEADERS_TLS_HANDSHAKE = 'headers+tls-handshake' # 协议头, 另外完整保存 TLS 握手消息和 QUIC 长包头(Initial/Handshake)的包
+
+    @staticmethod
+    def parse(value):
+        """
+        解析配置值
+        :param value: 配置值(为None时是 full)
+        :return: CaptureProfile
+        """
+        if value is None:
+            return CaptureProfile.FULL
+        return CaptureProfile(str(value))
+
+    def __str__(self):
+        return self.value
@@ -0,0 +1,19 @@
+__doc__ = "嗅探器后端类型"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-28"
+
+import enum
+
+
+class SnifferBackendType(enum.Enum):
+    """
+    嗅探器后端类型(sniffer_config.backend)
+    """
+    AUTO = 'auto'           # 按平台选择: Windows 用 dumpcap; Linux 有 tcpdump 用 tcpdump, 否则用 afpacket; macOS 用 tcpdump; 其他平台用 scapy
+    TCPDUMP = 'tcpdump'     # tcpdump 子进程
+    DUMPCAP = 'dumpcap'     # dumpcap 子进程
+    SCAPY = 'scapy'         # scapy 抓包线程(兼容性最好, 速度最慢)
+    AFPACKET = 'afpacket'   # AF_PACKET TPACKET_V3 环形缓冲区(仅 Linux, 纯 Python, 不需要外部程序)
+
+    def __str__(self):
+        return self.value
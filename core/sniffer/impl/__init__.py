@@ -1,3 +1,4 @@
+from .afpacket import afpacket_sniffer
 from .dumpcap import dumpcap_sniffer
 from .scapy import scapy_sniffer
 from .tcpdump import tcpdump_sniffer
\ No newline at end of file
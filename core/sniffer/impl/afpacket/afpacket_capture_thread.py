@@ -0,0 +1,319 @@
+__doc__ = "AF_PACKET TPACKET_V3 内存映射环形缓冲区抓包线程"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-28"
+
+import mmap
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+
+from core.sniffer.const.capture_profile import CaptureProfile
+from core.sniffer.impl.afpacket.bpf_program_util import BpfProgramUtil
+from core.sniffer.util.capture_profile_util import PacketTruncator
+from core.util.io.log_util import LogUtil
+from core.util.multithreading.better_thread import BetterThread
+from core.util.pcap.pcap_record_reader import PCAP_MAGIC_USEC
+
+
+# <linux/if_packet.h>, <linux/if_ether.h>
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_MR_PROMISC = 1
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+PACKET_OUTGOING = 4
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_block_desc(version, offset_to_priv, 之后是 tpacket_hdr_v1)
+BLOCK_STATUS_OFFSET = 8
+BLOCK_HEADER = struct.Struct('IIIII')           # version, offset_to_priv, block_status, num_pkts, offset_to_first_pkt
+# struct tpacket3_hdr
+PACKET_HEADER = struct.Struct('IIIIIIHH')       # tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac, tp_net
+SOCKADDR_LL_OFFSET = 48                         # TPACKET_ALIGN(sizeof(struct tpacket3_hdr)), 之后是 struct sockaddr_ll
+SLL_PKTTYPE_OFFSET = 10
+
+PCAP_RECORD_HEADER = struct.Struct('<IIII')
+
+# 网卡类型(ARPHRD_*) -> pcap 链路层类型
+ARPHRD_TO_LINK_TYPE = {
+    1: 1,           # ARPHRD_ETHER -> DLT_EN10MB
+    772: 1,         # ARPHRD_LOOPBACK(lo 的帧带全 0 的以太网头) -> DLT_EN10MB
+    65534: 101,     # ARPHRD_NONE(tun 等三层网卡) -> DLT_RAW
+    801: 105,       # ARPHRD_IEEE80211 -> DLT_IEEE802_11
+}
+ARPHRD_LOOPBACK = 772
+
+
+class AfPacketCaptureThread(BetterThread):
+    """
+    AF_PACKET 抓包线程(仅 Linux, 不需要 tcpdump 等外部程序)
+        socket 设置 TPACKET_V3, 用 PACKET_RX_RING 申请环形缓冲区并 mmap 到进程内, 内核按块(block)填充包, 不需要逐包系统调用
+        过滤表达式编译成经典 BPF 程序挂载到 socket 上, 不匹配的包在内核中就被丢弃
+        线程每次拿到一个填满(或超时退役)的块, 把块内所有包拼成一次 pcap 写入, 再把块还给内核
+    """
+
+    def __init__(self,
+                 task_name: str,
+                 output_file_path: str,
+                 network_interface: str,
+                 filter_expr: str = None,
+                 params: dict = None,
+                 snaplen: int = 262144,
+                 block_size: int = 1 << 22,
+                 block_count: int = 64,
+                 block_timeout_ms: int = 100,
+                 promisc: bool = True,
+                 rotation: dict = None,
+                 chunk_dir=None,
+                 capture_profile: CaptureProfile = None,
+                 profile_snaplen: int = None
+                 ):
+        """
+        :param task_name: 任务名称
+        :param output_file_path: 输出文件路径
+        :param network_interface: 网卡名称
+        :param filter_expr: 过滤表达式
+        :param params: 生成过滤表达式的参数(找不到 libpcap/tcpdump 时用于生成 BPF 程序)
+        :param snaplen: 每个包最多保存的字节数
+        :param block_size: 环形缓冲区每个块的大小(字节, 页大小的整数倍)
+        :param block_count: 块的数量(环形缓冲区大小 = block_size * block_count)
+        :param block_timeout_ms: 块没有填满时的退役超时(毫秒), 决定写入延迟
+        :param promisc: 是否开启混杂模式
+        :param rotation: 轮转抓包配置(seconds / size_mb, 可为None)
+        :param chunk_dir: 轮转抓包的分片目录
+        :param capture_profile: 抓包模板(headers 由 snaplen 实现, headers+tls-handshake 写入时逐包截断)
+        :param profile_snaplen: headers+tls-handshake 模板中非握手包的截断长度(为None时是默认值)
+        """
+        super().__init__(name=f'AfPacketCaptureThread-{network_interface}', daemon=True)
+        self.task_name = task_name
+        self.output_file = output_file_path
+        self.network_interface = network_interface
+        self.filter_expr = filter_expr
+        self.params = params
+        self.snaplen = snaplen
+        self.block_size = block_size
+        self.block_count = block_count
+        self.block_timeout_ms = block_timeout_ms
+        self.promisc = promisc
+        self.rotation = rotation
+        self.chunk_dir = chunk_dir
+        self.capture_profile = CaptureProfile.parse(capture_profile)
+        self.profile_snaplen = profile_snaplen
+        self._truncator = None
+
+        self.link_type = None
+        self._skip_outgoing = False
+        self._socket = None
+        self._ring = None
+        self._output = None
+        self._chunk_index = 0
+        self._chunk_start = 0.0
+        self._chunk_bytes = 0
+
+        # socket 绑定到网卡后置位(AfPacketSniffer.wait_until_ready 等待它)
+        self.ready_event = threading.Event()
+        self.error = None
+
+        # 抓包统计
+        self.captured_count = 0         # 写入文件的包数
+        self.received_count = 0         # 内核统计: 通过过滤器的包数
+        self.dropped_count = 0          # 内核统计: 环形缓冲区满丢弃的包数
+
+
+    def run(self):
+        try:
+            self._open_socket()
+            LogUtil().debug(self.task_name,
+                            f'[AfPacketCaptureThread] 开始抓包 (网卡: {self.network_interface}, 链路层类型: {self.link_type}, '
+                            f'环形缓冲区: {self.block_count} x {self.block_size // 1024}KB)')
+            self._capture()
+        except Exception as e:
+            self.error = e
+            LogUtil().error(self.task_name, f'[AfPacketCaptureThread] 抓包出现异常: {e}')
+        finally:
+            self.clear()
+            LogUtil().debug(self.task_name, f'[AfPacketCaptureThread] 抓包已结束 (写入包数: {self.captured_count})')
+
+
+    def _open_socket(self):
+        """
+        创建 socket 并映射环形缓冲区
+            创建时协议为 0(不接收任何包), 挂载过滤器后再 bind 到 ETH_P_ALL, 避免过滤器生效前收到不匹配的包
+        :return:
+        """
+        arphrd = int(Path(f'/sys/class/net/{self.network_interface}/type').read_text().strip())
+        self.link_type = ARPHRD_TO_LINK_TYPE.get(arphrd)
+        if self.link_type is None:
+            raise ValueError(f'[AfPacketCaptureThread] 不支持的网卡类型 ARPHRD={arphrd}, 请使用 tcpdump 嗅探器')
+        self._skip_outgoing = arphrd == ARPHRD_LOOPBACK
+        if self.capture_profile == CaptureProfile.HEADERS_TLS_HANDSHAKE:
+            self._truncator = PacketTruncator(self.capture_profile, self.link_type, self.profile_snaplen)
+
+        self._socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        self._socket.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+
+        # struct tpacket_req3: block_size, block_nr, frame_size, frame_nr, retire_blk_tov, sizeof_priv, feature_req_word
+        frame_size = 2048
+        request = struct.pack('IIIIIII', self.block_size, self.block_count, frame_size,
+                              self.block_size // frame_size * self.block_count, self.block_timeout_ms, 0, 0)
+        self._socket.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+        self._ring = mmap.mmap(self._socket.fileno(), self.block_size * self.block_count,
+                               mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+        program = BpfProgramUtil.compile_filter(self.filter_expr, self.link_type, self.snaplen,
+                                                params=self.params, logger_name=self.task_name)
+        if program is not None:
+            BpfProgramUtil.attach(self._socket, program)
+            LogUtil().debug(self.task_name, f'[AfPacketCaptureThread] 已挂载 BPF 过滤器 ({len(program)} 条指令): {self.filter_expr}')
+
+        self._socket.bind((self.network_interface, ETH_P_ALL))
+        if self.promisc:
+            # struct packet_mreq: ifindex, type, alen, address[8]
+            mreq = struct.pack('iHH8s', socket.if_nametoindex(self.network_interface), PACKET_MR_PROMISC, 0, b'')
+            self._socket.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+
+        self._open_output()
+        self.ready_event.set()
+
+
+    def _capture(self):
+        """
+        按顺序处理环形缓冲区中的块, 直到停止
+            停止后等待正在填充的块退役, 把已经交给用户态的块处理完
+        :return:
+        """
+        poller = select.poll()
+        poller.register(self._socket, select.POLLIN | select.POLLERR)
+
+        block_index = 0
+        drain_deadline = None
+        while True:
+            offset = block_index * self.block_size
+            status = struct.unpack_from('I', self._ring, offset + BLOCK_STATUS_OFFSET)[0]
+            if status & TP_STATUS_USER == 0:
+                if self.stop_event.is_set():
+                    # 正在填充的块要等退役超时后才交给用户态, 停止后再等一个超时周期
+                    if drain_deadline is None:
+                        drain_deadline = time.time() + self.block_timeout_ms * 2 / 1000
+                    elif time.time() >= drain_deadline:
+                        break
+                poller.poll(self.block_timeout_ms)
+                continue
+
+            self._write_block(offset)
+            # 把块还给内核
+            struct.pack_into('I', self._ring, offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            block_index = (block_index + 1) % self.block_count
+
+        self._read_kernel_stats()
+
+
+    def _write_block(self, block_offset: int):
+        """
+        把一个块内的所有包拼成 pcap 记录, 一次写入
+        :param block_offset: 块在环形缓冲区中的偏移
+        :return:
+        """
+        _, _, _, packet_count, first_offset = BLOCK_HEADER.unpack_from(self._ring, block_offset)
+        ring = self._ring
+        truncator = self._truncator
+        records = bytearray()
+        written = 0
+
+        packet_offset = block_offset + first_offset
+        for _ in range(packet_count):
+            next_offset, ts_sec, ts_nsec, snaplen, length, _, mac, _ = PACKET_HEADER.unpack_from(ring, packet_offset)
+            if self._skip_outgoing and ring[packet_offset + SOCKADDR_LL_OFFSET + SLL_PKTTYPE_OFFSET] == PACKET_OUTGOING:
+                # lo 上每个包会以发出和收到各出现一次, 与 libpcap 一样只保留收到的
+                pass
+            else:
+                caplen = min(snaplen, self.snaplen)
+                data_offset = packet_offset + mac
+                if truncator is not None:
+                    # 记录头中的 length 仍是原始长度
+                    caplen = min(caplen, truncator.caplen_of(ring[data_offset:data_offset + caplen]))
+                records += PCAP_RECORD_HEADER.pack(ts_sec, ts_nsec // 1000, caplen, length)
+                records += ring[data_offset:data_offset + caplen]
+                written += 1
+            if next_offset == 0:
+                break
+            packet_offset += next_offset
+
+        if written == 0:
+            return
+        if self._should_rotate():
+            self._output.close()
+            self._open_output()
+        self._output.write(records)
+        self._output.flush()
+        self._chunk_bytes += len(records)
+        self.captured_count += written
+
+
+    def _open_output(self):
+        """
+        打开输出文件并写入全局头(轮转抓包时为下一个分片 chunk_<序号>.pcap)
+        :return:
+        """
+        if self.rotation is None:
+            path = self.output_file
+        else:
+            self._chunk_index += 1
+            path = os.path.join(str(self.chunk_dir), f"chunk_{self._chunk_index:05d}.pcap")
+            LogUtil().debug(self.task_name, f'[AfPacketCaptureThread] 写入分片: {path}')
+        self._output = open(path, 'wb', buffering=1024 * 1024)
+        self._output.write(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, 2, 4, 0, 0, self.snaplen, self.link_type))
+        self._output.flush()
+        self._chunk_start = time.time()
+        self._chunk_bytes = 0
+
+
+    def _should_rotate(self) -> bool:
+        """
+        当前分片是否需要轮转(在块的边界上轮转)
+        :return: bool
+        """
+        if self.rotation is None or self._chunk_bytes == 0:
+            return False
+        seconds = self.rotation.get('seconds')
+        size_mb = self.rotation.get('size_mb')
+        if seconds and time.time() - self._chunk_start >= seconds:
+            return True
+        if size_mb and self._chunk_bytes >= size_mb * 1000 * 1000:
+            return True
+        return False
+
+
+    def _read_kernel_stats(self):
+        """
+        读取内核统计(struct tpacket_stats_v3: packets, drops, freeze_q_cnt), 每次读取后内核清零, 所以累加
+        :return:
+        """
+        packets, drops, _ = struct.unpack('III', self._socket.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+        self.received_count += packets
+        self.dropped_count += drops
+
+
+    def clear(self):
+        """
+        关闭输出文件, 解除映射并关闭 socket
+        :return:
+        """
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
@@ -0,0 +1,146 @@
+__doc__ = "AF_PACKET 嗅探器"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-28"
+
+import time
+
+from core.sniffer.impl.afpacket.afpacket_capture_thread import AfPacketCaptureThread
+from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.sniffer.model.capture_stats import CaptureStats
+from core.sniffer.util.capture_profile_util import CaptureProfileUtil
+from core.util.io.log_util import LogUtil
+
+
+class AfPacketSniffer(TrafficSniffer):
+    """
+    AF_PACKET 嗅探器(仅 Linux)
+        纯 Python 的高速抓包: TPACKET_V3 内存映射环形缓冲区 + 内核 BPF 过滤 + 按块写 pcap, 不启动子进程
+        没有安装 tcpdump 时代替 scapy 作为 Linux 上的默认嗅探器, 需要 root 或 CAP_NET_RAW
+    """
+
+    def __init__(self,
+                 task_name: str,
+                 output_file_path: str,
+                 network_interface: str = None,
+                 params: dict = None,
+                 filter_expr: str = None,
+                 rotation: dict = None,
+                 capture_profile: str = None,
+                 snaplen: int = None,
+                 afpacket_config: dict = None
+                 ):
+        """
+
+        :param task_name:           任务名称
+        :param output_file_path:    输出文件路径
+        :param network_interface:   网络接口
+        :param params:              指令参数
+        :param rotation:            轮转抓包配置(可为None)
+        :param capture_profile:     抓包模板(可为None, 见 CaptureProfile)
+        :param snaplen:             headers 模板的截断长度(可为None, 默认 160)
+        :param afpacket_config:     环形缓冲区配置(可为None)
+                                        - block_size_kb: 每个块的大小(默认 4096 KB)
+                                        - block_count: 块的数量(默认 64)
+                                        - block_timeout_ms: 块的退役超时(默认 100 毫秒)
+                                        - promisc: 是否开启混杂模式(默认 True)
+                                        - snaplen: 每个包最多保存的字节数(默认 262144, headers 模板下不超过 sniffer_config.snaplen)
+        """
+        super().__init__(
+            task_name=task_name,
+            output_file_path=output_file_path,
+            network_interface=network_interface,
+            params=params,
+            filter_expr=filter_expr,
+            rotation=rotation,
+            capture_profile=capture_profile,
+            snaplen=snaplen
+        )
+        self.afpacket_config = afpacket_config if afpacket_config is not None else {}
+
+        # 生成过滤表达式(如果未显式指定)
+        self.generate_filter_expr_by_params()
+
+        # 创建抓包线程
+        self.capture_thread = AfPacketCaptureThread(
+            task_name=self.task_name,
+            output_file_path=self.output_file,
+            network_interface=self.network_interface,
+            filter_expr=self.filter_expr,
+            params=self.params,
+            snaplen=min(self.afpacket_config.get('snaplen', 262144), CaptureProfileUtil.get_snaplen(self.capture_profile, self.snaplen)),
+            block_size=self.afpacket_config.get('block_size_kb', 4096) * 1024,
+            block_count=self.afpacket_config.get('block_count', 64),
+            block_timeout_ms=self.afpacket_config.get('block_timeout_ms', 100),
+            promisc=self.afpacket_config.get('promisc', True),
+            rotation=self.rotation,
+            chunk_dir=self.chunk_dir,
+            capture_profile=self.capture_profile,
+            profile_snaplen=self.snaplen,
+        )
+
+
+    def generate_startup_instruction(self):
+        """
+        不启动子进程, 没有启动指令
+        """
+        self.startup_instruction = None
+
+
+    def start_sniffer(self):
+        """
+        启动抓包
+        """
+        self.capture_thread.start()
+
+
+    def wait_until_ready(self, timeout: float) -> bool:
+        """
+        等待 socket 绑定到网卡
+        :param timeout: 超时时间(秒)
+        :return: 是否就绪
+        """
+        deadline = time.time() + timeout
+        while self.capture_thread.ready_event.wait(0.05) is False:
+            if self.capture_thread.is_alive() is False:
+                LogUtil().error(self.task_name, f"[AfPacketSniffer] 抓包线程已退出, 异常: {self.capture_thread.error}")
+                return False
+            if time.time() >= deadline:
+                LogUtil().warning(self.task_name, f"[AfPacketSniffer] {timeout}s 内 socket 未就绪")
+                return False
+        return True
+
+
+    def stop_sniffer(self):
+        """
+        停止抓包(等待抓包线程写完环形缓冲区中剩余的块)
+        """
+        self.capture_thread.stop()
+        self.capture_thread.join(timeout=5)
+
+
+    def get_capture_stats(self):
+        """
+        写入的包数和内核统计(PACKET_STATISTICS)
+        :return: CaptureStats
+        """
+        return CaptureStats(
+            source='afpacket',
+            captured=self.capture_thread.captured_count,
+            received=self.capture_thread.received_count,
+            dropped_by_kernel=self.capture_thread.dropped_count,
+        )
+
+
+    @staticmethod
+    def creat_sniffer_by_config(task_name, config: dict):
+        return AfPacketSniffer(
+            task_name=task_name,
+            output_file_path=config.get('output_file_path'),
+            network_interface=config.get('network_interface'),
+            params=config.get('params'),
+            filter_expr=config.get('filter_expr'),
+            rotation=config.get('rotation'),
+            capture_profile=config.get('capture_profile'),
+            snaplen=config.get('snaplen'),
+            afpacket_config=config.get('afpacket_config'),
+        )
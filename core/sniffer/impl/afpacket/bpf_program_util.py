@@ -0,0 +1,319 @@
+__doc__ = "经典 BPF 程序的编译与挂载"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-28"
+
+import ctypes
+import ctypes.util
+import ipaddress
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+
+from core.util.io.log_util import LogUtil
+from core.util.pcap.pcap_record_reader import PCAP_MAGIC_USEC
+
+
+# 经典 BPF 指令(code, jt, jf, k)
+BPF_LD_W_ABS = 0x20     # ld  [k]
+BPF_LD_H_ABS = 0x28     # ldh [k]
+BPF_LD_B_ABS = 0x30     # ldb [k]
+BPF_LD_H_IND = 0x48     # ldh [x + k]
+BPF_LDX_B_MSH = 0xb1    # ldxb 4 * ([k] & 0xf)
+BPF_JEQ_K = 0x15        # jeq #k
+BPF_JSET_K = 0x45       # jset #k
+BPF_RET_K = 0x06        # ret #k
+
+SO_ATTACH_FILTER = 26
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERNET_HEADER_LEN = 14
+
+PROTOCOL_NUMBERS = {
+    'tcp': (6, 6),          # (IPv4 协议号, IPv6 下一个头)
+    'udp': (17, 17),
+    'icmp': (1, 58),
+}
+
+
+class _BpfAssembler:
+    """
+    带标签的 BPF 汇编器: 跳转目标写成标签名, 最后统一换算成相对偏移
+        'accept'/'reject' 两个标签固定在程序末尾
+    """
+
+    def __init__(self):
+        self._instructions = []     # [code, jt, jf, k], jt/jf 为标签名或 None(下一条)
+        self._labels = {}
+
+    def emit(self, code: int, k: int = 0, jt: str = None, jf: str = None):
+        self._instructions.append([code, jt, jf, k])
+
+    def label(self, name: str):
+        self._labels[name] = len(self._instructions)
+
+    def assemble(self, snaplen: int) -> list:
+        self.label('accept')
+        self.emit(BPF_RET_K, snaplen)
+        self.label('reject')
+        self.emit(BPF_RET_K, 0)
+
+        program = []
+        for index, (code, jt, jf, k) in enumerate(self._instructions):
+            offsets = []
+            for target in (jt, jf):
+                offset = 0 if target is None else self._labels[target] - index - 1
+                if offset < 0 or offset > 255:
+                    raise ValueError(f'[BpfProgramUtil] 跳转偏移超出范围: {offset}')
+                offsets.append(offset)
+            program.append((code, offsets[0], offsets[1], k))
+        return program
+
+
+class BpfProgramUtil:
+    """
+    经典 BPF 程序的编译与挂载(供 AF_PACKET 嗅探器使用, 不依赖外部进程抓包)
+        编译 filter_expr 依次尝试: libpcap(ctypes 调用 pcap_compile_nopcap) -> tcpdump -ddd
+        两者都没有时, 对由 params(host/port/tcp/udp/icmp)生成的表达式, 用内置的生成器直接生成以太网上的等价程序
+        都不行时返回 None, 调用方不挂载过滤器(抓取全部流量, 由之后的连接过滤处理)
+    """
+
+    @staticmethod
+    def compile_filter(filter_expr: str, link_type: int, snaplen: int, params: dict = None,
+                       logger_name: str = 'main'):
+        """
+        编译过滤表达式
+        :param filter_expr: 过滤表达式(为空时不需要过滤器)
+        :param link_type: pcap 链路层类型
+        :param snaplen: 快照长度(程序接受时返回的长度)
+        :param params: 生成 filter_expr 的参数(可为None)
+        :param logger_name: 日志记录器名称
+        :return: [(code, jt, jf, k)], 不需要或无法编译时返回 None
+        """
+        if not filter_expr:
+            return None
+
+        for compiler in (BpfProgramUtil._compile_by_libpcap, BpfProgramUtil._compile_by_tcpdump):
+            try:
+                program = compiler(filter_expr, link_type, snaplen)
+            except (OSError, ValueError, subprocess.SubprocessError) as e:
+                LogUtil().debug(logger_name, f"[BpfProgramUtil] {compiler.__name__} 编译失败: {e}")
+                continue
+            if program is not None:
+                return program
+
+        if params and link_type == 1:
+            try:
+                return BpfProgramUtil.build_from_params(params, snaplen)
+            except ValueError as e:
+                LogUtil().debug(logger_name, f"[BpfProgramUtil] 无法按参数生成过滤程序: {e}")
+
+        LogUtil().warning(logger_name, f"[BpfProgramUtil] 找不到 libpcap/tcpdump, 无法编译过滤表达式 '{filter_expr}', 不在内核中过滤")
+        return None
+
+
+    @staticmethod
+    def has_compiler() -> bool:
+        """
+        是否能编译任意过滤表达式(有 libpcap 或 tcpdump; scapy 编译过滤器时同样依赖它们)
+        :return: bool
+        """
+        return ctypes.util.find_library('pcap') is not None or shutil.which('tcpdump') is not None
+
+
+    @staticmethod
+    def _compile_by_libpcap(filter_expr: str, link_type: int, snaplen: int):
+        """
+        用 libpcap 的 pcap_compile_nopcap 编译
+        :return: 程序, 找不到 libpcap 返回 None
+        """
+        library_name = ctypes.util.find_library('pcap')
+        if library_name is None:
+            return None
+        libpcap = ctypes.CDLL(library_name)
+
+        class BpfInsn(ctypes.Structure):
+            _fields_ = [('code', ctypes.c_ushort), ('jt', ctypes.c_ubyte), ('jf', ctypes.c_ubyte), ('k', ctypes.c_uint32)]
+
+        class BpfProgram(ctypes.Structure):
+            _fields_ = [('bf_len', ctypes.c_uint), ('bf_insns', ctypes.POINTER(BpfInsn))]
+
+        program = BpfProgram()
+        result = libpcap.pcap_compile_nopcap(ctypes.c_int(snaplen), ctypes.c_int(link_type), ctypes.byref(program),
+                                             filter_expr.encode('utf-8'), ctypes.c_int(1), ctypes.c_uint32(0xffffffff))
+        if result != 0:
+            raise ValueError(f'libpcap 无法编译表达式: {filter_expr}')
+        try:
+            return [(program.bf_insns[i].code, program.bf_insns[i].jt, program.bf_insns[i].jf, program.bf_insns[i].k)
+                    for i in range(program.bf_len)]
+        finally:
+            libpcap.pcap_freecode(ctypes.byref(program))
+
+
+    @staticmethod
+    def _compile_by_tcpdump(filter_expr: str, link_type: int, snaplen: int):
+        """
+        用 tcpdump -ddd 编译(输出第一行是指令数, 之后每行一条 "code jt jf k")
+            读取一个只有全局头的 pcap(-r), tcpdump 按它的链路层类型编译, 不需要打开网卡
+        :return: 程序, 找不到 tcpdump 返回 None
+        """
+        from core.sniffer.impl.tcpdump.tcpdump_util import TcpdumpUtil
+
+        if shutil.which('tcpdump') is None:
+            return None
+        with tempfile.NamedTemporaryFile(suffix='.pcap', delete=False) as empty_pcap:
+            empty_pcap.write(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, 2, 4, 0, 0, snaplen, link_type))
+        try:
+            result = subprocess.run(TcpdumpUtil.get_tcpdump_cmd() + ['-ddd', '-r', empty_pcap.name, filter_expr],
+                                    capture_output=True, text=True, timeout=10)
+        finally:
+            os.remove(empty_pcap.name)
+        if result.returncode != 0:
+            raise ValueError(result.stderr.strip())
+        lines = result.stdout.split()
+        count = int(lines[0])
+        values = [int(value) for value in lines[1:1 + count * 4]]
+        if len(values) != count * 4:
+            raise ValueError(f'tcpdump -ddd 输出不完整: {result.stdout!r}')
+        return [tuple(values[i:i + 4]) for i in range(0, len(values), 4)]
+
+
+    @staticmethod
+    def build_from_params(params: dict, snaplen: int) -> list:
+        """
+        按 params 生成以太网上的过滤程序, 与 TrafficSniffer.generate_filter_expr_by_params 生成的表达式等价:
+            host <ip> and port <port> and (tcp or udp or icmp), 各项都是可选的; host 可以是地址列表(任一地址匹配即可)
+            注: 与 tcpdump 一样只看 IPv6 的固定头(不跟随扩展头), IPv4 分片只有第一片能匹配端口
+        :param params: 参数(host/port/tcp/udp/icmp)
+        :param snaplen: 快照长度
+        :return: 程序
+        """
+        asm = _BpfAssembler()
+        term_index = 0
+
+        host = params.get('host')
+        if host is not None:
+            hosts = host if isinstance(host, (list, tuple)) else [host]
+            BpfProgramUtil._emit_hosts(asm, [ipaddress.ip_address(str(item)) for item in hosts], f'term{term_index}')
+            term_index += 1
+
+        port = params.get('port')
+        if port is not None:
+            BpfProgramUtil._emit_port(asm, int(port), f'term{term_index}')
+            term_index += 1
+
+        protocols = [name for name in ('tcp', 'udp', 'icmp') if params.get(name) is True]
+        if len(protocols) > 0:
+            BpfProgramUtil._emit_protocols(asm, protocols, f'term{term_index}')
+
+        # 所有条件都满足, 落到末尾的 accept
+        return asm.assemble(snaplen)
+
+
+    @staticmethod
+    def _emit_hosts(asm: _BpfAssembler, addresses: list, prefix: str):
+        """源地址或目的地址等于 addresses 中任一地址, 都不满足跳到 reject, 满足继续下一项"""
+        passed = f'{prefix}_pass'
+        for index, address in enumerate(addresses):
+            is_last = index == len(addresses) - 1
+            mismatch = 'reject' if is_last else f'{prefix}_host{index + 1}'
+            BpfProgramUtil._emit_host(asm, address, f'{prefix}_host{index}', passed, mismatch)
+            if not is_last:
+                asm.label(mismatch)
+        asm.label(passed)
+
+
+    @staticmethod
+    def _emit_host(asm: _BpfAssembler, address, prefix: str, passed: str, mismatch: str):
+        """源地址或目的地址等于 address 时跳到 passed, 否则跳到 mismatch"""
+        asm.emit(BPF_LD_H_ABS, 12)
+        if address.version == 4:
+            asm.emit(BPF_JEQ_K, ETHERTYPE_IPV4, jf=mismatch)
+            value = struct.unpack('!I', address.packed)[0]
+            asm.emit(BPF_LD_W_ABS, ETHERNET_HEADER_LEN + 12)
+            asm.emit(BPF_JEQ_K, value, jt=passed)
+            asm.emit(BPF_LD_W_ABS, ETHERNET_HEADER_LEN + 16)
+            asm.emit(BPF_JEQ_K, value, jt=passed, jf=mismatch)
+        else:
+            asm.emit(BPF_JEQ_K, ETHERTYPE_IPV6, jf=mismatch)
+            words = struct.unpack('!IIII', address.packed)
+            for direction, base in (('src', ETHERNET_HEADER_LEN + 8), ('dst', ETHERNET_HEADER_LEN + 24)):
+                next_label = mismatch if direction == 'dst' else f'{prefix}_dst'
+                for index, word in enumerate(words):
+                    asm.emit(BPF_LD_W_ABS, base + index * 4)
+                    asm.emit(BPF_JEQ_K, word, jt=passed if index == 3 else None, jf=next_label)
+                if direction == 'src':
+                    asm.label(next_label)
+
+
+    @staticmethod
+    def _emit_port(asm: _BpfAssembler, port: int, prefix: str):
+        """TCP/UDP 源端口或目的端口等于 port(IPv4 和 IPv6)"""
+        passed = f'{prefix}_pass'
+        ipv4 = f'{prefix}_v4'
+        ipv4_ports = f'{prefix}_v4_ports'
+        ipv6_ports = f'{prefix}_v6_ports'
+
+        asm.emit(BPF_LD_H_ABS, 12)
+        asm.emit(BPF_JEQ_K, ETHERTYPE_IPV4, jt=ipv4)
+        asm.emit(BPF_JEQ_K, ETHERTYPE_IPV6, jf='reject')
+        # IPv6: 下一个头是 TCP/UDP, 端口在 40 字节的固定头之后
+        asm.emit(BPF_LD_B_ABS, ETHERNET_HEADER_LEN + 6)
+        asm.emit(BPF_JEQ_K, 6, jt=ipv6_ports)
+        asm.emit(BPF_JEQ_K, 17, jf='reject')
+        asm.label(ipv6_ports)
+        asm.emit(BPF_LD_H_ABS, ETHERNET_HEADER_LEN + 40)
+        asm.emit(BPF_JEQ_K, port, jt=passed)
+        asm.emit(BPF_LD_H_ABS, ETHERNET_HEADER_LEN + 42)
+        asm.emit(BPF_JEQ_K, port, jt=passed, jf='reject')
+        # IPv4: 协议是 TCP/UDP, 不是后续分片, 端口在 IHL*4 字节之后
+        asm.label(ipv4)
+        asm.emit(BPF_LD_B_ABS, ETHERNET_HEADER_LEN + 9)
+        asm.emit(BPF_JEQ_K, 6, jt=ipv4_ports)
+        asm.emit(BPF_JEQ_K, 17, jf='reject')
+        asm.label(ipv4_ports)
+        asm.emit(BPF_LD_H_ABS, ETHERNET_HEADER_LEN + 6)
+        asm.emit(BPF_JSET_K, 0x1fff, jt='reject')
+        asm.emit(BPF_LDX_B_MSH, ETHERNET_HEADER_LEN)
+        asm.emit(BPF_LD_H_IND, ETHERNET_HEADER_LEN)
+        asm.emit(BPF_JEQ_K, port, jt=passed)
+        asm.emit(BPF_LD_H_IND, ETHERNET_HEADER_LEN + 2)
+        asm.emit(BPF_JEQ_K, port, jt=passed, jf='reject')
+        asm.label(passed)
+
+
+    @staticmethod
+    def _emit_protocols(asm: _BpfAssembler, protocols: list, prefix: str):
+        """IPv4 协议号 / IPv6 下一个头属于 protocols 之一"""
+        passed = f'{prefix}_pass'
+        ipv4 = f'{prefix}_v4'
+
+        asm.emit(BPF_LD_H_ABS, 12)
+        asm.emit(BPF_JEQ_K, ETHERTYPE_IPV4, jt=ipv4)
+        asm.emit(BPF_JEQ_K, ETHERTYPE_IPV6, jf='reject')
+        for version, offset in ((6, ETHERNET_HEADER_LEN + 6), (4, ETHERNET_HEADER_LEN + 9)):
+            if version == 4:
+                asm.label(ipv4)
+            asm.emit(BPF_LD_B_ABS, offset)
+            for index, name in enumerate(protocols):
+                number = PROTOCOL_NUMBERS[name][0 if version == 4 else 1]
+                last = index == len(protocols) - 1
+                asm.emit(BPF_JEQ_K, number, jt=passed, jf='reject' if last else None)
+        asm.label(passed)
+
+
+    @staticmethod
+    def attach(sock: socket.socket, program: list):
+        """
+        把程序挂载到 socket 上(SO_ATTACH_FILTER, 内核会复制一份)
+        :param sock: socket
+        :param program: [(code, jt, jf, k)]
+        :return:
+        """
+        instructions = b''.join(struct.pack('HBBI', *instruction) for instruction in program)
+        buffer = ctypes.create_string_buffer(instructions)
+        fprog = struct.pack('HP', len(program), ctypes.addressof(buffer))
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
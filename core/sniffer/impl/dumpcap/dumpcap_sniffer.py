@@ -2,10 +2,15 @@ __doc__ = "dumpcap 嗅探器"
 __author__ = "Li Qingyun"
 __date__ = "2025-12-03"
 
-from time import sleep
+import re
+import signal
 
+from core.sniffer.const.capture_profile import CaptureProfile
 from core.sniffer.impl.dumpcap.dumpcap_util import DumpcapUtil
 from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.sniffer.model.capture_stats import CaptureStats
+from core.sniffer.util.capture_profile_util import CaptureProfileUtil
+from core.util.io.log_util import LogUtil
 from core.util.multiprocessing import OuterSubProcessHelper
 
 
@@ -13,12 +18,19 @@ class DumpcapSniffer(TrafficSniffer):
     """
     dumpcap 嗅探器
     """
+
+    # 开始抓包时 dumpcap 在 stderr 输出: "Capturing on 'Ethernet'"
+    READY_PATTERNS = ['Capturing on']
+
     def __init__(self,
                  task_name: str,
                  output_file_path: str,
                  network_interface: str = None,
                  params: dict = None,
-                 filter_expr: str = None
+                 filter_expr: str = None,
+                 rotation: dict = None,
+                 capture_profile: str = None,
+                 snaplen: int = None
                  ):
         """
 
@@ -26,6 +38,9 @@ class DumpcapSniffer(TrafficSniffer):
         :param output_file_path:    输出文件路径
         :param network_interface:   网络接口
         :param params:              指令参数
+        :param rotation:            轮转抓包配置(可为None)
+        :param capture_profile:     抓包模板(可为None, 见 CaptureProfile)
+        :param snaplen:             headers 模板的截断长度(可为None, 默认 160)
         """
 
         # 1. 初始化父类
@@ -39,7 +54,10 @@ class DumpcapSniffer(TrafficSniffer):
             output_file_path=output_file_path,
             network_interface=network_interface,
             params=params,
-            filter_expr=filter_expr
+            filter_expr=filter_expr,
+            rotation=rotation,
+            capture_profile=capture_profile,
+            snaplen=snaplen
         )
 
         # 2. dumpcap 指令位置
@@ -60,6 +78,8 @@ class DumpcapSniffer(TrafficSniffer):
             name="dumpcap子进程",
             start_command=self.startup_instruction,
             logger_name=self.task_name,
+            ready_patterns=DumpcapSniffer.READY_PATTERNS,
+            stop_signal=signal.SIGINT,
         )
         pass
 
@@ -74,6 +94,25 @@ class DumpcapSniffer(TrafficSniffer):
             '-B', '50',                             # 缓冲区大小, 单位'MB'
             '-f', self.filter_expr                  # 过滤表达式
         ]
+
+        # 抓包模板: headers 直接设置 snaplen(记录头中保留原始长度);
+        #   需要逐包判断的模板完整抓包, 停止后再截断, 截断只支持经典 pcap, 用 -P 输出 pcap
+        if self.capture_profile == CaptureProfile.HEADERS:
+            self.startup_instruction += ['-s', str(CaptureProfileUtil.get_snaplen(self.capture_profile, self.snaplen))]
+        elif self.capture_profile == CaptureProfile.HEADERS_TLS_HANDSHAKE:
+            self.startup_instruction += ['-P']
+
+        # 轮转抓包: 写到分片目录, 分片名为 chunk_<序号>_<时间>.pcapng
+        #   -b duration: 按秒数轮转, -b filesize: 按大小轮转(单位kB)
+        if self.is_rotating():
+            seconds = self.rotation.get('seconds')
+            size_mb = self.rotation.get('size_mb')
+            if seconds:
+                self.startup_instruction += ['-b', f'duration:{int(seconds)}']
+            if size_mb:
+                self.startup_instruction += ['-b', f'filesize:{max(1, int(size_mb * 1000))}']
+            self.startup_instruction[self.startup_instruction.index('-w') + 1] = \
+                str(self.chunk_dir / f"{TrafficSniffer.CHUNK_PREFIX}.pcapng")
         pass
 
 
@@ -82,16 +121,69 @@ class DumpcapSniffer(TrafficSniffer):
         启动抓包
         """
         self.dumpcap_subprocess.start_process()
-        sleep(1)
         pass
 
+    def wait_until_ready(self, timeout: float) -> bool:
+        """
+        等待 dumpcap 输出 "Capturing on"(或输出文件出现 pcapng 文件头)
+        :param timeout: 超时时间(秒)
+        :return: 是否就绪
+        """
+        return self.dumpcap_subprocess.wait_until_ready(timeout, ready_check=self._has_output_header)
+
     def stop_sniffer(self):
         """
         停止抓包
+            Linux/macOS 上先发送 SIGINT, dumpcap 写完文件后退出; Windows 上直接 terminate
         """
         self.dumpcap_subprocess.stop_process()
+        if self.dumpcap_subprocess.stopped_gracefully is False:
+            LogUtil().warning(self.task_name, f"[DumpcapSniffer] dumpcap 未正常退出, 输出文件末尾可能不完整(过滤前会修复)")
         pass
 
+    def needs_post_truncation(self) -> bool:
+        """
+        dumpcap 不能逐包决定 snaplen, headers+tls-handshake 需要停止后截断
+        :return: bool
+        """
+        return self.capture_profile == CaptureProfile.HEADERS_TLS_HANDSHAKE
+
+    def get_capture_stats(self):
+        """
+        从 dumpcap 退出时的输出中解析抓包统计
+        :return: CaptureStats
+        """
+        return DumpcapSniffer.parse_capture_stats(self.dumpcap_subprocess.get_output())
+
+    @staticmethod
+    def parse_capture_stats(output: str) -> CaptureStats:
+        """
+        解析 dumpcap 退出时打印的统计:
+            Packets captured: 52
+            Packets received/dropped on interface 'eth0': 52/3 (pcap:3/dumpcap:0/flushed:0/ps_ifdrop:0) (94.5%)
+            括号中的明细只有部分版本/平台有, 没有明细时丢包数都计为内核丢包
+        :param output: dumpcap 的输出
+        :return: CaptureStats(没有匹配的项为 None)
+        """
+        output = output or ''
+        stats = CaptureStats(source='dumpcap')
+
+        match = re.search(r'Packets captured: (\d+)', output)
+        if match:
+            stats.captured = int(match.group(1))
+
+        match = re.search(r"Packets received/dropped on interface .*?: (\d+)/(\d+)", output)
+        if match:
+            stats.received = int(match.group(1))
+            stats.dropped_by_kernel = int(match.group(2))
+
+        match = re.search(r'\(pcap:(\d+)/dumpcap:(\d+)/flushed:(\d+)/ps_ifdrop:(\d+)\)', output)
+        if match:
+            stats.dropped_by_kernel = int(match.group(1))
+            stats.dropped_by_sniffer = int(match.group(2)) + int(match.group(3))
+            stats.dropped_by_interface = int(match.group(4))
+        return stats
+
     @staticmethod
     def creat_sniffer_by_config(task_name, config: dict):
         return DumpcapSniffer(
@@ -100,6 +192,9 @@ class DumpcapSniffer(TrafficSniffer):
             network_interface=config.get('network_interface'),
             params=config.get('params'),
             filter_expr=config.get('filter_expr'),
+            rotation=config.get('rotation'),
+            capture_profile=config.get('capture_profile'),
+            snaplen=config.get('snaplen'),
         )
         pass
 
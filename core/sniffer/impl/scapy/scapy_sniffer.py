@@ -2,8 +2,12 @@ __doc__ = "scapy 嗅探器"
 __author__ = "Li Qingyun"
 __date__ = "2025-12-03"
 
+import time
+
 from core.sniffer.impl.scapy.scapy_thread import ScapyThread
 from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.sniffer.model.capture_stats import CaptureStats
+from core.util.io.log_util import LogUtil
 
 
 class ScapySniffer(TrafficSniffer):
@@ -22,7 +26,11 @@ class ScapySniffer(TrafficSniffer):
                  output_file_path: str,
                  network_interface: str = None,
                  params: dict = None,
-                 filter_expr: str = None
+                 filter_expr: str = None,
+                 rotation: dict = None,
+                 capture_profile: str = None,
+                 snaplen: int = None,
+                 scapy_config: dict = None
                  ):
         """
 
@@ -30,6 +38,10 @@ class ScapySniffer(TrafficSniffer):
         :param output_file_path:    输出文件路径
         :param network_interface:   网络接口
         :param params:              指令参数列表
+        :param rotation:            轮转抓包配置(可为None)
+        :param capture_profile:     抓包模板(可为None, 见 CaptureProfile)
+        :param snaplen:             headers 模板的截断长度(可为None, 默认 160)
+        :param scapy_config:        写入队列配置(可为None): queue_size / batch_size / flush_interval
         """
 
         # 1. 初始化父类
@@ -37,13 +49,17 @@ class ScapySniffer(TrafficSniffer):
         self.output_file_path = output_file_path
         self.network_interface = network_interface
         self.params = params
+        self.scapy_config = scapy_config if scapy_config is not None else {}
 
         super().__init__(
             task_name=task_name,
             output_file_path=output_file_path,
             network_interface=network_interface,
             params=params,
-            filter_expr=filter_expr
+            filter_expr=filter_expr,
+            rotation=rotation,
+            capture_profile=capture_profile,
+            snaplen=snaplen
         )
 
         # 生成过滤表达式(如果未显式指定)
@@ -55,6 +71,11 @@ class ScapySniffer(TrafficSniffer):
                                                                                 'output_file_path': self.output_file,
                                                                                 'network_interface': self.network_interface,
                                                                                 'filter_expr': self.filter_expr,
+                                                                                'rotation': self.rotation,
+                                                                                'chunk_dir': self.chunk_dir,
+                                                                                'capture_profile': self.capture_profile,
+                                                                                'snaplen': self.snaplen,
+                                                                                **self.scapy_config,
                                                                              })
         pass
 
@@ -66,14 +87,43 @@ class ScapySniffer(TrafficSniffer):
         self.scapy_thread.start()
         pass
 
+    def wait_until_ready(self, timeout: float) -> bool:
+        """
+        等待 scapy 打开抓包 socket
+        :param timeout: 超时时间(秒)
+        :return: 是否就绪
+        """
+        deadline = time.time() + timeout
+        while self.scapy_thread.ready_event.wait(0.05) is False:
+            if self.scapy_thread.is_alive() is False:
+                LogUtil().error(self.task_name, f"[ScapySniffer] 抓包线程已退出, 异常: {self.scapy_thread.error}")
+                return False
+            if time.time() >= deadline:
+                LogUtil().warning(self.task_name, f"[ScapySniffer] {timeout}s 内抓包 socket 未打开")
+                return False
+        return True
+
     def stop_sniffer(self):
         """
         停止抓包
         """
         if self.scapy_thread is not None:
             self.scapy_thread.stop()
+            # 等待写入线程写完队列中的包, 之后读取 pcap 才是完整的
+            self.scapy_thread.join(timeout=5)
         pass
 
+    def get_capture_stats(self):
+        """
+        scapy 抓包线程的计数(拿不到内核丢包数)
+        :return: CaptureStats
+        """
+        return CaptureStats(
+            source='scapy',
+            captured=self.scapy_thread.captured_count,
+            dropped_by_sniffer=self.scapy_thread.dropped_count,
+        )
+
     @staticmethod
     def creat_sniffer_by_config(task_name, config: dict):
         return ScapySniffer(
@@ -82,6 +132,10 @@ class ScapySniffer(TrafficSniffer):
             network_interface=config.get('network_interface'),
             params=config.get('params'),
             filter_expr=config.get('filter_expr'),
+            rotation=config.get('rotation'),
+            capture_profile=config.get('capture_profile'),
+            snaplen=config.get('snaplen'),
+            scapy_config=config.get('scapy_config'),
         )
         pass
 
@@ -3,9 +3,12 @@ __author__ = "Li Qingyun"
 __date__ = "2025-02-27"
 
 import platform
+import queue
 
 from scapy.all import *
 
+from core.sniffer.const.capture_profile import CaptureProfile
+from core.sniffer.util.capture_profile_util import CaptureProfileUtil, PacketTruncator
 from core.util.io.log_util import LogUtil
 from core.util.multithreading.better_thread import BetterThread
 from core.util.network.network_interface_util import NetworkInterfaceUtil
@@ -17,13 +20,27 @@ class ScapyThread(BetterThread):
                  task_name,
                  output_file_path,
                  network_interface=None,
-                 filter_expr=None
+                 filter_expr=None,
+                 rotation=None,
+                 chunk_dir=None,
+                 queue_size=20000,
+                 batch_size=512,
+                 flush_interval=1.0,
+                 capture_profile=None,
+                 snaplen=None
                  ):
         """
 
         :param output_file_path: 输出文件名命名
         :param network_interface: 网卡名称
         :param filter_expr:
+        :param rotation: 轮转抓包配置(seconds / size_mb, 可为None)
+        :param chunk_dir: 轮转抓包的分片目录
+        :param queue_size: 抓包线程与写入线程之间的队列长度, 队列满时丢包
+        :param batch_size: 写入线程每批最多取出的包数
+        :param flush_interval: 写入文件的刷新间隔(秒)
+        :param capture_profile: 抓包模板(CaptureProfile, 为None时完整保存)
+        :param snaplen: 抓包模板的截断长度(为None时是默认值)
         """
         super().__init__()
         # 任务名称
@@ -37,6 +54,24 @@ class ScapyThread(BetterThread):
             self.filter_expr = ''
         # 网卡
         self.network_interface = self._detect_interface(network_interface)
+        # 轮转抓包
+        self.rotation = rotation
+        self.chunk_dir = chunk_dir
+        self._chunk_index = 0
+        # 写入队列
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # 抓包模板: 非 full 时写入前逐包截断(链路层类型取第一个包的)
+        self.capture_profile = CaptureProfile.parse(capture_profile)
+        self.snaplen = snaplen
+        self._truncator = None
+        # 抓包 socket 打开后置位(ScapySniffer.wait_until_ready 等待它)
+        self.ready_event = threading.Event()
+        self.error = None
+        # 抓包统计
+        self.captured_count = 0     # 写入文件的包数
+        self.dropped_count = 0      # 写入队列满丢弃的包数
 
 
     def _detect_interface(self,network_interface):
@@ -63,60 +98,164 @@ class ScapyThread(BetterThread):
             LogUtil().debug(self.task_name, '[ScapyProcess] 抓包程序正在启动')
             self._capture()
             LogUtil().debug(self.task_name, '[ScapyProcess] 抓包程序已结束')
-        except PermissionError:
+        except PermissionError as e:
+            self.error = e
             LogUtil().error(self.task_name, "需要root权限执行抓包，请使用sudo运行脚本")
             exit(1)
 
 
     def _capture(self):
         """
-                抓取流量的核心方法
-                :return:
-                """
+        抓取流量的核心方法
+            AsyncSniffer 在整个抓包期间只打开一次 socket, 回调中只把包放进队列;
+            写入线程按批取出, 缓冲写入并按 flush_interval 定期刷新, 不再每个包都刷新一次
+        :return:
+        """
         LogUtil().debug(self.task_name, f'[ScapyProcess] 开启 sniff')
         LogUtil().debug(self.task_name, f'[ScapyProcess] 网卡: {self.network_interface}')
         LogUtil().debug(self.task_name, f'[ScapyProcess] pcap文件: {self.output_file}')
 
-        q = Queue(maxsize=20000)
-        writer = PcapWriter(self.output_file, append=True, sync=True)
+        q = queue.Queue(maxsize=self.queue_size)
+        writer = self._open_writer()
 
         def feeder(pkt):
             # sniff 线程里：只把 pkt 放进队列，不做重 IO
             if self.stop_event.is_set():
                 return
             try:
-                q.put(pkt, block=False)
-            except:
-                # 队列满了可以丢包或计数
-                pass
+                q.put_nowait(pkt)
+            except queue.Full:
+                # 队列满了只能丢包, 计入统计
+                self.dropped_count += 1
 
         def writer_thread():
+            nonlocal writer
+            chunk_start = time.time()
+            chunk_bytes = 0
+            last_flush = time.time()
             while not self.stop_event.is_set() or not q.empty():
-                try:
-                    pkt = q.get(timeout=1)
-                except:
-                    continue
-                writer.write(pkt)
-                q.task_done()
+                for pkt in self._drain_batch(q):
+                    # 轮转抓包: 当前分片达到秒数或大小后关闭, 写下一个分片
+                    if self._should_rotate(chunk_start, chunk_bytes):
+                        writer.close()
+                        writer = self._open_writer()
+                        chunk_start = time.time()
+                        chunk_bytes = 0
+                        last_flush = time.time()
+                    chunk_bytes += self._write_packet(writer, pkt) + 16
+                    self.captured_count += 1
+                # 定期刷新, 在线过滤/分片过滤可以读到最新的数据
+                if time.time() - last_flush >= self.flush_interval:
+                    writer.flush()
+                    last_flush = time.time()
+            writer.close()
 
         wt = threading.Thread(target=writer_thread, daemon=True)
         wt.start()
 
+        sniffer = AsyncSniffer(
+            # 空字符串也会让 scapy 编译过滤器, 没有 libpcap/tcpdump 的平台上会失败
+            filter=self.filter_expr or None,
+            iface=self.network_interface,
+            store=False,
+            prn=feeder,
+            started_callback=self.ready_event.set,  # socket 打开后回调
+        )
         try:
-            while not self.stop_event.is_set():
-                sniff(
-                    filter=self.filter_expr,
-                    iface=self.network_interface,
-                    store=False,
-                    prn=feeder,
-                    timeout=1,  # ★ 抓包线程一秒轮询一次 stop_event
-                )
+            sniffer.start()
+            # 等待停止; sniff 线程异常退出(如没有权限)时也结束
+            while not self.stop_event.wait(0.5):
+                if sniffer.thread is None or not sniffer.thread.is_alive():
+                    break
+            if sniffer.running:
+                sniffer.stop(join=False)
+            # sniff 线程中的异常会在 join 时抛出
+            sniffer.join(timeout=5)
         except Exception as e:
+            self.error = e
             LogUtil().error(self.task_name, f'[ScapyProcess] 抓包出现异常: {e}')
         finally:
             self.stop_event.set()
             wt.join(timeout=5)
-            LogUtil().debug(self.task_name, f'[ScapyProcess] sniff 结束')
+            LogUtil().debug(self.task_name,
+                            f'[ScapyProcess] sniff 结束, 写入 {self.captured_count} 个包, 队列满丢弃 {self.dropped_count} 个包')
+
+
+    def _drain_batch(self, q: queue.Queue) -> list:
+        """
+        从队列中取出一批包: 最多等待 flush_interval 取到第一个包, 之后不等待, 最多取 batch_size 个
+        :param q: 写入队列
+        :return: 包列表(可能为空)
+        """
+        try:
+            batch = [q.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+
+    def _write_packet(self, writer, pkt) -> int:
+        """
+        写入一个包, 按抓包模板截断(记录头中保留原始长度)
+        :param writer: PcapWriter
+        :param pkt: 数据包
+        :return: 写入的包数据字节数
+        """
+        if not CaptureProfileUtil.needs_truncator(self.capture_profile):
+            writer.write(pkt)
+            return len(pkt)
+
+        raw = bytes(pkt)
+        if self._truncator is None:
+            self._truncator = PacketTruncator(self.capture_profile, conf.l2types.layer2num[pkt.__class__], self.snaplen)
+        caplen = self._truncator.caplen_of(raw)
+        if caplen >= len(raw):
+            writer.write(pkt)
+            return len(raw)
+
+        if not writer.header_present:
+            writer.write_header(pkt)
+        sec = int(pkt.time)
+        usec = min(int(round((pkt.time - sec) * 1000000)), 999999)
+        writer.write_packet(raw[:caplen], sec=sec, usec=usec, wirelen=len(raw))
+        return caplen
+
+
+    def _open_writer(self):
+        """
+        打开 pcap 写入器(轮转抓包时为下一个分片 chunk_<序号>.pcap)
+        :return: PcapWriter
+        """
+        snaplen = min(CaptureProfileUtil.get_snaplen(self.capture_profile, self.snaplen), 65535)
+        if self.rotation is None:
+            return PcapWriter(self.output_file, append=True, sync=False, snaplen=snaplen)
+        self._chunk_index += 1
+        chunk_path = os.path.join(str(self.chunk_dir), f"chunk_{self._chunk_index:05d}.pcap")
+        LogUtil().debug(self.task_name, f'[ScapyProcess] 写入分片: {chunk_path}')
+        return PcapWriter(chunk_path, append=True, sync=False, snaplen=snaplen)
+
+
+    def _should_rotate(self, chunk_start: float, chunk_bytes: int) -> bool:
+        """
+        当前分片是否需要轮转
+        :param chunk_start: 分片开始时间
+        :param chunk_bytes: 分片已写入的字节数
+        :return: bool
+        """
+        if self.rotation is None or chunk_bytes == 0:
+            return False
+        seconds = self.rotation.get('seconds')
+        size_mb = self.rotation.get('size_mb')
+        if seconds and time.time() - chunk_start >= seconds:
+            return True
+        if size_mb and chunk_bytes >= size_mb * 1000 * 1000:
+            return True
+        return False
 
 
     def clear(self):
@@ -149,5 +288,12 @@ class ScapyThread(BetterThread):
             task_name=task_name,
             output_file_path=output_file_path,
             network_interface=config.get('network_interface'),
-            filter_expr=config.get('filter_expr')
+            filter_expr=config.get('filter_expr'),
+            rotation=config.get('rotation'),
+            chunk_dir=config.get('chunk_dir'),
+            queue_size=config.get('queue_size', 20000),
+            batch_size=config.get('batch_size', 512),
+            flush_interval=config.get('flush_interval', 1.0),
+            capture_profile=config.get('capture_profile'),
+            snaplen=config.get('snaplen')
         )
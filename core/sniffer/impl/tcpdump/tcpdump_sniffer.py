@@ -2,20 +2,34 @@ __doc__ = "tcpdump 嗅探器"
 __author__ = "Li Qingyun"
 __date__ = "2025-12-03"
 
+import re
+import signal
+
+from core.sniffer.const.capture_profile import CaptureProfile
 from core.sniffer.impl.tcpdump.tcpdump_util import TcpdumpUtil
 from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.sniffer.model.capture_stats import CaptureStats
+from core.sniffer.util.capture_profile_util import CaptureProfileUtil
+from core.util.io.log_util import LogUtil
 from core.util.multiprocessing import OuterSubProcessHelper
 
 class TcpdumpSniffer(TrafficSniffer):
     """
     tcpdump 子进程工具类手机号
     """
+
+    # 开始抓包时 tcpdump 在 stderr 输出: "listening on eth0, link-type EN10MB (Ethernet), ..."
+    READY_PATTERNS = ['listening on']
+
     def __init__(self,
                  task_name: str,
                  output_file_path: str,
                  network_interface: str = None,
                  params: dict = None,
-                 filter_expr: str = None
+                 filter_expr: str = None,
+                 rotation: dict = None,
+                 capture_profile: str = None,
+                 snaplen: int = None
                  ):
         """
 
@@ -23,6 +37,9 @@ class TcpdumpSniffer(TrafficSniffer):
         :param output_file_path:    输出文件路径
         :param network_interface:   网络接口
         :param params:              指令参数
+        :param rotation:            轮转抓包配置(可为None)
+        :param capture_profile:     抓包模板(可为None, 见 CaptureProfile)
+        :param snaplen:             headers 模板的截断长度(可为None, 默认 160)
         """
 
         # 1. 初始化父类
@@ -36,7 +53,10 @@ class TcpdumpSniffer(TrafficSniffer):
             output_file_path=output_file_path,
             network_interface=network_interface,
             params=params,
-            filter_expr=filter_expr
+            filter_expr=filter_expr,
+            rotation=rotation,
+            capture_profile=capture_profile,
+            snaplen=snaplen
         )
 
         # 2. tcpdump 指令位置
@@ -53,6 +73,8 @@ class TcpdumpSniffer(TrafficSniffer):
             name="tcpdump子进程",
             start_command=self.startup_instruction,
             logger_name=self.task_name,
+            ready_patterns=TcpdumpSniffer.READY_PATTERNS,
+            stop_signal=signal.SIGINT,
         )
         pass
 
@@ -67,6 +89,25 @@ class TcpdumpSniffer(TrafficSniffer):
             # '-n',                           # 不进行DNS解析
             '-B', '51200',                    # 缓冲区大小, 单位KB
         ]
+
+        # 抓包模板: headers 直接设置 snaplen(记录头中保留原始长度); 需要逐包判断的模板完整抓包, 停止后再截断
+        if self.capture_profile == CaptureProfile.HEADERS:
+            self.startup_instruction += ['-s', str(CaptureProfileUtil.get_snaplen(self.capture_profile, self.snaplen))]
+
+        # 轮转抓包: 写到分片目录
+        #   -G 按秒数轮转, 文件名中的 %s 是分片开始的 epoch 秒
+        #   -C 按大小轮转(单位百万字节), 第一个分片不带序号, 之后依次追加 1, 2, ...
+        if self.is_rotating():
+            seconds = self.rotation.get('seconds')
+            size_mb = self.rotation.get('size_mb')
+            if seconds:
+                chunk_name = f"{TrafficSniffer.CHUNK_PREFIX}_%s.pcap"
+                self.startup_instruction += ['-G', str(int(seconds))]
+            else:
+                chunk_name = f"{TrafficSniffer.CHUNK_PREFIX}.pcap"
+            if size_mb:
+                self.startup_instruction += ['-C', str(max(1, int(size_mb)))]
+            self.startup_instruction[self.startup_instruction.index('-w') + 1] = str(self.chunk_dir / chunk_name)
         pass
 
 
@@ -77,13 +118,61 @@ class TcpdumpSniffer(TrafficSniffer):
         self.tcpdump_subprocess.start_process()
         pass
 
+    def wait_until_ready(self, timeout: float) -> bool:
+        """
+        等待 tcpdump 输出 "listening on"(或输出文件出现 pcap 全局头)
+        :param timeout: 超时时间(秒)
+        :return: 是否就绪
+        """
+        return self.tcpdump_subprocess.wait_until_ready(timeout, ready_check=self._has_output_header)
+
     def stop_sniffer(self):
         """
         停止抓包
+            先发送 SIGINT: tcpdump 把缓冲区中的包写入文件、打印统计后退出, 退出即返回; 超时才 terminate/kill
         """
         self.tcpdump_subprocess.stop_process()
+        if self.tcpdump_subprocess.stopped_gracefully is False:
+            LogUtil().warning(self.task_name, f"[TcpdumpSniffer] tcpdump 未正常退出, 输出文件末尾可能不完整(过滤前会修复)")
         pass
 
+    def needs_post_truncation(self) -> bool:
+        """
+        tcpdump 不能逐包决定 snaplen, headers+tls-handshake 需要停止后截断
+        :return: bool
+        """
+        return self.capture_profile == CaptureProfile.HEADERS_TLS_HANDSHAKE
+
+    def get_capture_stats(self):
+        """
+        从 tcpdump 退出时的输出中解析抓包统计
+        :return: CaptureStats
+        """
+        return TcpdumpSniffer.parse_capture_stats(self.tcpdump_subprocess.get_output())
+
+    @staticmethod
+    def parse_capture_stats(output: str) -> CaptureStats:
+        """
+        解析 tcpdump 退出时打印的统计:
+            123 packets captured
+            130 packets received by filter
+            7 packets dropped by kernel
+            0 packets dropped by interface (部分版本)
+        :param output: tcpdump 的输出
+        :return: CaptureStats(没有匹配的项为 None)
+        """
+        def find(pattern):
+            match = re.search(pattern, output or '')
+            return int(match.group(1)) if match else None
+
+        return CaptureStats(
+            source='tcpdump',
+            captured=find(r'(\d+) packets? captured'),
+            received=find(r'(\d+) packets? received by filter'),
+            dropped_by_kernel=find(r'(\d+) packets? dropped by kernel'),
+            dropped_by_interface=find(r'(\d+) packets? dropped by interface'),
+        )
+
     @staticmethod
     def creat_sniffer_by_config(task_name, config: dict):
         return TcpdumpSniffer(
@@ -92,6 +181,9 @@ class TcpdumpSniffer(TrafficSniffer):
             network_interface=config.get('network_interface'),
             params=config.get('params'),
             filter_expr=config.get('filter_expr'),
+            rotation=config.get('rotation'),
+            capture_profile=config.get('capture_profile'),
+            snaplen=config.get('snaplen'),
         )
         pass
 
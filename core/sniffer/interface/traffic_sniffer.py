@@ -3,22 +3,41 @@ __author__ = "Li Qingyun"
 __date__ = "2025-12-03"
 
 import platform
+import re
 from abc import ABCMeta, abstractmethod
+from pathlib import Path
 
+from core.sniffer.const.capture_profile import CaptureProfile
+from core.sniffer.util.capture_profile_util import CaptureProfileUtil
 from core.util.network.network_interface_util import NetworkInterfaceUtil
 
 
 class TrafficSniffer(metaclass=ABCMeta):
+
+    CHUNK_DIR_SUFFIX = '_chunks'
+    CHUNK_PREFIX = 'chunk'
+    # 各嗅探器的分片命名: tcpdump chunk.pcap, chunk.pcap1 .. / chunk_<epoch>.pcap[N], dumpcap chunk_<序号>_<时间>.pcapng, scapy chunk_<序号>.pcap
+    CHUNK_NAME_PATTERN = re.compile(r'^chunk.*\.pcap(ng)?\d*$')
+
     def __init__(self,
                  task_name,
                  output_file_path: str,
                  network_interface: str=None,
                  params: dict=None,
-                 filter_expr: str=None):
+                 filter_expr: str=None,
+                 rotation: dict=None,
+                 capture_profile: str=None,
+                 snaplen: int=None):
         """
         :param output_file_path: 输出文件名命名
         :param network_interface: 网卡名称
         :param params: 指令参数列表
+        :param rotation: 轮转抓包配置(可为None)
+                            - seconds: 每个分片的秒数
+                            - size_mb: 每个分片的大小(MB)
+                            两者至少指定一个, 同时指定时任一条件满足即轮转
+        :param capture_profile: 抓包模板 full / headers / headers+tls-handshake(为None时是 full, 见 CaptureProfile)
+        :param snaplen: headers / headers+tls-handshake 模板的截断长度(为None时是 160, 不小于 CaptureProfileUtil.MIN_HEADER_SNAPLEN)
         """
         # 1. 基本属性
         # 1.1 任务名称
@@ -38,6 +57,19 @@ class TrafficSniffer(metaclass=ABCMeta):
         self.filter_expr = filter_expr
         # 2.2 启动指令
         self.startup_instruction = None
+        # 2.3 轮转抓包: 分片写到 <pcap名>_chunks 目录, 抓包结束后由 RotatedCaptureFilter 拼接回 output_file
+        self.rotation = None
+        self.chunk_dir = None
+        if rotation:
+            if not rotation.get('seconds') and not rotation.get('size_mb'):
+                raise ValueError('[TrafficSniffer] rotation 中需要指定 seconds 或 size_mb')
+            self.rotation = rotation
+            output_path = Path(output_file_path)
+            self.chunk_dir = output_path.with_name(f"{output_path.stem}{TrafficSniffer.CHUNK_DIR_SUFFIX}")
+            self.chunk_dir.mkdir(parents=True, exist_ok=True)
+        # 2.4 抓包模板: 每个包保存多少字节
+        self.capture_profile = CaptureProfile.parse(capture_profile)
+        self.snaplen = CaptureProfileUtil.check_snaplen(snaplen, self.task_name)
 
 
     @staticmethod
@@ -80,6 +112,50 @@ class TrafficSniffer(metaclass=ABCMeta):
         """
         pass
 
+    def wait_until_ready(self, timeout: float) -> bool:
+        """
+        等待嗅探器就绪(开始抓包), 用于替代固定的预热等待
+            默认认为启动后即就绪, 各嗅探器按自己的方式检测
+        :param timeout: 超时时间(秒)
+        :return: 是否就绪(超时或嗅探器启动失败返回 False)
+        """
+        return True
+
+
+    def get_capture_stats(self):
+        """
+        获取抓包统计(抓到/收到/丢弃的包数), 在 stop_sniffer 之后调用
+            默认拿不到统计, 返回 None
+        :return: CaptureStats 或 None
+        """
+        return None
+
+
+    def needs_post_truncation(self) -> bool:
+        """
+        停止后是否还需要按抓包模板截断输出文件(嗅探器自身无法逐包截断时, 见 CaptureProfileUtil.truncate_pcap)
+            默认嗅探器写入时已经截断
+        :return: bool
+        """
+        return False
+
+
+    def _has_output_header(self) -> bool:
+        """
+        输出文件(轮转抓包时为第一个分片)是否已经写出了文件头(pcap 全局头或 pcapng 的 SHB 至少 4 字节魔数)
+        :return: bool
+        """
+        if self.is_rotating():
+            chunks = self.list_chunk_paths()
+            path = chunks[0] if len(chunks) > 0 else None
+        else:
+            path = Path(self.output_file)
+        try:
+            return path is not None and path.stat().st_size >= 4
+        except OSError:
+            return False
+
+
     def generate_filter_expr_by_params(self):
         """
         生成过滤表达式
@@ -89,10 +165,16 @@ class TrafficSniffer(metaclass=ABCMeta):
             return
 
         expr_parts = []
-        # host 主机
+        # host 主机(可以是地址列表, 任一地址匹配即可)
         if self.params.get('host') is not None:
             host = self.params.get('host')
-            expr_parts.append(f'host {host}')
+            if isinstance(host, (list, tuple)):
+                if len(host) == 1:
+                    expr_parts.append(f'host {host[0]}')
+                elif len(host) > 1:
+                    expr_parts.append(f"({' or '.join(f'host {item}' for item in host)})")
+            else:
+                expr_parts.append(f'host {host}')
 
         # port 端口号
         if self.params.get('port') is not None:
@@ -123,27 +205,92 @@ class TrafficSniffer(metaclass=ABCMeta):
         return self.output_file
 
 
+    def is_rotating(self) -> bool:
+        """
+        是否轮转抓包
+        """
+        return self.rotation is not None
+
+
+    def list_chunk_paths(self) -> list:
+        """
+        列出轮转抓包已写出的分片
+            按文件名中的数字排序(序号、epoch 秒), 最后一个分片可能还在写入
+        :return: [Path]
+        """
+        if self.chunk_dir is None or not self.chunk_dir.exists():
+            return []
+        chunks = [path for path in self.chunk_dir.iterdir() if TrafficSniffer.CHUNK_NAME_PATTERN.match(path.name)]
+        chunks.sort(key=lambda path: tuple(int(number) for number in re.findall(r'\d+', path.name)))
+        return chunks
+
+
 
     @staticmethod
     @abstractmethod
     def creat_sniffer_by_config(task_name, config: dict):
+        from core.sniffer.const.sniffer_backend_type import SnifferBackendType
+        from core.sniffer.impl.afpacket.afpacket_sniffer import AfPacketSniffer
         from core.sniffer.impl.dumpcap.dumpcap_sniffer import DumpcapSniffer
         from core.sniffer.impl.tcpdump.tcpdump_sniffer import TcpdumpSniffer
         from core.sniffer.impl.scapy.scapy_sniffer import ScapySniffer
 
         """
         根据配置创建抓包器实例
+            config.backend 指定后端(见 SnifferBackendType), 默认 auto 按平台选择
         :param task_name: 任务名称
         :param config: 配置字典
         :return: 抓包器实例
         """
+        backend = TrafficSniffer.resolve_backend(config)
+        if backend == SnifferBackendType.DUMPCAP:
+            return DumpcapSniffer.creat_sniffer_by_config(task_name, config)
+        elif backend == SnifferBackendType.TCPDUMP:
+            return TcpdumpSniffer.creat_sniffer_by_config(task_name, config)
+        elif backend == SnifferBackendType.AFPACKET:
+            return AfPacketSniffer.creat_sniffer_by_config(task_name, config)
+        else:
+            return ScapySniffer.creat_sniffer_by_config(task_name, config)
+        pass
+
+
+    @staticmethod
+    def resolve_backend(config: dict):
+        """
+        配置对应的嗅探器后端(auto 时按平台选择)
+        :param config: 嗅探配置
+        :return: SnifferBackendType
+        """
+        from core.sniffer.const.sniffer_backend_type import SnifferBackendType
+
+        backend = SnifferBackendType(str(config.get('backend', SnifferBackendType.AUTO)))
+        if backend == SnifferBackendType.AUTO:
+            backend = TrafficSniffer._detect_backend()
+        return backend
+
+
+    @staticmethod
+    def _detect_backend():
+        """
+        按平台选择嗅探器后端
+        :return: SnifferBackendType
+        """
+        from core.sniffer.const.sniffer_backend_type import SnifferBackendType
+        from core.sniffer.impl.tcpdump.tcpdump_util import TcpdumpUtil
+
         # Windows下用 dumpcap, 其他linux/macOS平台用 tcpdump
         if platform.system() == 'Windows':
-            return DumpcapSniffer.creat_sniffer_by_config(task_name, config)
+            return SnifferBackendType.DUMPCAP
         elif platform.system() == 'Darwin' or platform.system() == 'Linux':
-            return TcpdumpSniffer.creat_sniffer_by_config(task_name, config)
+            try:
+                TcpdumpUtil.get_tcpdump_cmd()
+                return SnifferBackendType.TCPDUMP
+            except FileNotFoundError:
+                if platform.system() == 'Darwin':
+                    raise
+            # Linux 上没有 tcpdump 时用 AF_PACKET, 比 scapy 逐包回调快得多
+            return SnifferBackendType.AFPACKET
         else:
             # raise EnvironmentError(f'[TrafficSniffer] 不支持的操作系统: {platform.system()}')
             # 用 scapy 兜底
-            return ScapySniffer.creat_sniffer_by_config(task_name, config)
-        pass
+            return SnifferBackendType.SCAPY
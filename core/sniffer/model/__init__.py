@@ -0,0 +1 @@
+from .capture_stats import CaptureStats
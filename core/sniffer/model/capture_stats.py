@@ -0,0 +1,61 @@
+__doc__ = "嗅探器的抓包统计"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-27"
+
+import json
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+
+@dataclass
+class CaptureStats:
+    """
+    一次抓包的统计, 拿不到的项为 None
+        tcpdump/dumpcap 从退出时的输出中解析, scapy 在抓包线程中计数
+    """
+    source: str                                 # 统计来源(嗅探器类型)
+    captured: Optional[int] = None              # 写入文件的包数
+    received: Optional[int] = None              # 过滤器收到的包数
+    dropped_by_kernel: Optional[int] = None     # 内核缓冲区满丢弃的包数(-B 太小)
+    dropped_by_interface: Optional[int] = None  # 网卡/驱动丢弃的包数
+    dropped_by_sniffer: Optional[int] = None    # 嗅探器自身丢弃的包数(如 scapy 队列满)
+    capture_profile: Optional[str] = None       # 抓包模板(见 CaptureProfile)
+    snaplen: Optional[int] = None               # 模板的截断长度(full 时为 None, 使用嗅探器默认值; 记录头中保留原始长度)
+
+    @property
+    def dropped(self) -> Optional[int]:
+        """丢包总数(各项都拿不到时为 None)"""
+        values = [value for value in (self.dropped_by_kernel, self.dropped_by_interface, self.dropped_by_sniffer)
+                  if value is not None]
+        return sum(values) if len(values) > 0 else None
+
+    @property
+    def drop_rate(self) -> Optional[float]:
+        """丢包率(丢包数 / (收到的包数 + 嗅探器自身丢弃的包数))"""
+        dropped = self.dropped
+        total = self.received if self.received is not None else self.captured
+        if dropped is None or total is None:
+            return None
+        if self.dropped_by_sniffer is not None and self.received is None:
+            # scapy 的 captured 不包括队列满丢弃的包
+            total += self.dropped_by_sniffer
+        return dropped / total if total > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        """转字典(附带丢包总数和丢包率)"""
+        result = asdict(self)
+        result['dropped'] = self.dropped
+        result['drop_rate'] = self.drop_rate
+        return result
+
+    def write_json(self, file_path: str):
+        """
+        写出 JSON
+        :param file_path: 文件路径
+        :return:
+        """
+        with open(file_path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def __str__(self):
+        return f"CaptureStats({self.source}: captured={self.captured}, received={self.received}, dropped={self.dropped})"
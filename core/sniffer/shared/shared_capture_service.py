@@ -0,0 +1,119 @@
+__doc__ = "共享抓包服务"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-24"
+
+import os
+import platform
+import tempfile
+import threading
+from time import sleep
+
+from core.sniffer.shared.shared_interface_capture import SharedInterfaceCapture
+from core.util.io.log_util import LogUtil
+from core.util.python.singleton_util import Singleton
+
+
+@Singleton
+class SharedCaptureService:
+    """
+    共享抓包服务
+        在 TaskManager 的整个生命周期内, 每个网卡只运行一个轮转抓包(SharedInterfaceCapture)
+        每次抓取通过 create_sniffer 拿到一个 SharedCaptureSniffer, 只登记时间窗口, 结束时从共享分片中切出自己的 pcap
+        省掉了每次抓取启动 tcpdump 和预热等待的时间, 并发的 N 个抓取也不会让内核把同一网卡的流量复制 N 份
+        注: 目前基于 tcpdump 的 -G 轮转, 仅支持 Linux/macOS; 其他平台 is_running() 为 False, 抓取线程仍使用各自的嗅探器
+    """
+
+    def __init__(self):
+        self.config = None
+        self._captures = {}     # 网卡名 -> SharedInterfaceCapture
+        self._lock = threading.Lock()
+        self._running = False
+
+
+    def start(self, config: dict):
+        """
+        启动服务(各网卡的抓包在第一次使用时才启动)
+        :param config: 共享抓包配置
+                        - rotate_seconds: 每个分片的秒数(默认 5)
+                        - retention_seconds: 没有抓取需要时分片的保留时长(默认 120 秒)
+                        - flush_seconds: 抓取结束后等待 tcpdump 写出最后数据的最长时间(默认 1.5 秒, 确认写出后提前结束)
+                        - ready_timeout: 网卡上的 tcpdump 第一次启动后等待就绪的超时(默认 5.0 秒)
+                        - warmup_seconds: 就绪后额外的固定等待(默认 0 秒)
+                        - filter_expr: 所有抓取共用的抓包过滤表达式(默认抓取全部流量)
+                        - buffer_size_kb: tcpdump 缓冲区大小(默认 51200 KB)
+                        - work_dir: 分片目录(默认系统临时目录下的 small_brother_shared_capture)
+        :return:
+        """
+        if platform.system() not in ('Linux', 'Darwin'):
+            LogUtil().warning('main', f"[SharedCaptureService] 共享抓包不支持 {platform.system()}, 使用每次抓取各自的嗅探器")
+            return
+        self.config = dict(config)
+        self._running = True
+        LogUtil().debug('main', f"[SharedCaptureService] 共享抓包服务已启动")
+
+
+    def is_running(self) -> bool:
+        """服务是否在运行"""
+        return self._running
+
+
+    def get_interface_capture(self, network_interface: str) -> SharedInterfaceCapture:
+        """
+        获取网卡的共享抓包, 没有时启动一个
+        :param network_interface: 网卡名称
+        :return: SharedInterfaceCapture
+        """
+        with self._lock:
+            capture = self._captures.get(network_interface)
+            if capture is not None:
+                return capture
+
+            work_dir = self.config.get('work_dir',
+                                       os.path.join(tempfile.gettempdir(), 'small_brother_shared_capture'))
+            capture = SharedInterfaceCapture(
+                network_interface=network_interface,
+                work_dir=work_dir,
+                rotate_seconds=self.config.get('rotate_seconds', 5),
+                retention_seconds=self.config.get('retention_seconds', 120),
+                flush_seconds=self.config.get('flush_seconds', 1.5),
+                filter_expr=self.config.get('filter_expr'),
+                buffer_size_kb=self.config.get('buffer_size_kb', 51200),
+            )
+            capture.start()
+            LogUtil().debug('main', f"[SharedCaptureService] 网卡 {network_interface} 的共享抓包已启动")
+
+            # 只有第一次启动时需要等待就绪
+            if capture.wait_until_ready(self.config.get('ready_timeout', 5.0)) is False:
+                LogUtil().warning('main', f"[SharedCaptureService] 未确认网卡 {network_interface} 的共享抓包就绪")
+            warmup_seconds = self.config.get('warmup_seconds', 0)
+            if warmup_seconds and warmup_seconds > 0:
+                sleep(warmup_seconds)
+
+            self._captures[network_interface] = capture
+            return capture
+
+
+    def create_sniffer(self, task_name: str, config: dict):
+        """
+        为一次抓取创建嗅探器
+        :param task_name: 任务名称
+        :param config: 嗅探配置(同 TrafficSniffer.creat_sniffer_by_config)
+        :return: SharedCaptureSniffer
+        """
+        from core.sniffer.shared.shared_capture_sniffer import SharedCaptureSniffer
+        return SharedCaptureSniffer.creat_sniffer_by_config(task_name, config)
+
+
+    def stop(self):
+        """
+        停止所有网卡的共享抓包并删除分片
+        :return:
+        """
+        with self._lock:
+            for network_interface, capture in self._captures.items():
+                capture.stop()
+                capture.join()
+                capture.clear()
+                LogUtil().debug('main', f"[SharedCaptureService] 网卡 {network_interface} 的共享抓包已停止")
+            self._captures = {}
+            self._running = False
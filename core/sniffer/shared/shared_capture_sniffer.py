@@ -0,0 +1,110 @@
+__doc__ = "从共享抓包中切片的嗅探器"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-24"
+
+import time
+
+from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.sniffer.model.capture_stats import CaptureStats
+from core.util.io.log_util import LogUtil
+
+
+class SharedCaptureSniffer(TrafficSniffer):
+    """
+    从共享抓包中切片的嗅探器
+        不启动任何抓包进程: start_sniffer 只登记时间窗口, stop_sniffer 从网卡的共享分片中切出窗口内的记录写到 output_file
+        网卡上的抓包由 SharedCaptureService 统一管理, 抓包过滤表达式也是共用的, 本次抓取的 filter_expr 不生效(连接过滤照常进行)
+    """
+
+    def __init__(self,
+                 task_name: str,
+                 output_file_path: str,
+                 network_interface: str = None,
+                 params: dict = None,
+                 filter_expr: str = None,
+                 capture_profile: str = None,
+                 snaplen: int = None
+                 ):
+        """
+        :param task_name:           任务名称
+        :param output_file_path:    输出文件路径
+        :param network_interface:   网络接口
+        :param params:              指令参数
+        :param capture_profile:     抓包模板(可为None, 见 CaptureProfile), 切片时截断
+        :param snaplen:             headers 模板的截断长度(可为None, 默认 160)
+        """
+        super().__init__(
+            task_name=task_name,
+            output_file_path=output_file_path,
+            network_interface=network_interface,
+            params=params,
+            filter_expr=filter_expr,
+            capture_profile=capture_profile,
+            snaplen=snaplen
+        )
+
+        self.start_ts = None
+        self.stop_ts = None
+        self._window_id = None
+        self._capture = None
+        self._extracted_count = None
+
+
+    def generate_startup_instruction(self):
+        """
+        共享抓包没有单独的启动指令
+        """
+        self.startup_instruction = None
+
+
+    def start_sniffer(self):
+        """
+        登记窗口起始时间(第一次使用该网卡时会启动共享抓包)
+        """
+        from core.sniffer.shared.shared_capture_service import SharedCaptureService
+
+        self._capture = SharedCaptureService().get_interface_capture(self.network_interface)
+        self.start_ts = time.time()
+        self._window_id = self._capture.register_window(self.start_ts)
+        LogUtil().debug(self.task_name, f"[SharedCaptureSniffer] 已登记抓取窗口 (网卡: {self.network_interface})")
+
+
+    def stop_sniffer(self):
+        """
+        结束窗口并切出窗口内的记录
+        """
+        if self._capture is None:
+            return
+        self.stop_ts = time.time()
+        try:
+            count = self._capture.extract_slice(self.start_ts, self.stop_ts, self.output_file,
+                                                capture_profile=self.capture_profile, snaplen=self.snaplen)
+            self._extracted_count = count
+            LogUtil().debug(self.task_name,
+                            f"[SharedCaptureSniffer] 已从共享抓包切出 {count} 个包 "
+                            f"({self.stop_ts - self.start_ts:.1f}s): {self.output_file}")
+        finally:
+            self._capture.unregister_window(self._window_id)
+
+
+    def get_capture_stats(self):
+        """
+        切出的包数(共享的 tcpdump 还在运行, 拿不到丢包数)
+        :return: CaptureStats 或 None
+        """
+        if self._extracted_count is None:
+            return None
+        return CaptureStats(source='shared_capture', captured=self._extracted_count)
+
+
+    @staticmethod
+    def creat_sniffer_by_config(task_name, config: dict):
+        return SharedCaptureSniffer(
+            task_name=task_name,
+            output_file_path=config.get('output_file_path'),
+            network_interface=config.get('network_interface'),
+            params=config.get('params'),
+            filter_expr=config.get('filter_expr'),
+            capture_profile=config.get('capture_profile'),
+            snaplen=config.get('snaplen'),
+        )
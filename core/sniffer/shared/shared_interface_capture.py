@@ -0,0 +1,269 @@
+__doc__ = "单个网卡上长期运行的轮转抓包"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-24"
+
+import os
+import signal
+import struct
+import threading
+import time
+from pathlib import Path
+
+from core.sniffer.const.capture_profile import CaptureProfile
+from core.sniffer.impl.tcpdump.tcpdump_sniffer import TcpdumpSniffer
+from core.sniffer.impl.tcpdump.tcpdump_util import TcpdumpUtil
+from core.sniffer.util.capture_profile_util import CaptureProfileUtil, PacketTruncator
+from core.util.io.log_util import LogUtil
+from core.util.multiprocessing import OuterSubProcessHelper
+from core.util.multithreading.better_thread import BetterThread
+from core.util.pcap.pcap_record_reader import PcapRecordReader, PCAP_MAGIC_USEC, PCAP_GLOBAL_HEADER_LEN
+
+
+class SharedInterfaceCapture(BetterThread):
+    """
+    单个网卡上长期运行的轮转抓包
+        一个 tcpdump 进程按 rotate_seconds 轮转写出分片(文件名是分片开始的 epoch 秒), 所有抓取共用
+        每次抓取登记自己的 [start, stop] 时间窗口, 结束后从覆盖该窗口的分片中按时间戳切出自己的部分
+        线程定期删除不再被任何窗口需要、且超过保留时长的分片, 分片目录相当于一个环形缓冲区
+    """
+
+    CHUNK_SUFFIX = '.pcap'
+
+    def __init__(self,
+                 network_interface: str,
+                 work_dir: str,
+                 rotate_seconds: int = 5,
+                 retention_seconds: float = 120,
+                 flush_seconds: float = 1.5,
+                 filter_expr: str = None,
+                 buffer_size_kb: int = 51200,
+                 logger_name: str = 'main'
+                 ):
+        """
+        :param network_interface: 网卡名称
+        :param work_dir: 分片目录
+        :param rotate_seconds: 每个分片的秒数
+        :param retention_seconds: 没有窗口需要时分片的保留时长(秒)
+        :param flush_seconds: 窗口结束后等待 tcpdump 写出最后数据的最长时间(秒)
+        :param filter_expr: 抓包过滤表达式(所有抓取共用, 为None时抓取全部流量)
+        :param buffer_size_kb: tcpdump 缓冲区大小(KB)
+        :param logger_name: 日志记录器名称
+        """
+        super().__init__(name=f'SharedInterfaceCapture-{network_interface}', daemon=True)
+        self.network_interface = network_interface
+        self.work_dir = Path(work_dir)
+        self.rotate_seconds = rotate_seconds
+        self.retention_seconds = retention_seconds
+        self.flush_seconds = flush_seconds
+        self.filter_expr = filter_expr
+        self.buffer_size_kb = buffer_size_kb
+        self.logger_name = logger_name
+
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.chunk_prefix = f"{network_interface}_"
+
+        # 已登记的窗口: 窗口id -> 起始时间
+        self._windows = {}
+        self._next_window_id = 0
+        self._lock = threading.Lock()
+        self._started_event = threading.Event()
+
+        self.tcpdump_subprocess = OuterSubProcessHelper(
+            name=f"共享tcpdump子进程({network_interface})",
+            start_command=self.generate_startup_instruction(),
+            logger_name=self.logger_name,
+            ready_patterns=TcpdumpSniffer.READY_PATTERNS,
+            stop_signal=signal.SIGINT,
+        )
+
+
+    def generate_startup_instruction(self) -> list:
+        """
+        生成启动指令
+            -G 按时间轮转, 文件名中的 %s 是分片开始的 epoch 秒
+            -U 每个包写出后立即刷新, 切片时能读到最新的数据
+        :return: list
+        """
+        instruction = TcpdumpUtil.get_tcpdump_cmd() + [
+            '-i', self.network_interface,
+            '-w', str(self.work_dir / f"{self.chunk_prefix}%s{SharedInterfaceCapture.CHUNK_SUFFIX}"),
+            '-G', str(self.rotate_seconds),
+            '-U',
+            '-B', str(self.buffer_size_kb),
+        ]
+        if self.filter_expr:
+            instruction += ['-f', self.filter_expr]
+        return instruction
+
+
+    def run(self):
+        self.tcpdump_subprocess.start_process()
+        self._started_event.set()
+        while self.stop_event.is_set() is False:
+            self.stop_event.wait(self.rotate_seconds)
+            self._remove_expired_chunks()
+
+
+    def wait_until_ready(self, timeout: float) -> bool:
+        """
+        等待 tcpdump 开始抓包(输出 "listening on" 或写出第一个分片)
+        :param timeout: 超时时间(秒)
+        :return: 是否就绪
+        """
+        if self._started_event.wait(timeout) is False:
+            return False
+        return self.tcpdump_subprocess.wait_until_ready(timeout, ready_check=lambda: len(self.list_chunks()) > 0)
+
+
+    def register_window(self, start_ts: float) -> int:
+        """
+        登记一个抓取窗口(窗口结束前, 覆盖它的分片不会被删除)
+        :param start_ts: 窗口起始时间
+        :return: 窗口id
+        """
+        with self._lock:
+            window_id = self._next_window_id
+            self._next_window_id += 1
+            self._windows[window_id] = start_ts
+        return window_id
+
+
+    def unregister_window(self, window_id: int):
+        """
+        注销抓取窗口
+        :param window_id: 窗口id
+        :return:
+        """
+        with self._lock:
+            self._windows.pop(window_id, None)
+
+
+    def list_chunks(self) -> list:
+        """
+        列出所有分片
+        :return: [(分片开始时间, 分片路径)], 按时间排序
+        """
+        chunks = []
+        for path in self.work_dir.glob(f"{self.chunk_prefix}*{SharedInterfaceCapture.CHUNK_SUFFIX}"):
+            start_str = path.name[len(self.chunk_prefix):-len(SharedInterfaceCapture.CHUNK_SUFFIX)]
+            if start_str.isdigit():
+                chunks.append((int(start_str), path))
+        chunks.sort()
+        return chunks
+
+
+    def _remove_expired_chunks(self):
+        """
+        删除过期分片: 分片结束时间早于所有窗口的起始时间, 且超过保留时长
+        :return:
+        """
+        with self._lock:
+            keep_after = time.time() - self.retention_seconds
+            if len(self._windows) > 0:
+                keep_after = min(keep_after, min(self._windows.values()))
+
+        chunks = self.list_chunks()
+        # 最后一个分片还在写入, 不删除
+        for (_, path), (next_start, _) in zip(chunks, chunks[1:]):
+            if next_start >= keep_after:
+                break
+            try:
+                path.unlink()
+            except OSError as e:
+                LogUtil().warning(self.logger_name, f"[SharedInterfaceCapture] 删除分片失败 {path}: {e}")
+
+
+    def extract_slice(self, start_ts: float, end_ts: float, output_path: str,
+                      capture_profile: CaptureProfile = None, snaplen: int = None) -> int:
+        """
+        从分片中切出时间窗口内的记录, 写成一个 pcap
+            等到 tcpdump 写出窗口结束前的数据后再读取, 正在写入的分片末尾不完整的记录会被忽略
+        :param start_ts: 窗口起始时间
+        :param end_ts: 窗口结束时间
+        :param output_path: 输出文件路径
+        :param capture_profile: 本次抓取的抓包模板(共享的 tcpdump 完整抓包, 切片时按模板截断)
+        :param snaplen: 抓包模板的截断长度(为None时是默认值)
+        :return: 写出的记录数
+        """
+        capture_profile = CaptureProfile.parse(capture_profile)
+        self._wait_for_flush(end_ts)
+
+        chunks = self.list_chunks()
+        count = 0
+        truncator = None
+        with open(output_path, 'wb') as out:
+            header_written = False
+            for index, (chunk_start, path) in enumerate(chunks):
+                chunk_end = chunks[index + 1][0] if index + 1 < len(chunks) else float('inf')
+                # 轮转时刻与包时间戳可能差一点, 两端各放宽一秒
+                if chunk_start > end_ts + 1 or chunk_end < start_ts - 1:
+                    continue
+                try:
+                    reader = PcapRecordReader(str(path))
+                except (OSError, ValueError):
+                    # 刚轮转出的分片可能还没写完全局头, 或已经被删除
+                    continue
+                with reader:
+                    if not header_written:
+                        out.write(reader.global_header)
+                        header_written = True
+                    if truncator is None and CaptureProfileUtil.needs_truncator(capture_profile):
+                        # 握手状态跨分片保留
+                        truncator = PacketTruncator(capture_profile, reader.link_type, snaplen)
+                    for record in reader:
+                        if start_ts <= reader.timestamp_of(record) <= end_ts:
+                            caplen = truncator.caplen_of(record.data) if truncator is not None else record.caplen
+                            out.write(reader.pack_record_header(record, caplen))
+                            out.write(record.data[:caplen])
+                            count += 1
+
+            if not header_written:
+                # 没有可用的分片, 写出一个空的以太网 pcap
+                out.write(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, 2, 4, 0, 0, 262144, 1))
+        return count
+
+
+    def _wait_for_flush(self, end_ts: float, poll_interval: float = 0.1):
+        """
+        等待 tcpdump 写出 end_ts 之前的数据
+            tcpdump 使用 -U 逐包写出, 最新分片中出现时间戳不早于 end_ts 的记录, 说明之前的包都已写出, 马上结束等待;
+            网卡上没有新流量时最多等到 end_ts + flush_seconds
+            从上次读到的位置继续读记录头, 不重复扫描整个分片
+        :param end_ts: 窗口结束时间
+        :param poll_interval: 检查间隔(秒)
+        :return:
+        """
+        deadline = end_ts + self.flush_seconds
+        scan_path = None
+        scan_offset = PCAP_GLOBAL_HEADER_LEN
+        while time.time() < deadline:
+            chunks = self.list_chunks()
+            if chunks:
+                path = chunks[-1][1]
+                if path != scan_path:
+                    scan_path, scan_offset = path, PCAP_GLOBAL_HEADER_LEN
+                try:
+                    with PcapRecordReader(str(path)) as reader:
+                        record = reader.read_record_at(scan_offset)
+                        while record is not None:
+                            scan_offset = record.offset + record.length
+                            if reader.timestamp_of(record) >= end_ts:
+                                return
+                            record = reader.read_record()
+                except (OSError, ValueError):
+                    # 刚轮转出的分片可能还没写完全局头, 或已经被删除
+                    pass
+            time.sleep(max(0.0, min(poll_interval, deadline - time.time())))
+
+
+    def clear(self):
+        """
+        停止 tcpdump 并删除分片
+        :return:
+        """
+        self.tcpdump_subprocess.stop_process()
+        for _, path in self.list_chunks():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,126 @@
+__doc__ = "自动生成抓包过滤器"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-30"
+
+import socket
+from urllib.parse import urlsplit
+
+from core.sniffer.const.capture_filter_mode import CaptureFilterMode
+from core.sniffer.const.sniffer_backend_type import SnifferBackendType
+from core.sniffer.impl.afpacket.bpf_program_util import BpfProgramUtil
+from core.sniffer.interface.traffic_sniffer import TrafficSniffer
+from core.util.io.log_util import LogUtil
+
+
+class CaptureFilterUtil:
+    """
+    自动生成抓包过滤器
+        没有指定 filter_expr/params 时, 按抓取方式生成一个尽量窄的过滤器, 在内核中就丢掉无关流量,
+        减少写盘量、丢包和之后 ConnectionsFilter 的过滤时间(连接过滤照常进行, 这里只需要保证不漏掉需要的流量)
+            代理: 浏览器的流量都发往代理服务器, 只抓代理服务器的 地址+端口(域名会先解析成 A/AAAA 地址)
+            直连(auto): 页面会引用其他域名的资源, 不能按目标地址过滤, 只排除明显无关的本机噪声
+            直连(target): 只抓目标域名解析出的 A/AAAA 地址
+    """
+
+    # 明显与网页访问无关的端口: SSH, DHCP, NetBIOS, SSDP, mDNS, LLMNR
+    NOISE_PORTS = (22, 67, 68, 137, 138, 1900, 5353, 5355)
+
+
+    @staticmethod
+    def build_sniffer_filter(sniffer_config: dict, url: str, protocol_stack=None, logger_name: str = 'main') -> dict:
+        """
+        生成需要合并进 sniffer_config 的过滤配置
+        :param sniffer_config: 嗅探配置(读取 auto_filter / backend)
+        :param url: 抓取的 url
+        :param protocol_stack: 代理的协议栈(ProtocolStack, 直连为None)
+        :param logger_name: 日志记录器名称
+        :return: {'params': ...} 或 {'filter_expr': ...}, 不生成时返回 {}
+        """
+        mode = CaptureFilterMode.parse(sniffer_config.get('auto_filter', CaptureFilterMode.AUTO))
+        if mode == CaptureFilterMode.OFF:
+            return {}
+
+        if protocol_stack is not None:
+            addresses = CaptureFilterUtil.resolve_addresses(protocol_stack.remote_address, logger_name)
+            if len(addresses) == 0:
+                LogUtil().warning(logger_name, f"[CaptureFilterUtil] 无法解析代理服务器地址 {protocol_stack.remote_address}, 不生成抓包过滤器")
+                return {}
+            # 这里用系统解析器在代理启动前解析, 代理(mihomo)自己解析出的地址可能不同, 记录下来便于排查抓包为空的情况
+            LogUtil().info(logger_name, f"[CaptureFilterUtil] 代理服务器 {protocol_stack.remote_address}:{protocol_stack.remote_port} "
+                                        f"按系统解析器解析为 {addresses}, 只抓这些地址")
+            updates = {'params': {'host': addresses, 'port': int(protocol_stack.remote_port)}}
+        elif mode == CaptureFilterMode.TARGET:
+            hostname = urlsplit(url if '//' in url else f'//{url}').hostname
+            addresses = CaptureFilterUtil.resolve_addresses(hostname, logger_name) if hostname else []
+            if len(addresses) > 0:
+                updates = {'params': {'host': addresses}}
+            else:
+                LogUtil().warning(logger_name, f"[CaptureFilterUtil] 无法解析 {hostname}, 改为只排除本机噪声")
+                updates = {'filter_expr': CaptureFilterUtil.build_noise_exclusion_expr()}
+        else:
+            updates = {'filter_expr': CaptureFilterUtil.build_noise_exclusion_expr()}
+
+        if CaptureFilterUtil.is_filter_supported(sniffer_config, updates) is False:
+            LogUtil().warning(logger_name, f"[CaptureFilterUtil] 当前嗅探器后端无法编译过滤表达式(找不到 libpcap/tcpdump), 不生成抓包过滤器")
+            return {}
+        return updates
+
+
+    @staticmethod
+    def resolve_addresses(host: str, logger_name: str = 'main') -> list:
+        """
+        解析域名的 A/AAAA 地址(本身就是 IP 时原样返回)
+        :param host: 域名或 IP
+        :param logger_name: 日志记录器名称
+        :return: 地址列表(去重, 保持解析顺序), 解析失败返回空列表
+        """
+        try:
+            infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+        except (socket.gaierror, UnicodeError) as e:
+            LogUtil().debug(logger_name, f"[CaptureFilterUtil] 解析 {host} 失败: {e}")
+            return []
+
+        addresses = []
+        for family, _, _, _, sockaddr in infos:
+            if family not in (socket.AF_INET, socket.AF_INET6):
+                continue
+            # 去掉 IPv6 链路本地地址的 %网卡 后缀
+            address = sockaddr[0].split('%')[0]
+            if address not in addresses:
+                addresses.append(address)
+        LogUtil().debug(logger_name, f"[CaptureFilterUtil] {host} 解析为 {addresses}")
+        return addresses
+
+
+    @staticmethod
+    def build_noise_exclusion_expr() -> str:
+        """
+        只抓 TCP/UDP, 排除噪声端口和组播
+            带 vlan 分支, trunk/VLAN 网卡上带 802.1Q 标签的流量同样抓取
+        :return: 过滤表达式
+        """
+        ports = ' or '.join(f'port {port}' for port in CaptureFilterUtil.NOISE_PORTS)
+        expr = f'(tcp or udp) and not ({ports}) and not ip multicast and not ip6 multicast'
+        return f'({expr}) or (vlan and ({expr}))'
+
+
+    @staticmethod
+    def is_filter_supported(sniffer_config: dict, updates: dict) -> bool:
+        """
+        嗅探器能否使用生成的过滤器
+            tcpdump/dumpcap 自己编译; scapy 需要 libpcap 或 tcpdump;
+            afpacket 没有它们时只能用内置生成器处理 params
+        :param sniffer_config: 嗅探配置
+        :param updates: 生成的过滤配置
+        :return: bool
+        """
+        try:
+            backend = TrafficSniffer.resolve_backend(sniffer_config)
+        except (FileNotFoundError, ValueError):
+            # 创建嗅探器时会报告同样的错误
+            return True
+        if backend in (SnifferBackendType.TCPDUMP, SnifferBackendType.DUMPCAP):
+            return True
+        if BpfProgramUtil.has_compiler():
+            return True
+        return backend == SnifferBackendType.AFPACKET and 'params' in updates
@@ -0,0 +1,174 @@
+__doc__ = "按抓包模板截断数据包"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-31"
+
+import os
+
+from core.sniffer.const.capture_profile import CaptureProfile
+from core.util.io.log_util import LogUtil
+from core.util.pcap.packet_key_util import PacketKeyUtil
+from core.util.pcap.pcap_codec import PcapCodecUtil
+from core.util.pcap.pcap_record_reader import PcapRecordReader
+
+
+class PacketTruncator:
+    """
+    按抓包模板决定每个包保存的长度
+        headers: 所有包都截断到 snaplen(默认 HEADER_SNAPLEN)
+        headers+tls-handshake: 有状态, 按方向记录正在握手的 TCP 流:
+            载荷以 TLS 握手记录(0x16 0x03)开头的包完整保存, 并标记该流在握手中, 之后的包(跨多个 TCP 段的握手消息)也完整保存,
+            直到出现应用数据/告警记录(0x17/0x15); 443 端口上的 QUIC 长包头完整保存; 其余包截断
+    """
+
+    MAX_TRACKED_FLOWS = 65536   # 正在握手的流数量上限, 超过时清空(宁可多截断几个续段, 也不无限增长)
+
+    def __init__(self, profile: CaptureProfile, link_type: int, snaplen: int = None):
+        """
+        :param profile: 抓包模板
+        :param link_type: pcap 链路层类型
+        :param snaplen: 截断长度(为None时是 HEADER_SNAPLEN)
+        """
+        self.profile = profile
+        self.link_type = link_type
+        self.snaplen = snaplen if snaplen is not None else CaptureProfileUtil.HEADER_SNAPLEN
+        self._handshake_flows = set()
+
+
+    def caplen_of(self, data) -> int:
+        """
+        包应该保存的长度
+        :param data: 包数据(从链路层开始, bytes/memoryview)
+        :return: 保存的字节数
+        """
+        if self.profile == CaptureProfile.FULL or len(data) <= self.snaplen:
+            return len(data)
+        if self.profile == CaptureProfile.HEADERS_TLS_HANDSHAKE and self._is_handshake(data):
+            return len(data)
+        return self.snaplen
+
+
+    def _is_handshake(self, data) -> bool:
+        """
+        包是否属于 TLS/QUIC 握手
+        :param data: 包数据
+        :return: bool
+        """
+        located = PacketKeyUtil.locate_payload(self.link_type, data)
+        if located is None:
+            return False
+        protocol, l3_offset, l4_offset, payload_offset = located
+        if payload_offset + 3 > len(data):
+            return False
+
+        if protocol == PacketKeyUtil.PROTO_UDP:
+            src_port = (data[l4_offset] << 8) | data[l4_offset + 1]
+            dst_port = (data[l4_offset + 2] << 8) | data[l4_offset + 3]
+            return (src_port == 443 or dst_port == 443) and data[payload_offset] & 0x80 != 0
+
+        # 流的一个方向: 源/目的地址 + 源/目的端口
+        if data[l3_offset] >> 4 == 4:
+            key = bytes(data[l3_offset + 12:l3_offset + 20]) + bytes(data[l4_offset:l4_offset + 4])
+        else:
+            key = bytes(data[l3_offset + 8:l3_offset + 40]) + bytes(data[l4_offset:l4_offset + 4])
+
+        content_type, major_version = data[payload_offset], data[payload_offset + 1]
+        if content_type == 0x16 and major_version == 0x03:
+            if len(self._handshake_flows) >= PacketTruncator.MAX_TRACKED_FLOWS:
+                self._handshake_flows.clear()
+            self._handshake_flows.add(key)
+            return True
+        if content_type in (0x17, 0x15) and major_version == 0x03:
+            self._handshake_flows.discard(key)
+            return False
+        return key in self._handshake_flows
+
+
+class CaptureProfileUtil:
+    """
+    抓包模板工具类
+        headers 模板可以直接设置嗅探器的 snaplen(tcpdump/dumpcap 的 -s, scapy/afpacket 写入时截断)
+        headers+tls-handshake 需要逐包判断: scapy/afpacket/共享抓包在写入时用 PacketTruncator 截断,
+        tcpdump/dumpcap 只能完整抓包, 停止后用 truncate_pcap 重写一遍
+    """
+
+    HEADER_SNAPLEN = 160        # 默认截断长度: 以太网(含 VLAN) + 带选项的 IPv4/IPv6 + 带选项的 TCP 头
+    MIN_HEADER_SNAPLEN = 138    # 截断长度下限: 以太网 + VLAN(18) + 最长的 IPv4 头(60) + 最长的 TCP 头(60)
+    FULL_SNAPLEN = 262144       # tcpdump 的默认 snaplen
+
+
+    @staticmethod
+    def check_snaplen(snaplen, logger_name: str = 'main') -> int:
+        """
+        检查配置的截断长度(sniffer_config.snaplen)
+        :param snaplen: 配置值(为None时是 HEADER_SNAPLEN)
+        :param logger_name: 日志记录器名称
+        :return: 截断长度, 小于 MIN_HEADER_SNAPLEN 时改为 MIN_HEADER_SNAPLEN
+        :raise ValueError: 不是整数
+        """
+        if snaplen is None:
+            return CaptureProfileUtil.HEADER_SNAPLEN
+        if isinstance(snaplen, bool) or not isinstance(snaplen, int):
+            raise ValueError(f'[CaptureProfileUtil] snaplen 需要是整数: {snaplen}')
+        if snaplen < CaptureProfileUtil.MIN_HEADER_SNAPLEN:
+            LogUtil().warning(logger_name, f"[CaptureProfileUtil] snaplen {snaplen} 放不下带选项的协议头, "
+                                           f"改为 {CaptureProfileUtil.MIN_HEADER_SNAPLEN}")
+            return CaptureProfileUtil.MIN_HEADER_SNAPLEN
+        return snaplen
+
+
+    @staticmethod
+    def get_snaplen(profile: CaptureProfile, snaplen: int = None) -> int:
+        """
+        嗅探器本身可以设置的 snaplen(逐包判断的模板需要完整抓包)
+        :param profile: 抓包模板
+        :param snaplen: headers 模板的截断长度(为None时是 HEADER_SNAPLEN)
+        :return: snaplen
+        """
+        if profile == CaptureProfile.HEADERS:
+            return snaplen if snaplen is not None else CaptureProfileUtil.HEADER_SNAPLEN
+        return CaptureProfileUtil.FULL_SNAPLEN
+
+
+    @staticmethod
+    def needs_truncator(profile: CaptureProfile) -> bool:
+        """
+        写入时是否需要逐包截断
+        :param profile: 抓包模板
+        :return: bool
+        """
+        return profile != CaptureProfile.FULL
+
+
+    @staticmethod
+    def truncate_pcap(file_path: str, profile: CaptureProfile, logger_name: str = 'main', snaplen: int = None):
+        """
+        按抓包模板原地截断 pcap 中的记录(写到临时文件后替换), 记录头保留原始长度
+        :param file_path: pcap 路径(仅经典 pcap, 不支持 pcapng 和压缩文件)
+        :param profile: 抓包模板
+        :param logger_name: 日志记录器名称
+        :param snaplen: 截断长度(为None时是 HEADER_SNAPLEN)
+        :return: (记录数, 节省的字节数), 不需要或无法处理时返回 None
+        """
+        if profile == CaptureProfile.FULL or not os.path.exists(file_path):
+            return None
+        if PcapCodecUtil.detect_codec(file_path) is not None or not PcapRecordReader.is_pcap_file(file_path):
+            LogUtil().warning(logger_name, f"[CaptureProfileUtil] {file_path} 不是未压缩的经典 pcap, 不按抓包模板 {profile} 截断")
+            return None
+
+        original_size = os.path.getsize(file_path)
+        temp_path = f"{file_path}.truncating"
+        count = 0
+        with PcapRecordReader(file_path) as reader, open(temp_path, 'wb', buffering=1024 * 1024) as out:
+            truncator = PacketTruncator(profile, reader.link_type, snaplen)
+            out.write(reader.global_header)
+            for record in reader:
+                caplen = truncator.caplen_of(record.data)
+                out.write(reader.pack_record_header(record, caplen))
+                out.write(record.data[:caplen])
+                count += 1
+        os.replace(temp_path, file_path)
+
+        saved = original_size - os.path.getsize(file_path)
+        LogUtil().debug(logger_name, f"[CaptureProfileUtil] 已按抓包模板 {profile} 截断 {file_path}: "
+                                     f"{count} 个包, 节省 {saved} 字节")
+        return count, saved
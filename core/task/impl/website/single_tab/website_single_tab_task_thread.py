@@ -2,8 +2,11 @@ __doc__="单标签网页任务线程"
 __author__="Li Qingyun"
 __date__="2025-03-10"
 
+from collections import deque
+
 from tqdm import tqdm
 
+from core.filter.pcap_filter_worker_pool import PcapFilterWorkerPool
 from core.task.interface.task_config.task_capture_context import TaskStatus
 from core.task.interface.task_thread import TaskThread
 from core.util.data_loader.website_list_data_loader import WebsiteListDataLoader
@@ -37,6 +40,12 @@ class WebsiteSingleTabTaskThread(TaskThread):
         # 任务相关变量
         # 1. 网站列表数据加载器
         self.website_list_dataloader = None
+        # 2. 后台过滤进程池(为None时在抓取线程内同步过滤)
+        self.filter_worker_pool: PcapFilterWorkerPool = None
+        # 3. 等待计入上下文的抓取(按抓取顺序), 后台过滤完成后才计入 capture_context 和任务进度
+        self.pending_commits = deque()
+        # 4. 已经发起的当前网站抓取次数(包含还没计入上下文的)
+        self.scheduled_performed_times = 0
         pass
     
     @staticmethod
@@ -70,7 +79,10 @@ class WebsiteSingleTabTaskThread(TaskThread):
             # 1.1 恢复上下文
             self.recover_from_context()
             # 1.2 从中断位置继续执行任务(循环阻塞)
-            self.continue_perform()
+            try:
+                self.continue_perform()
+            finally:
+                self.__shutdown_filter_worker_pool()
         else:
             # 任务面板设置为全部完成
             self.console_panel.set_all_completed()
@@ -84,6 +96,8 @@ class WebsiteSingleTabTaskThread(TaskThread):
         当进程被通知stop, 停止标志位设置后, 需要调用这个来执行任务中断逻辑
         :return:
         """
+        # 0. 等待后台过滤完成, 把已完成的抓取计入上下文
+        self.__commit_finished_captures(block=True)
         # 1. 更新任务状态为手动中断
         self.task_config.capture_context.update_status(TaskStatus.INTERRUPT)
         # 2. 更新任务最后执行时间
@@ -95,6 +109,13 @@ class WebsiteSingleTabTaskThread(TaskThread):
 
 
     def finalize(self):
+        # 0. 等待后台过滤完成, 把剩余的抓取计入上下文
+        self.__commit_finished_captures(block=True)
+        # 有过滤失败的抓取时不能标记为完成, 按中断处理, 恢复任务时从失败的抓取重新开始
+        if self.__has_failed_capture():
+            self.task_being_interrupted()
+            self.clear()
+            return
         # 1. 更新任务状态为已完成
         self.task_config.capture_context.update_status(TaskStatus.FINISHED)
         # 2. 更新任务最后执行时间
@@ -144,16 +165,20 @@ class WebsiteSingleTabTaskThread(TaskThread):
         self.task_progress.set_total_progress(self.website_list_dataloader.get_total_line_num())
         self.task_progress.update_current_progress(self.website_list_dataloader.get_current_line_num())
 
-        # 3. 初始化console panel的数据
+        # 3. 创建后台过滤进程池
+        self.__create_filter_worker_pool()
+        self.scheduled_performed_times = self.task_config.capture_context.capture_performed_times
+
+        # 4. 初始化console panel的数据
         self.console_panel.init(task_name=self.task_name,
                                 visited_url_count=self.task_progress.current_progress,
                                 total_url_count=self.task_progress.total_progress)
 
-        # 4. 从定位的网站遍历网站列表, 直到全部网站都访问结束
+        # 5. 从定位的网站遍历网站列表, 直到全部网站都访问结束
         while self.website_list_dataloader.is_finish() is False:  # 读取未结束的情况下
             # 0. 检查停止标志
-            if self.stop_event.is_set():
-                # 如果有终止信号, 就停止任务
+            if self.stop_event.is_set() or self.__has_failed_capture():
+                # 如果有终止信号或后台过滤失败, 就停止任务
                 self.task_being_interrupted()
                 return
 
@@ -163,22 +188,23 @@ class WebsiteSingleTabTaskThread(TaskThread):
 
 
             # 2. 如果context中已经抓取的次数没有达到达到了policy中的次数, 就执行
-            if self.task_config.capture_context.capture_performed_times < self.task_config.capture_policy.capture_times:
+            #    (已发起但后台过滤还没完成的抓取也算在内)
+            if self.scheduled_performed_times < self.task_config.capture_policy.capture_times:
 
                 # 2.1 计算当前网站剩余抓取次数
                 capture_times_left = self.task_config.capture_policy.capture_times - \
-                                     self.task_config.capture_context.capture_performed_times
+                                     self.scheduled_performed_times
 
                 # 更新一下终端面板的抓取数据
                 self.console_panel.start_new_url(url=now_url,
-                                                 current_visit_times=self.task_config.capture_context.capture_performed_times,
+                                                 current_visit_times=self.scheduled_performed_times,
                                                  total_visit_times=self.task_config.capture_policy.capture_times
                                                  )
                 # 2.2 循环抓取
                 for capture_num in range(1, capture_times_left + 1):
                     # 4.1 检查终止信号
-                    if self.stop_event.is_set():
-                        # 如果有终止信号, 就停止任务
+                    if self.stop_event.is_set() or self.__has_failed_capture():
+                        # 如果有终止信号或后台过滤失败, 就停止任务
                         self.task_being_interrupted()
                         return
 
@@ -220,7 +246,8 @@ class WebsiteSingleTabTaskThread(TaskThread):
                         extension_config=extension_config_dict,
                         request_config=request_config_dict,
                         sniffer_config=sniffer_scapy_config,
-                        sniffer_conn_tracker_config=sniffer_conn_tracker_config
+                        sniffer_conn_tracker_config=sniffer_conn_tracker_config,
+                        filter_worker_pool=self.filter_worker_pool
                     )
                     LogUtil().debug(self.task_config.task_name, f'[WebsiteSingleTabTaskThread] 启动抓取流程')
                     # 启动抓取流程
@@ -229,14 +256,17 @@ class WebsiteSingleTabTaskThread(TaskThread):
                     # 阻塞等待执行结束
                     capture_thread.join()
 
-                    # 抓取一次完成后, 更新上下文, 并保存任务描述文件到磁盘
-                    self.task_config.capture_context.increase_capture_performed_times()
-                    self.save_config_to_disk()
-
-                    # 更新任务执行进度
-                    self.task_progress.update_current_progress(self.website_list_dataloader.get_current_line_num())
-
-                    # 完成当前网站内一次访问, 更新终端面板中的数据
+                    # 抓取一次完成后, 等后台过滤完成再更新上下文和任务进度
+                    self.scheduled_performed_times += 1
+                    self.pending_commits.append({
+                        'type': 'capture',
+                        'future': capture_thread.filter_future,
+                        'line_num': self.website_list_dataloader.get_current_line_num(),
+                    })
+                    self.__commit_finished_captures(block=False)
+
+                    # 完成当前网站内一次访问, 更新终端面板中的数据(包括抓包统计)
+                    self.console_panel.add_capture_stats(capture_thread.capture_stats)
                     self.console_panel.finish_one_visit_in_website()
                     pass
                 # end for capture_num (一个网站内的次数抓完了)
@@ -244,15 +274,14 @@ class WebsiteSingleTabTaskThread(TaskThread):
 
             # 移到下一个网站
             self.website_list_dataloader.move_next_line()
+            self.scheduled_performed_times = 0
 
-            # 更新上下文
-            self.task_config.capture_context.update_counter(self.website_list_dataloader.current_line)
-            self.task_config.capture_context.update_last_perform_time(TimeUtil.now_time_str())
-            # 清空上下文中网站的抓取次数
-            self.task_config.capture_context.clear_capture_performed_times()
-
-            # 保存一下任务
-            self.save_config_to_disk()
+            # 更新上下文(排在当前网站所有抓取之后, 这些抓取都计入上下文后才更新)
+            self.pending_commits.append({
+                'type': 'website',
+                'line': self.website_list_dataloader.current_line,
+            })
+            self.__commit_finished_captures(block=False)
 
             # 完成一整个网站的所有访问次数, 更新终端面板中的数据
             self.console_panel.finish_one_website()
@@ -266,6 +295,80 @@ class WebsiteSingleTabTaskThread(TaskThread):
 
 
 
+    def __create_filter_worker_pool(self):
+        """
+        根据 sniffer 配置中的 filter_config 创建后台过滤进程池
+        :return:
+        """
+        filter_config = None
+        if self.task_config.sniffer_config is not None and self.task_config.sniffer_config.scapy_config_dict is not None:
+            filter_config = self.task_config.sniffer_config.scapy_config_dict.get('filter_config')
+
+        self.filter_worker_pool = PcapFilterWorkerPool.create_worker_pool_by_config(filter_config)
+        if self.filter_worker_pool is not None:
+            LogUtil().debug(self.task_config.task_name,
+                            f'[WebsiteSingleTabTaskThread] 启用后台过滤 (进程数: {self.filter_worker_pool.max_workers})')
+
+
+    def __shutdown_filter_worker_pool(self):
+        """
+        关闭后台过滤进程池
+        :return:
+        """
+        if self.filter_worker_pool is not None:
+            self.filter_worker_pool.shutdown(wait=True)
+            self.filter_worker_pool = None
+
+
+    def __has_failed_capture(self) -> bool:
+        """
+        队首的抓取是否后台过滤失败(之后的抓取都无法计入上下文, 任务需要中断, 恢复时从它重新抓取)
+        :return: bool
+        """
+        return len(self.pending_commits) > 0 and self.pending_commits[0].get('failed') is True
+
+
+    def __commit_finished_captures(self, block: bool):
+        """
+        按抓取顺序, 把后台过滤已完成的抓取计入上下文和任务进度, 并保存到磁盘
+            只从队首开始提交, 保证中断后上下文里记录的抓取都已经过滤完成
+            过滤失败的抓取不提交, 它和之后的抓取都留在队列中, 任务随后按中断结束(见 __has_failed_capture), 恢复任务时从这里重新抓取
+        :param block: 是否等待所有在途的过滤完成
+        :return:
+        """
+        committed = False
+        while len(self.pending_commits) > 0:
+            entry = self.pending_commits[0]
+
+            if entry['type'] == 'capture':
+                future = entry['future']
+                if future is not None:
+                    if not future.done() and not block:
+                        break
+                    exception = future.exception()
+                    if exception is not None:
+                        if not entry.get('failed'):
+                            entry['failed'] = True
+                            LogUtil().error(self.task_config.task_name,
+                                            f'[WebsiteSingleTabTaskThread] 后台过滤失败, 该抓取不计入上下文: {exception}')
+                        break
+                self.task_config.capture_context.increase_capture_performed_times()
+                # 更新任务执行进度
+                self.task_progress.update_current_progress(entry['line_num'])
+            else:
+                self.task_config.capture_context.update_counter(entry['line'])
+                self.task_config.capture_context.update_last_perform_time(TimeUtil.now_time_str())
+                # 清空上下文中网站的抓取次数
+                self.task_config.capture_context.clear_capture_performed_times()
+
+            self.pending_commits.popleft()
+            committed = True
+
+        # 保存一下任务
+        if committed:
+            self.save_config_to_disk()
+
+
     def save_config_to_disk(self):
         """
         保存任务到磁盘
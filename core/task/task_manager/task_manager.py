@@ -6,6 +6,7 @@ import signal
 import threading
 from time import sleep
 
+from core.sniffer.shared.shared_capture_service import SharedCaptureService
 from core.task.task_manager.performable import Performable
 from core.util.console.rich.controller.task_manager_console_controller import TaskManagerConsoleController
 from core.util.io.log_util import LogUtil
@@ -33,6 +34,8 @@ class TaskManager:
         self.task_group_note = None
         # 最大同时线程量
         self.max_concurrent_num = 1
+        # 共享抓包配置(为None或未启用时, 每次抓取使用各自的嗅探器)
+        self.shared_capture_config = None
 
 
         # 下一个要执行的index
@@ -66,6 +69,23 @@ class TaskManager:
         self.console_controller.init(task_panel_list=task_panel_list)
         self.console_controller.start_refresh()
 
+        # 启动共享抓包服务(每个网卡一个长期运行的轮转抓包, 任务管理器退出时停止)
+        if self.shared_capture_config is not None and self.shared_capture_config.get('enable', False) is True:
+            SharedCaptureService().start(self.shared_capture_config)
+
+        try:
+            self.__perform_loop()
+        finally:
+            if SharedCaptureService().is_running():
+                SharedCaptureService().stop()
+
+
+    def __perform_loop(self):
+        """
+        循环执行任务, 直到全部完成或收到中断信号
+        :return:
+        """
+
         # 循环判断是否有任务需要执行
         while self._stop_event.is_set() is False:
             # 还有没执行的线程
@@ -173,6 +193,9 @@ class TaskManager:
         # 3. 获取最大并发数
         self.max_concurrent_num = config_dict.get("max_concurrent_num", 1)
 
+        # 3.1 共享抓包配置(可选)
+        self.shared_capture_config = config_dict.get("shared_capture")
+
         # 4. 循环创建Performable
         performable_dict_list = config_dict.get("task_list")
         for performable_dict in performable_dict_list:
@@ -191,6 +214,8 @@ class TaskManager:
             "max_concurrent_num": self.max_concurrent_num,
             "task_list": [performable.to_dict() for performable in self.performable_list]
         }
+        if self.shared_capture_config is not None:
+            config_dict["shared_capture"] = self.shared_capture_config
         commented_yaml_data = YamlUtil().add_cycle_comments(config_dict, self.get_comment_for_yaml_data())
         YamlUtil().dump_with_comments(commented_yaml_data, self.task_group_file_path)
 
@@ -205,5 +230,6 @@ class TaskManager:
             "task_group_name": "任务组名",
             "task_group_note": "任务组备注",
             "max_concurrent_num": "最大并发数",
+            "shared_capture": "共享抓包配置",
             "task_list": "任务列表"
         }
\ No newline at end of file
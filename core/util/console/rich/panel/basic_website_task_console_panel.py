@@ -46,6 +46,11 @@ class BasicWebsiteTaskConsolePanel:
         # 3. 所有任务是否完成
         self._all_tasks_finished = False
 
+        # 4. 抓包统计(累计)
+        self._captured_packets = 0
+        self._dropped_packets = 0
+        self._last_capture_dropped = False     # 最近一次抓取是否有丢包
+
 
         # 创建网站列表进度条
         self.total_url_progress = Progress(
@@ -124,6 +129,18 @@ class BasicWebsiteTaskConsolePanel:
                 if self._visited_url_count >= self._total_url_count:
                     self._all_tasks_finished = True
 
+    def add_capture_stats(self, capture_stats):
+        """
+        累计一次抓取的抓包统计
+        :param capture_stats: CaptureStats(拿不到统计时为None)
+        """
+        if capture_stats is None:
+            return
+        with self._lock:
+            self._captured_packets += capture_stats.captured or 0
+            self._dropped_packets += capture_stats.dropped or 0
+            self._last_capture_dropped = bool(capture_stats.dropped)
+
     def set_all_finished(self):
         """设置所有任务为完成状态"""
         with self._lock:
@@ -158,6 +175,12 @@ class BasicWebsiteTaskConsolePanel:
                 border_style = "bright_blue"
                 subtitle = f"{completion_pct:.1f}%"
 
+            # 抓包统计: 有丢包时标黄, 提示调整并发数或缓冲区
+            if self._captured_packets > 0 or self._dropped_packets > 0:
+                subtitle += f" | 抓包 {self._captured_packets} 丢包 {self._dropped_packets}"
+                if self._last_capture_dropped and not self.is_all_finished():
+                    border_style = "yellow"
+
             return Panel(
                 task_layout,
                 title=f"[bold cyan]任务{self.task_name}[/bold cyan]",
@@ -2,7 +2,11 @@ __doc__='外部子进程类'
 __auther__='Li Qingyun'
 __date__='2025-03-01'
 
+import platform
 import signal
+import threading
+import time
+from collections import deque
 
 from core.util.io.log_util import LogUtil
 
@@ -27,6 +31,11 @@ class OuterSubProcessHelper:
                  logger_name: str='main',
                  enable_log: bool=False,
                  log_file_path: str = None,
+                 ready_patterns: list = None,
+                 output_max_lines: int = 1000,
+                 output_callbacks: list = None,
+                 stop_signal=None,
+                 stop_timeout: float = 5.0,
                  ):
         """
         初始化
@@ -35,6 +44,11 @@ class OuterSubProcessHelper:
         :param start_command:   启动命令
         :param enable_log:      是否启用日志
         :param log_file_path:   日志文件路径
+        :param ready_patterns:  表示进程已就绪的输出内容(如 tcpdump 的 "listening on"), 输出中出现任一项即视为就绪
+        :param output_max_lines: 保留的最近输出行数(更早的行被丢弃)
+        :param output_callbacks: 每读到一行输出时调用的回调列表, 参数为该行(str)
+        :param stop_signal:     停止时先发送的信号(如 signal.SIGINT, 让 tcpdump 写完缓冲区再退出), 为None或在Windows上时直接terminate
+        :param stop_timeout:    每一步停止(信号/terminate)后等待进程退出的超时(秒), 超时后升级到下一步
         """
         self.logger_name = logger_name        # 日志记录器名称
         self.name = name                      # 自定义的进程名
@@ -45,6 +59,21 @@ class OuterSubProcessHelper:
         self.__process = None                 # 进程
         self.__status = None                  # 进程状态
 
+        # 就绪检测: 不写日志文件时, 由读取线程逐行读取输出, 出现 ready_patterns 中的内容即就绪
+        self.ready_patterns = ready_patterns if ready_patterns is not None else []
+        self._ready_event = threading.Event()
+        # 读取线程持续读走管道中的输出, 只保留最近 output_max_lines 行(环形缓冲区), 内存占用有上限
+        self._output_lines = deque(maxlen=output_max_lines)
+        self._output_lock = threading.Lock()
+        self._output_line_count = 0             # 读到的总行数(含已丢弃的)
+        self._output_callbacks = list(output_callbacks) if output_callbacks is not None else []
+        self._output_thread = None              # 输出读取线程
+
+        # 停止流程: stop_signal -> terminate -> kill, 每一步最多等待 stop_timeout
+        self.stop_signal = stop_signal
+        self.stop_timeout = stop_timeout
+        self.stopped_gracefully = None          # 最近一次停止是否由 stop_signal 正常退出(未停止过或没有发送 stop_signal 时为None)
+
         # self.stop_command = None              # 停止命令
         pass
 
@@ -139,9 +168,108 @@ class OuterSubProcessHelper:
             return
 
         LogUtil().debug(self.logger_name, f"[OuterSubProcessHelper(name: {self.name}).open()] 已启动, PID: {self.pid}")
+
+        # 输出到管道时, 启动读取线程(否则管道写满后进程会阻塞, 也无法检测就绪)
+        if std_out == subprocess.PIPE:
+            self._output_thread = threading.Thread(target=self._read_output,
+                                                   name=f'OuterSubProcessOutput-{self.pid}', daemon=True)
+            self._output_thread.start()
         pass
 
 
+    def _read_output(self):
+        """
+        逐行读取进程输出(读取线程), 直到进程关闭输出
+            管道被持续读走, 输出再多进程也不会因为管道写满而阻塞
+        :return:
+        """
+        try:
+            for line in self.__process.stdout:
+                with self._output_lock:
+                    self._output_lines.append(line)
+                    self._output_line_count += 1
+                if self._ready_event.is_set() is False and any(pattern in line for pattern in self.ready_patterns):
+                    self._ready_event.set()
+                for callback in self._output_callbacks:
+                    try:
+                        callback(line)
+                    except Exception as e:
+                        LogUtil().warning(self.logger_name,
+                                          f"[OuterSubProcessHelper(name: {self.name})._read_output()] 输出回调异常: {e}")
+        except (OSError, ValueError):
+            # 管道已关闭
+            pass
+
+
+    def add_output_callback(self, callback):
+        """
+        添加输出回调, 之后每读到一行输出都会在读取线程中调用(回调应尽快返回, 否则会拖慢读取)
+        :param callback: 回调函数, 参数为该行输出(str, 含换行符)
+        :return:
+        """
+        self._output_callbacks.append(callback)
+
+
+    def get_last_lines(self, n: int = None) -> list:
+        """
+        获取最近的输出行
+        :param n: 行数(为None时返回缓冲区中的全部行)
+        :return: list[str]
+        """
+        with self._output_lock:
+            lines = list(self._output_lines)
+        if n is not None:
+            lines = lines[-n:] if n > 0 else []
+        return lines
+
+
+    def get_output(self) -> str:
+        """
+        读取线程目前读到的输出(最近 output_max_lines 行; 进程结束后包含最后的输出, 如 tcpdump 退出时打印的统计)
+        :return: str
+        """
+        return ''.join(self.get_last_lines())
+
+
+    @property
+    def output_line_count(self) -> int:
+        """读取线程读到的总行数(包括已经从缓冲区丢弃的)"""
+        return self._output_line_count
+
+
+    def wait_until_ready(self, timeout: float, ready_check=None, poll_interval: float = 0.05) -> bool:
+        """
+        等待进程就绪
+            输出中出现 ready_patterns 中的内容, 或 ready_check() 返回 True 时视为就绪
+            进程提前退出或超时都会记录日志并返回 False
+        :param timeout: 超时时间(秒)
+        :param ready_check: 额外的就绪检查(无参数, 返回 bool), 如输出文件已写出文件头
+        :param poll_interval: 检查间隔(秒)
+        :return: 是否就绪
+        """
+        if self._is_process_exist() is False:
+            LogUtil().error(self.logger_name, f"[OuterSubProcessHelper(name: {self.name}).wait_until_ready()] 进程未启动")
+            return False
+
+        deadline = time.time() + timeout
+        while True:
+            if self._ready_event.is_set() or (ready_check is not None and ready_check()):
+                return True
+            if self.__process.poll() is not None:
+                # 进程已经退出, 读取线程会读完剩余输出
+                if self._output_thread is not None:
+                    self._output_thread.join(timeout=1)
+                LogUtil().error(self.logger_name,
+                                f"[OuterSubProcessHelper(name: {self.name}).wait_until_ready()] 进程已退出, "
+                                f"返回码: {self.__process.returncode}, 输出: {self.get_output().strip()}")
+                return False
+            if time.time() >= deadline:
+                LogUtil().warning(self.logger_name,
+                                  f"[OuterSubProcessHelper(name: {self.name}).wait_until_ready()] {timeout}s 内未检测到就绪")
+                return False
+            self._ready_event.wait(poll_interval)
+
+
     def _terminate_process(self):
         """
         kill进程
@@ -154,11 +282,7 @@ class OuterSubProcessHelper:
                 self._close_log_file()
                 # 终止进程
                 LogUtil().debug(self.logger_name, f"[OuterSubProcessHelper(name: {self.name})._kill()] 正在尝试终止进程")
-                # 发送停止信号, 模拟Ctrl-C退出
-                # self.__process.send_signal(signal.SIGINT)
-
-                self.__process.terminate() # terminate 会直接中断, 可能会导致程序数据写入丢失
-                self.__process.wait()       # todo: 不确定这个要不要加
+                self.stopped_gracefully = self._stop_with_escalation()
 
                 # 获取终止后的输出
                 output_message = self._safe_communicate_and_decode()
@@ -173,6 +297,42 @@ class OuterSubProcessHelper:
         pass
 
 
+    def _stop_with_escalation(self):
+        """
+        逐步停止进程: 先发送 stop_signal(模拟Ctrl-C, 进程写完缓冲区后自行退出), 超时后 terminate, 再超时 kill
+            进程一退出就返回, 不会多等
+        :return: 是否由 stop_signal 正常退出(没有发送 stop_signal 时为None)
+        """
+        if self.__process.poll() is not None:
+            # 已经停止过或自行退出了
+            return self.stopped_gracefully
+
+        start_ts = time.time()
+        signal_sent = self.stop_signal is not None and platform.system() != 'Windows'
+        if signal_sent:
+            self.__process.send_signal(self.stop_signal)
+            try:
+                self.__process.wait(timeout=self.stop_timeout)
+                LogUtil().debug(self.logger_name,
+                                f"[OuterSubProcessHelper(name: {self.name})._kill()] 进程已正常退出, "
+                                f"耗时 {time.time() - start_ts:.2f}s, 返回码: {self.__process.returncode}")
+                return True
+            except subprocess.TimeoutExpired:
+                LogUtil().warning(self.logger_name,
+                                  f"[OuterSubProcessHelper(name: {self.name})._kill()] "
+                                  f"{self.stop_timeout}s 内未响应 {signal.Signals(self.stop_signal).name}, 改为 terminate")
+
+        self.__process.terminate()      # terminate 会直接中断, 可能会导致程序数据写入丢失
+        try:
+            self.__process.wait(timeout=self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            LogUtil().warning(self.logger_name,
+                              f"[OuterSubProcessHelper(name: {self.name})._kill()] {self.stop_timeout}s 内未响应 terminate, 改为 kill")
+            self.__process.kill()
+            self.__process.wait()
+        return False if signal_sent else None
+
+
     def stop_process(self):
         LogUtil().debug(self.logger_name, f'[OuterSubProcessHelper.start()] 进程 {self.name} 正在准备停止')
         self._terminate_process()
@@ -188,6 +348,11 @@ class OuterSubProcessHelper:
         if not self.__process:
             return ""
 
+        # 有读取线程时, 输出已经由它读取
+        if self._output_thread is not None:
+            self._output_thread.join(timeout=2)
+            return self.get_output()
+
         # 获取输出
         output_data, _ = self.__process.communicate()
 
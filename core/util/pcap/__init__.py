@@ -0,0 +1,8 @@
+from .pcap_record_reader import PcapRecordReader, PcapRecord
+from .packet_key_util import PacketKeyUtil
+from .pcap_range_writer import PcapRangeWriter
+from .pcap_flow_splitter import PcapFlowSplitter
+from .pcapng_block_reader import PcapngBlockReader, PcapngBlock
+from .pcap_codec import PcapCodec, PcapCodecUtil
+from .pcap_repair_util import PcapRepairUtil
+from .pcap_flow_index import PcapFlowIndex, PcapFlowIndexWriter
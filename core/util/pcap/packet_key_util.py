@@ -0,0 +1,284 @@
+__doc__ = "从原始字节提取数据包四元组"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-10"
+
+import socket
+
+
+class PacketKeyUtil:
+    """
+    直接按固定偏移读取原始记录字节, 提取 (src_ip, src_port, dst_ip, dst_port)
+        不经过 scapy 解析, 单包开销从几十微秒降到 1~2 微秒
+        支持的链路层: Ethernet(含 VLAN) / Linux cooked(SLL, SLL2) / Raw IP / BSD loopback
+        支持的网络层: IPv4 / IPv6(含扩展头)
+        支持的传输层: TCP / UDP
+    """
+
+    # 链路层类型(LINKTYPE_*)
+    LINKTYPE_NULL = 0
+    LINKTYPE_ETHERNET = 1
+    LINKTYPE_RAW = 101
+    LINKTYPE_LOOP = 108
+    LINKTYPE_LINUX_SLL = 113
+    LINKTYPE_IPV4 = 228
+    LINKTYPE_IPV6 = 229
+    LINKTYPE_LINUX_SLL2 = 276
+    # 部分系统的 pcap 文件里 Raw IP 会写成 DLT 值
+    DLT_RAW_ALIASES = (12, 14)
+
+    # 以太网类型
+    ETHERTYPE_IPV4 = 0x0800
+    ETHERTYPE_IPV6 = 0x86DD
+    ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+    # 传输层协议号
+    PROTO_TCP = 6
+    PROTO_UDP = 17
+
+    # IPv6 扩展头
+    IPV6_EXT_HOP_BY_HOP = 0
+    IPV6_EXT_ROUTING = 43
+    IPV6_EXT_FRAGMENT = 44
+    IPV6_EXT_AH = 51
+    IPV6_EXT_DEST_OPTS = 60
+    IPV6_EXT_MOBILITY = 135
+
+    # 解析成功但不是 TCP/UDP 的 IP 包(与 scapy 路径的结果一样, 不会命中任何连接)
+    NON_MATCHING_KEY = (None, None, None, None)
+
+    # TCP 标志位
+    TCP_FLAG_FIN = 0x01
+    TCP_FLAG_SYN = 0x02
+    TCP_FLAG_RST = 0x04
+
+
+    @staticmethod
+    def extract_key(link_type: int, data: bytes):
+        """
+        从原始记录提取四元组
+        :param link_type: pcap 链路层类型
+        :param data: 记录数据(从链路层开始)
+        :return: (src_ip, src_port, dst_ip, dst_port)
+                 确定不是 TCP/UDP 时返回 NON_MATCHING_KEY
+                 无法解析(未知链路层/头部被截断等)时返回 None, 由调用方回退到 scapy
+        """
+        l3_offset = PacketKeyUtil.get_l3_offset(link_type, data)
+        if l3_offset is None:
+            return None
+        if l3_offset < 0:
+            return PacketKeyUtil.NON_MATCHING_KEY
+        return PacketKeyUtil.extract_key_from_ip(data, l3_offset)
+
+
+    @staticmethod
+    def get_l3_offset(link_type: int, data: bytes):
+        """
+        计算网络层在记录中的偏移
+        :param link_type: pcap 链路层类型
+        :param data: 记录数据
+        :return: 偏移; 确定不是 IP 时返回 -1; 无法解析时返回 None
+        """
+        if link_type == PacketKeyUtil.LINKTYPE_ETHERNET:
+            offset = 12
+            if len(data) < offset + 2:
+                return None
+            ether_type = (data[offset] << 8) | data[offset + 1]
+            # 跳过 VLAN 标签(最多两层)
+            for _ in range(2):
+                if ether_type not in PacketKeyUtil.ETHERTYPE_VLAN:
+                    break
+                offset += 4
+                if len(data) < offset + 2:
+                    return None
+                ether_type = (data[offset] << 8) | data[offset + 1]
+            return PacketKeyUtil._l3_offset_by_ether_type(ether_type, offset + 2)
+
+        if link_type == PacketKeyUtil.LINKTYPE_LINUX_SLL:
+            if len(data) < 16:
+                return None
+            return PacketKeyUtil._l3_offset_by_ether_type((data[14] << 8) | data[15], 16)
+
+        if link_type == PacketKeyUtil.LINKTYPE_LINUX_SLL2:
+            if len(data) < 20:
+                return None
+            return PacketKeyUtil._l3_offset_by_ether_type((data[0] << 8) | data[1], 20)
+
+        if link_type in (PacketKeyUtil.LINKTYPE_RAW, PacketKeyUtil.LINKTYPE_IPV4, PacketKeyUtil.LINKTYPE_IPV6) \
+                or link_type in PacketKeyUtil.DLT_RAW_ALIASES:
+            return 0
+
+        if link_type in (PacketKeyUtil.LINKTYPE_NULL, PacketKeyUtil.LINKTYPE_LOOP):
+            # 4字节地址族, 字节序不定, 直接看 IP 版本号
+            return 4
+
+        return None
+
+
+    @staticmethod
+    def _l3_offset_by_ether_type(ether_type: int, offset: int):
+        """
+        根据以太网类型判断是否为 IP
+        :return: IP 返回 offset, 否则返回 -1
+        """
+        if ether_type == PacketKeyUtil.ETHERTYPE_IPV4 or ether_type == PacketKeyUtil.ETHERTYPE_IPV6:
+            return offset
+        return -1
+
+
+    @staticmethod
+    def extract_key_from_ip(data: bytes, l3_offset: int):
+        """
+        从 IP 头开始提取四元组
+        :param data: 记录数据
+        :param l3_offset: IP 头偏移
+        :return: 同 extract_key
+        """
+        if len(data) < l3_offset + 1:
+            return None
+
+        version = data[l3_offset] >> 4
+        if version == 4:
+            if len(data) < l3_offset + 20:
+                return None
+            ihl = (data[l3_offset] & 0x0F) * 4
+            if ihl < 20:
+                return None
+            protocol = data[l3_offset + 9]
+            # 非首个分片没有传输层头
+            fragment_offset = ((data[l3_offset + 6] & 0x1F) << 8) | data[l3_offset + 7]
+            if fragment_offset != 0 or (protocol != PacketKeyUtil.PROTO_TCP and protocol != PacketKeyUtil.PROTO_UDP):
+                return PacketKeyUtil.NON_MATCHING_KEY
+            src_ip = socket.inet_ntoa(data[l3_offset + 12:l3_offset + 16])
+            dst_ip = socket.inet_ntoa(data[l3_offset + 16:l3_offset + 20])
+            l4_offset = l3_offset + ihl
+
+        elif version == 6:
+            if len(data) < l3_offset + 40:
+                return None
+            l4_offset, protocol = PacketKeyUtil._skip_ipv6_ext_headers(data, l3_offset)
+            if l4_offset is None:
+                return None
+            if protocol != PacketKeyUtil.PROTO_TCP and protocol != PacketKeyUtil.PROTO_UDP:
+                return PacketKeyUtil.NON_MATCHING_KEY
+            src_ip = socket.inet_ntop(socket.AF_INET6, data[l3_offset + 8:l3_offset + 24])
+            dst_ip = socket.inet_ntop(socket.AF_INET6, data[l3_offset + 24:l3_offset + 40])
+
+        else:
+            return None
+
+        if len(data) < l4_offset + 4:
+            return None
+        src_port = (data[l4_offset] << 8) | data[l4_offset + 1]
+        dst_port = (data[l4_offset + 2] << 8) | data[l4_offset + 3]
+
+        return src_ip, src_port, dst_ip, dst_port
+
+
+    @staticmethod
+    def get_tcp_flags(link_type: int, data: bytes):
+        """
+        从原始记录读取 TCP 标志位
+        :param link_type: pcap 链路层类型
+        :param data: 记录数据(从链路层开始)
+        :return: 标志位字节, 不是 TCP 或无法解析时返回 None
+        """
+        l3_offset = PacketKeyUtil.get_l3_offset(link_type, data)
+        if l3_offset is None or l3_offset < 0 or len(data) < l3_offset + 1:
+            return None
+
+        version = data[l3_offset] >> 4
+        if version == 4:
+            if len(data) < l3_offset + 20:
+                return None
+            fragment_offset = ((data[l3_offset + 6] & 0x1F) << 8) | data[l3_offset + 7]
+            if data[l3_offset + 9] != PacketKeyUtil.PROTO_TCP or fragment_offset != 0:
+                return None
+            l4_offset = l3_offset + (data[l3_offset] & 0x0F) * 4
+        elif version == 6:
+            if len(data) < l3_offset + 40:
+                return None
+            l4_offset, protocol = PacketKeyUtil._skip_ipv6_ext_headers(data, l3_offset)
+            if l4_offset is None or protocol != PacketKeyUtil.PROTO_TCP:
+                return None
+        else:
+            return None
+
+        if len(data) < l4_offset + 14:
+            return None
+        return data[l4_offset + 13]
+
+
+    @staticmethod
+    def locate_payload(link_type: int, data: bytes):
+        """
+        定位 TCP/UDP 载荷
+        :param link_type: pcap 链路层类型
+        :param data: 记录数据(从链路层开始)
+        :return: (传输层协议号, 网络层偏移, 传输层偏移, 载荷偏移), 不是 TCP/UDP(含非首个分片)或无法解析时返回 None
+        """
+        l3_offset = PacketKeyUtil.get_l3_offset(link_type, data)
+        if l3_offset is None or l3_offset < 0 or len(data) < l3_offset + 1:
+            return None
+
+        version = data[l3_offset] >> 4
+        if version == 4:
+            if len(data) < l3_offset + 20:
+                return None
+            fragment_offset = ((data[l3_offset + 6] & 0x1F) << 8) | data[l3_offset + 7]
+            protocol = data[l3_offset + 9]
+            if fragment_offset != 0:
+                return None
+            l4_offset = l3_offset + (data[l3_offset] & 0x0F) * 4
+        elif version == 6:
+            if len(data) < l3_offset + 40:
+                return None
+            l4_offset, protocol = PacketKeyUtil._skip_ipv6_ext_headers(data, l3_offset)
+            if l4_offset is None:
+                return None
+        else:
+            return None
+
+        if protocol == PacketKeyUtil.PROTO_TCP:
+            if len(data) < l4_offset + 13:
+                return None
+            return protocol, l3_offset, l4_offset, l4_offset + (data[l4_offset + 12] >> 4) * 4
+        if protocol == PacketKeyUtil.PROTO_UDP:
+            return protocol, l3_offset, l4_offset, l4_offset + 8
+        return None
+
+
+    @staticmethod
+    def _skip_ipv6_ext_headers(data: bytes, l3_offset: int):
+        """
+        跳过 IPv6 扩展头
+        :param data: 记录数据
+        :param l3_offset: IPv6 头偏移
+        :return: (传输层偏移, 传输层协议号); 被截断时返回 (None, None)
+                 非首个分片返回协议号 -1
+        """
+        next_header = data[l3_offset + 6]
+        offset = l3_offset + 40
+
+        while True:
+            if next_header in (PacketKeyUtil.IPV6_EXT_HOP_BY_HOP,
+                               PacketKeyUtil.IPV6_EXT_ROUTING,
+                               PacketKeyUtil.IPV6_EXT_DEST_OPTS,
+                               PacketKeyUtil.IPV6_EXT_MOBILITY):
+                if len(data) < offset + 2:
+                    return None, None
+                next_header, ext_len = data[offset], (data[offset + 1] + 1) * 8
+            elif next_header == PacketKeyUtil.IPV6_EXT_FRAGMENT:
+                if len(data) < offset + 8:
+                    return None, None
+                fragment_offset = ((data[offset + 2] << 8) | data[offset + 3]) >> 3
+                if fragment_offset != 0:
+                    return offset + 8, -1
+                next_header, ext_len = data[offset], 8
+            elif next_header == PacketKeyUtil.IPV6_EXT_AH:
+                if len(data) < offset + 2:
+                    return None, None
+                next_header, ext_len = data[offset], (data[offset + 1] + 2) * 4
+            else:
+                return offset, next_header
+
+            offset += ext_len
@@ -0,0 +1,160 @@
+__doc__ = "pcap 压缩存储的编解码器"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-21"
+
+import gzip
+import lzma
+from abc import ABCMeta, abstractmethod
+from pathlib import Path
+
+
+class PcapCodec(metaclass=ABCMeta):
+    """
+    pcap 压缩编解码器接口
+        每种编解码器提供名称、文件后缀、文件开头的魔数, 以及流式打开文件的方法
+        新的编解码器实现该接口后通过 PcapCodecUtil.register_codec 注册即可
+    """
+
+    name: str = None        # 配置中使用的名称
+    suffix: str = None      # 文件后缀(如 .gz), 接在 .pcap/.pcapng 之后
+    magic: bytes = None     # 压缩文件开头的魔数(用于自动识别)
+
+    @abstractmethod
+    def open(self, file_path: str, mode: str = 'rb'):
+        """
+        流式打开压缩文件
+        :param file_path: 文件路径
+        :param mode: 'rb' 或 'wb'
+        :return: 文件对象(支持 read/write/close, 读时支持向前 seek)
+        """
+        pass
+
+
+class GzipPcapCodec(PcapCodec):
+    """gzip 压缩(速度快, 压缩率一般)"""
+
+    name = 'gzip'
+    suffix = '.gz'
+    magic = b'\x1f\x8b'
+
+    def __init__(self, compress_level: int = 6):
+        """
+        :param compress_level: 压缩级别(1~9)
+        """
+        self.compress_level = compress_level
+
+    def open(self, file_path: str, mode: str = 'rb'):
+        if 'w' in mode:
+            return gzip.open(file_path, mode, compresslevel=self.compress_level)
+        return gzip.open(file_path, mode)
+
+
+class LzmaPcapCodec(PcapCodec):
+    """lzma(xz) 压缩(压缩率高, 速度较慢)"""
+
+    name = 'lzma'
+    suffix = '.xz'
+    magic = b'\xfd7zXZ\x00'
+
+    def __init__(self, preset: int = 1):
+        """
+        :param preset: 压缩预设(0~9), 抓包数据量大, 默认使用较快的预设
+        """
+        self.preset = preset
+
+    def open(self, file_path: str, mode: str = 'rb'):
+        if 'w' in mode:
+            return lzma.open(file_path, mode, format=lzma.FORMAT_XZ, preset=self.preset)
+        return lzma.open(file_path, mode)
+
+
+class PcapCodecUtil:
+    """
+    pcap 压缩工具
+        按名称查找编解码器, 按文件开头的魔数识别压缩格式, 透明地打开压缩或未压缩的 pcap/pcapng
+    """
+
+    NONE = 'none'   # 不压缩
+
+    _codecs = {
+        GzipPcapCodec.name: GzipPcapCodec(),
+        LzmaPcapCodec.name: LzmaPcapCodec(),
+    }
+
+
+    @staticmethod
+    def register_codec(codec: PcapCodec):
+        """
+        注册编解码器(同名会覆盖, 可用于修改压缩级别)
+        :param codec: PcapCodec
+        :return:
+        """
+        PcapCodecUtil._codecs[codec.name] = codec
+
+
+    @staticmethod
+    def get_codec(name):
+        """
+        按名称获取编解码器
+        :param name: 名称(None 或 'none' 表示不压缩)
+        :return: PcapCodec, 不压缩返回 None
+        """
+        if name is None or name == PcapCodecUtil.NONE:
+            return None
+        codec = PcapCodecUtil._codecs.get(name)
+        if codec is None:
+            raise ValueError(f"[PcapCodecUtil] 不支持的压缩格式: {name} (可选: {', '.join(PcapCodecUtil._codecs)})")
+        return codec
+
+
+    @staticmethod
+    def get_suffixes() -> list:
+        """
+        所有已注册编解码器的文件后缀
+        :return: list
+        """
+        return [codec.suffix for codec in PcapCodecUtil._codecs.values()]
+
+
+    @staticmethod
+    def detect_codec(file_path: str):
+        """
+        按文件开头的魔数识别压缩格式
+        :param file_path: 文件路径
+        :return: PcapCodec, 未压缩返回 None
+        """
+        max_magic_len = max(len(codec.magic) for codec in PcapCodecUtil._codecs.values())
+        with open(file_path, 'rb') as f:
+            head = f.read(max_magic_len)
+        for codec in PcapCodecUtil._codecs.values():
+            if head.startswith(codec.magic):
+                return codec
+        return None
+
+
+    @staticmethod
+    def open_file(file_path: str, buffer_size: int = -1):
+        """
+        透明地打开 pcap/pcapng 文件(只读), 压缩文件自动解压
+        :param file_path: 文件路径
+        :param buffer_size: 未压缩文件的读缓冲区大小(字节)
+        :return: 文件对象
+        """
+        codec = PcapCodecUtil.detect_codec(file_path)
+        if codec is None:
+            return open(file_path, 'rb', buffering=buffer_size)
+        return codec.open(file_path, 'rb')
+
+
+    @staticmethod
+    def strip_suffix(file_path) -> Path:
+        """
+        去掉压缩后缀, 例: a.pcap.gz -> a.pcap
+        :param file_path: 文件路径
+        :return: Path
+        """
+        file_path = Path(file_path)
+        for suffix in PcapCodecUtil.get_suffixes():
+            if file_path.name.endswith(suffix):
+                return file_path.with_name(file_path.name[:-len(suffix)])
+        return file_path
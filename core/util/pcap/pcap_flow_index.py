@@ -0,0 +1,240 @@
+__doc__ = "pcap 连接索引(随机读取某个连接或某段时间的记录)"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-23"
+
+import math
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from core.util.pcap.pcap_codec import PcapCodecUtil
+from core.util.pcap.pcap_record_reader import PcapRecordReader
+
+
+# 索引文件格式(小端):
+#   文件头: 魔数(8) 版本(H) 保留(H) 连接数(I) 记录数(Q) 时间桶秒数(d) 第一个桶的起始时间(d) 桶数(I)
+#   连接表: 每个连接 key 长度(H) + key(utf-8) + 记录数(I)
+#   记录偏移: 按连接表顺序依次排列的记录偏移(Q 数组, 每个连接内按偏移递增)
+#   时间表: 每个桶 (桶内记录的最小起始偏移, 最大结束偏移)(Q 数组), 没有记录的桶为 (0, 0)
+INDEX_MAGIC = b'SBFIDX\x00\x01'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<8sHHIQddI')
+
+
+def _to_little_endian(values: array) -> array:
+    """array 按本机字节序存储, 写入/读取前统一成小端"""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class PcapFlowIndexWriter:
+    """
+    pcap 连接索引的写入器
+        过滤时在同一次遍历中调用 add, 记录每条输出记录所属的连接、在输出文件中的偏移和时间戳
+        每个连接的记录偏移存成紧凑的 Q 数组; 另外按固定秒数分桶, 记录每个桶覆盖的字节区间
+    """
+
+    DEFAULT_BUCKET_SECONDS = 1.0
+
+    def __init__(self, bucket_seconds: float = DEFAULT_BUCKET_SECONDS):
+        """
+        :param bucket_seconds: 时间表每个桶的秒数
+        """
+        self.bucket_seconds = bucket_seconds
+        self.record_count = 0
+
+        self._flow_offsets = {}     # 连接 key -> array('Q')
+        self._buckets = {}          # 桶编号 -> [最小起始偏移, 最大结束偏移]
+
+
+    def add(self, flow_key: str, offset: int, length: int, timestamp):
+        """
+        记录一条输出记录
+        :param flow_key: 连接 key
+        :param offset: 记录在输出文件中的偏移
+        :param length: 记录总长度(记录头 + 数据)
+        :param timestamp: 时间戳(秒), 可为None(不计入时间表)
+        :return:
+        """
+        offsets = self._flow_offsets.get(flow_key)
+        if offsets is None:
+            offsets = self._flow_offsets[flow_key] = array('Q')
+        offsets.append(offset)
+        self.record_count += 1
+
+        if timestamp is None:
+            return
+        bucket_id = math.floor(timestamp / self.bucket_seconds)
+        bucket = self._buckets.get(bucket_id)
+        if bucket is None:
+            self._buckets[bucket_id] = [offset, offset + length]
+        else:
+            if offset < bucket[0]:
+                bucket[0] = offset
+            if offset + length > bucket[1]:
+                bucket[1] = offset + length
+
+
+    def write(self, index_path: str):
+        """
+        写出索引文件
+        :param index_path: 索引文件路径
+        :return:
+        """
+        if len(self._buckets) > 0:
+            first_bucket = min(self._buckets)
+            bucket_count = max(self._buckets) - first_bucket + 1
+        else:
+            first_bucket = 0
+            bucket_count = 0
+
+        time_table = array('Q', bytes(16 * bucket_count))
+        for bucket_id, (start, end) in self._buckets.items():
+            position = (bucket_id - first_bucket) * 2
+            time_table[position] = start
+            time_table[position + 1] = end
+
+        with open(index_path, 'wb') as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, len(self._flow_offsets), self.record_count,
+                                         self.bucket_seconds, first_bucket * self.bucket_seconds, bucket_count))
+            for flow_key, offsets in self._flow_offsets.items():
+                key_bytes = flow_key.encode('utf-8')
+                file.write(struct.pack('<H', len(key_bytes)) + key_bytes + struct.pack('<I', len(offsets)))
+            for offsets in self._flow_offsets.values():
+                file.write(_to_little_endian(offsets).tobytes())
+            file.write(_to_little_endian(time_table).tobytes())
+
+
+class PcapFlowIndex:
+    """
+    pcap 连接索引的读取器
+        按连接或按时间段取出记录时只需几次 seek, 不用从头扫描整个 pcap
+        偏移是解压后的偏移, 压缩的 pcap 也能读取(但 seek 需要解压前面的数据, 较慢)
+    """
+
+    INDEX_FILE_SUFFIX = '_flow_index.bin'
+
+    def __init__(self, index_path: str):
+        """
+        :param index_path: 索引文件路径
+        """
+        self.index_path = index_path
+        with open(index_path, 'rb') as file:
+            content = file.read()
+
+        magic, version, _, flow_count, self.record_count, self.bucket_seconds, self.first_bucket_ts, bucket_count = \
+            INDEX_HEADER.unpack_from(content)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"[PcapFlowIndex] 不是有效的索引文件: {index_path}")
+
+        # 连接表
+        position = INDEX_HEADER.size
+        flow_counts = []
+        for _ in range(flow_count):
+            key_length = struct.unpack_from('<H', content, position)[0]
+            flow_key = content[position + 2:position + 2 + key_length].decode('utf-8')
+            count = struct.unpack_from('<I', content, position + 2 + key_length)[0]
+            flow_counts.append((flow_key, count))
+            position += 2 + key_length + 4
+
+        # 记录偏移
+        self._flow_offsets = {}
+        for flow_key, count in flow_counts:
+            offsets = array('Q')
+            offsets.frombytes(content[position:position + 8 * count])
+            self._flow_offsets[flow_key] = _to_little_endian(offsets)
+            position += 8 * count
+
+        # 时间表
+        self._time_table = array('Q')
+        self._time_table.frombytes(content[position:position + 16 * bucket_count])
+        self._time_table = _to_little_endian(self._time_table)
+
+
+    @staticmethod
+    def get_index_path(pcap_path) -> Path:
+        """
+        pcap 对应的索引文件路径, 例: a.pcap / a.pcap.gz -> a_flow_index.bin
+        :param pcap_path: pcap 文件路径
+        :return: Path
+        """
+        plain_path = PcapCodecUtil.strip_suffix(pcap_path)
+        return plain_path.with_name(f"{plain_path.stem}{PcapFlowIndex.INDEX_FILE_SUFFIX}")
+
+
+    @property
+    def flow_keys(self) -> list:
+        """索引中的所有连接 key"""
+        return list(self._flow_offsets.keys())
+
+
+    def get_flow_offsets(self, flow_key: str) -> array:
+        """
+        连接的所有记录偏移
+        :param flow_key: 连接 key(Connection.key)
+        :return: array('Q'), 连接不存在返回空数组
+        """
+        return self._flow_offsets.get(flow_key, array('Q'))
+
+
+    def get_time_range(self, start_ts: float, end_ts: float):
+        """
+        时间段内的记录所在的字节区间
+        :param start_ts: 起始时间戳(秒)
+        :param end_ts: 结束时间戳(秒)
+        :return: (起始偏移, 结束偏移), 没有记录返回 None
+        """
+        bucket_count = len(self._time_table) // 2
+        first = max(0, math.floor((start_ts - self.first_bucket_ts) / self.bucket_seconds))
+        last = min(bucket_count - 1, math.floor((end_ts - self.first_bucket_ts) / self.bucket_seconds))
+
+        start = None
+        end = None
+        for position in range(first, last + 1):
+            bucket_start = self._time_table[position * 2]
+            bucket_end = self._time_table[position * 2 + 1]
+            if bucket_end == 0:
+                continue
+            start = bucket_start if start is None else min(start, bucket_start)
+            end = bucket_end if end is None else max(end, bucket_end)
+        if start is None:
+            return None
+        return start, end
+
+
+    def read_flow(self, pcap_path: str, flow_key: str):
+        """
+        读取一个连接的所有记录
+        :param pcap_path: 建立索引时输出的 pcap 文件路径
+        :param flow_key: 连接 key
+        :return: PcapRecord 生成器
+        """
+        with PcapRecordReader(pcap_path) as reader:
+            for offset in self.get_flow_offsets(flow_key):
+                record = reader.read_record_at(offset)
+                if record is None:
+                    return
+                yield record
+
+
+    def read_time_range(self, pcap_path: str, start_ts: float, end_ts: float):
+        """
+        读取时间段内的所有记录(按文件顺序)
+        :param pcap_path: 建立索引时输出的 pcap 文件路径
+        :param start_ts: 起始时间戳(秒)
+        :param end_ts: 结束时间戳(秒)
+        :return: PcapRecord 生成器
+        """
+        byte_range = self.get_time_range(start_ts, end_ts)
+        if byte_range is None:
+            return
+        start, end = byte_range
+        with PcapRecordReader(pcap_path) as reader:
+            record = reader.read_record_at(start)
+            while record is not None and record.offset < end:
+                if start_ts <= reader.timestamp_of(record) <= end_ts:
+                    yield record
+                record = reader.read_record()
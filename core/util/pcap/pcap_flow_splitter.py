@@ -0,0 +1,153 @@
+__doc__ = "把 pcap 记录按连接拆分到多个文件"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-17"
+
+import json
+import os
+import re
+from collections import OrderedDict
+
+
+class PcapFlowSplitter:
+    """
+    把 pcap 记录按连接拆分到多个 pcap 文件
+        每个连接一个文件, 记录原样写入(保留源文件的全局头和链路层类型)
+        同时打开的文件句柄数有上限, 超过时按 LRU 关闭最久没写的文件, 之后再写入时以追加方式重新打开
+        关闭时写出 manifest.json, 记录每个连接对应的文件和包数/字节数
+    """
+
+    MANIFEST_FILE_NAME = 'manifest.json'
+    DEFAULT_MAX_OPEN_FILES = 64     # 默认同时打开的文件数
+    WRITE_BUFFER_SIZE = 64 * 1024   # 每个文件的写缓冲
+
+    def __init__(self, output_dir: str, global_header: bytes, source_name: str = None,
+                 max_open_files: int = DEFAULT_MAX_OPEN_FILES):
+        """
+        :param output_dir: 输出目录(不存在会自动创建)
+        :param global_header: 每个文件开头写入的全局头(一般是源文件的全局头原样)
+        :param source_name: 源文件名(写入 manifest)
+        :param max_open_files: 同时打开的文件数上限
+        """
+        self.output_dir = output_dir
+        self.global_header = global_header
+        self.source_name = source_name
+        self.max_open_files = max(1, max_open_files)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self._open_files = OrderedDict()    # 连接 -> 文件句柄(按最近写入排序)
+        self._flows = {}                    # 连接 -> manifest 条目
+        self._used_file_names = set()
+        self.eviction_count = 0             # 因 LRU 被关闭的次数
+
+
+    @staticmethod
+    def flow_file_name(flow_key: str) -> str:
+        """
+        由连接 key 生成文件名
+            Connection.key 形如 192.168.1.100:54321->93.184.216.34:443, 把文件名中不能使用的字符替换掉
+            例: 192.168.1.100_54321__93.184.216.34_443.pcap
+        :param flow_key: 连接 key
+        :return: 文件名
+        """
+        return re.sub(r'[^0-9A-Za-z._]+', '_', flow_key.replace('->', '__')).strip('_') + '.pcap'
+
+
+    def write(self, flow_key: str, record_header: bytes, data: bytes):
+        """
+        把一条记录写入连接对应的文件
+        :param flow_key: 连接 key
+        :param record_header: 16 字节记录头
+        :param data: 记录数据
+        :return:
+        """
+        file = self._get_file(flow_key)
+        file.write(record_header)
+        file.write(data)
+
+        flow = self._flows[flow_key]
+        flow['packets'] += 1
+        flow['bytes'] += len(data)
+
+
+    def _get_file(self, flow_key: str):
+        """
+        取得连接对应的文件句柄, 没有打开时打开(必要时关闭最久没写的文件)
+        :param flow_key: 连接 key
+        :return: 文件句柄
+        """
+        file = self._open_files.get(flow_key)
+        if file is not None:
+            self._open_files.move_to_end(flow_key)
+            return file
+
+        # 达到上限, 关闭最久没写的文件
+        while len(self._open_files) >= self.max_open_files:
+            _, evicted = self._open_files.popitem(last=False)
+            evicted.close()
+            self.eviction_count += 1
+
+        flow = self._flows.get(flow_key)
+        if flow is None:
+            # 第一次写入: 新建文件并写入全局头
+            file_name = self._unique_file_name(PcapFlowSplitter.flow_file_name(flow_key))
+            flow = {'connection': flow_key, 'file': file_name, 'packets': 0, 'bytes': 0}
+            self._flows[flow_key] = flow
+            file = open(os.path.join(self.output_dir, file_name), 'wb', buffering=PcapFlowSplitter.WRITE_BUFFER_SIZE)
+            file.write(self.global_header)
+        else:
+            # 之前被关闭过, 追加写入
+            file = open(os.path.join(self.output_dir, flow['file']), 'ab', buffering=PcapFlowSplitter.WRITE_BUFFER_SIZE)
+
+        self._open_files[flow_key] = file
+        return file
+
+
+    def _unique_file_name(self, file_name: str) -> str:
+        """
+        避免不同连接的文件名冲突(替换字符后可能重名)
+        :param file_name: 文件名
+        :return: 不重复的文件名
+        """
+        stem, suffix = os.path.splitext(file_name)
+        candidate = file_name
+        index = 1
+        while candidate in self._used_file_names:
+            candidate = f"{stem}_{index}{suffix}"
+            index += 1
+        self._used_file_names.add(candidate)
+        return candidate
+
+
+    def write_manifest(self):
+        """
+        写出 manifest.json
+        :return: manifest 文件路径
+        """
+        manifest = {
+            'source': self.source_name,
+            'flow_count': len(self._flows),
+            'flows': list(self._flows.values()),
+        }
+        manifest_path = os.path.join(self.output_dir, PcapFlowSplitter.MANIFEST_FILE_NAME)
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file, indent=2)
+        return manifest_path
+
+
+    def close(self):
+        """
+        关闭所有文件并写出 manifest
+        :return:
+        """
+        while len(self._open_files) > 0:
+            _, file = self._open_files.popitem(last=False)
+            file.close()
+        self.write_manifest()
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
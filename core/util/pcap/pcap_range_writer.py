@@ -0,0 +1,159 @@
+__doc__ = "按字节区间复制 pcap 记录"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-12"
+
+import os
+
+from core.util.pcap.pcap_codec import PcapCodec, PcapCodecUtil
+
+
+class PcapRangeWriter:
+    """
+    按字节区间把源 pcap 中的记录原样复制到目标文件
+        不解析也不重新编码任何包, 输出文件是源文件的逐字节子集
+        相邻的区间会先合并再复制, 复制优先使用 copy_file_range, 其次 sendfile, 都不可用时退回普通读写
+        源文件是压缩文件时按解压后的偏移读取(区间需按偏移递增, 只向前 seek); 指定 codec 时目标文件边写边压缩, 两种情况都只能普通读写
+    """
+
+    COPY_CHUNK_SIZE = 1024 * 1024   # 普通读写时每次复制的字节数
+
+    def __init__(self, src_path: str, dst_path: str, global_header: bytes, codec: PcapCodec = None):
+        """
+        :param src_path: 源 pcap 文件路径(可以是压缩文件)
+        :param dst_path: 目标文件路径
+        :param global_header: 写入目标文件开头的全局头(一般是源文件的全局头原样)
+        :param codec: 目标文件的压缩编解码器(为None时不压缩)
+        """
+        self.src_path = src_path
+        self.dst_path = dst_path
+
+        src_compressed = PcapCodecUtil.detect_codec(src_path) is not None
+        self._src = PcapCodecUtil.open_file(src_path)
+        self._dst_fd = None
+        self._dst = None
+        if codec is None:
+            self._dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        else:
+            self._dst = codec.open(dst_path, 'wb')
+        self._write_all(global_header)
+
+        # 待复制的区间(合并相邻区间)
+        self._pending_start = None
+        self._pending_end = None
+
+        # 可用的零拷贝方式(压缩的源或目标文件都不能直接复制字节)
+        zero_copy = not src_compressed and self._dst_fd is not None
+        self._use_copy_file_range = zero_copy and hasattr(os, 'copy_file_range')
+        self._use_sendfile = zero_copy and hasattr(os, 'sendfile')
+
+
+    def add_range(self, start: int, length: int):
+        """
+        追加一段需要复制的区间
+        :param start: 在源文件中的起始偏移
+        :param length: 长度
+        :return:
+        """
+        if self._pending_end is not None and self._pending_end == start:
+            self._pending_end += length
+            return
+
+        self.flush()
+        self._pending_start = start
+        self._pending_end = start + length
+
+
+    def flush(self):
+        """
+        把待复制的区间写入目标文件
+        :return:
+        """
+        if self._pending_start is None:
+            return
+        self._copy(self._pending_start, self._pending_end - self._pending_start)
+        self._pending_start = None
+        self._pending_end = None
+
+
+    def _copy(self, offset: int, count: int):
+        """
+        复制一个区间
+        :param offset: 源文件偏移
+        :param count: 字节数
+        :return:
+        """
+        # 1. copy_file_range: 内核内复制, 部分文件系统上甚至不需要复制数据块
+        while count > 0 and self._use_copy_file_range:
+            try:
+                copied = os.copy_file_range(self._src.fileno(), self._dst_fd, count, offset)
+            except OSError:
+                self._use_copy_file_range = False
+                break
+            if copied <= 0:
+                self._use_copy_file_range = False
+                break
+            offset += copied
+            count -= copied
+
+        # 2. sendfile: 同样不经过用户态
+        while count > 0 and self._use_sendfile:
+            try:
+                copied = os.sendfile(self._dst_fd, self._src.fileno(), offset, count)
+            except OSError:
+                self._use_sendfile = False
+                break
+            if copied <= 0:
+                self._use_sendfile = False
+                break
+            offset += copied
+            count -= copied
+
+        # 3. 普通读写兜底
+        if count > 0:
+            self._src.seek(offset)
+            while count > 0:
+                data = self._src.read(min(count, PcapRangeWriter.COPY_CHUNK_SIZE))
+                if not data:
+                    raise IOError(f"[PcapRangeWriter] 源文件 {self.src_path} 在偏移 {offset} 处数据不足")
+                self._write_all(data)
+                offset += len(data)
+                count -= len(data)
+
+
+    def _write_all(self, data: bytes):
+        """
+        把数据完整写入目标文件
+        :param data:
+        :return:
+        """
+        if self._dst is not None:
+            self._dst.write(data)
+            return
+        view = memoryview(data)
+        while len(view) > 0:
+            written = os.write(self._dst_fd, view)
+            view = view[written:]
+
+
+    def close(self):
+        """
+        复制剩余区间并关闭文件
+        :return:
+        """
+        try:
+            self.flush()
+        finally:
+            self._src.close()
+            if self._dst_fd is not None:
+                os.close(self._dst_fd)
+                self._dst_fd = None
+            if self._dst is not None:
+                self._dst.close()
+                self._dst = None
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,202 @@
+__doc__ = "pcap 原始记录读取器"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-10"
+
+import struct
+from dataclasses import dataclass
+
+from core.util.pcap.pcap_codec import PcapCodecUtil
+
+
+# pcap 全局头的魔数
+PCAP_MAGIC_USEC = 0xa1b2c3d4    # 微秒精度
+PCAP_MAGIC_NSEC = 0xa1b23c4d    # 纳秒精度
+
+PCAP_GLOBAL_HEADER_LEN = 24     # 全局头长度
+PCAP_RECORD_HEADER_LEN = 16     # 记录头长度
+
+
+@dataclass
+class PcapRecord:
+    """pcap 中的一条记录(不解析包内容)"""
+    offset: int         # 记录头在文件中的偏移
+    ts_sec: int         # 时间戳(秒)
+    ts_frac: int        # 时间戳(微秒或纳秒, 取决于文件精度)
+    caplen: int         # 实际保存的长度
+    wirelen: int        # 线上原始长度
+    data: bytes         # 记录数据(链路层开始)
+
+    @property
+    def length(self) -> int:
+        """记录在文件中占用的总字节数(记录头 + 数据)"""
+        return PCAP_RECORD_HEADER_LEN + self.caplen
+
+
+class PcapRecordReader:
+    """
+    pcap 原始记录读取器
+        只解析全局头和记录头, 按顺序返回每条记录的原始字节, 不做任何协议解析
+        仅支持经典 pcap 格式(支持大小端和纳秒精度), 不支持 pcapng
+        压缩文件(.pcap.gz/.pcap.xz 等)自动解压读取, 此时记录偏移是解压后的偏移
+    """
+
+    def __init__(self, file_path: str, buffer_size: int = 1024 * 1024):
+        """
+        :param file_path: pcap 文件路径
+        :param buffer_size: 读缓冲区大小(字节)
+        """
+        self.file_path = file_path
+        self._file = PcapCodecUtil.open_file(file_path, buffer_size)
+
+        # 全局头信息
+        self.global_header = None   # 全局头原始字节
+        self.endian = None          # 字节序('<' 或 '>')
+        self.nano = False           # 是否是纳秒精度
+        self.snaplen = None         # 快照长度
+        self.link_type = None       # 链路层类型
+        self.truncated = False      # 文件末尾是否有不完整的记录
+
+        self._record_header_struct = None
+        self._offset = 0            # 下一条记录的文件偏移(自己记录, 避免每次调用 tell)
+        self._read_global_header()
+
+
+    @staticmethod
+    def is_pcap_file(file_path: str) -> bool:
+        """
+        判断文件是否是经典 pcap 格式(压缩文件按解压后的内容判断)
+        :param file_path: 文件路径
+        :return: bool
+        """
+        with PcapCodecUtil.open_file(file_path) as f:
+            magic = f.read(4)
+        return PcapRecordReader._parse_magic(magic) is not None
+
+
+    @staticmethod
+    def parse_global_header(header: bytes):
+        """
+        解析 pcap 全局头
+        :param header: 文件开头的 24 个字节
+        :return: (字节序, 是否纳秒, snaplen, 链路层类型), 不是 pcap 返回 None
+        """
+        parsed = PcapRecordReader._parse_magic(header[:4])
+        if parsed is None or len(header) < PCAP_GLOBAL_HEADER_LEN:
+            return None
+        endian, nano = parsed
+        _, _, _, _, snaplen, link_type = struct.unpack(endian + 'HHiIII', header[4:PCAP_GLOBAL_HEADER_LEN])
+        return endian, nano, snaplen, link_type & 0xFFFF     # 链路层类型高位可能带有 FCS 信息
+
+
+    @staticmethod
+    def _parse_magic(magic: bytes):
+        """
+        解析魔数
+        :param magic: 前4个字节
+        :return: (字节序, 是否纳秒), 不是 pcap 返回 None
+        """
+        if len(magic) < 4:
+            return None
+        for endian in ('<', '>'):
+            value = struct.unpack(endian + 'I', magic)[0]
+            if value == PCAP_MAGIC_USEC:
+                return endian, False
+            if value == PCAP_MAGIC_NSEC:
+                return endian, True
+        return None
+
+
+    def _read_global_header(self):
+        """
+        读取并解析全局头
+        :return:
+        """
+        header = self._file.read(PCAP_GLOBAL_HEADER_LEN)
+        parsed = PcapRecordReader.parse_global_header(header)
+        if parsed is None:
+            self._file.close()
+            raise ValueError(f"[PcapRecordReader] 不是有效的 pcap 文件: {self.file_path}")
+
+        self.global_header = header
+        self.endian, self.nano, self.snaplen, self.link_type = parsed
+        self._record_header_struct = struct.Struct(self.endian + 'IIII')
+        self._offset = PCAP_GLOBAL_HEADER_LEN
+
+
+    def read_record(self):
+        """
+        读取下一条记录
+        :return: PcapRecord, 读到文件末尾(或遇到不完整记录)时返回 None
+        """
+        offset = self._offset
+        header = self._file.read(PCAP_RECORD_HEADER_LEN)
+        if len(header) < PCAP_RECORD_HEADER_LEN:
+            if len(header) > 0:
+                self.truncated = True
+            return None
+
+        ts_sec, ts_frac, caplen, wirelen = self._record_header_struct.unpack(header)
+        data = self._file.read(caplen)
+        if len(data) < caplen:
+            self.truncated = True
+            return None
+
+        self._offset = offset + PCAP_RECORD_HEADER_LEN + caplen
+        return PcapRecord(offset, ts_sec, ts_frac, caplen, wirelen, data)
+
+
+    def read_record_at(self, offset: int):
+        """
+        读取指定偏移处的记录(配合索引随机读取), 之后 read_record 从这条记录之后继续读
+        :param offset: 记录头在文件中的偏移
+        :return: PcapRecord, 偏移处没有完整记录时返回 None
+        """
+        self._file.seek(offset)
+        self._offset = offset
+        return self.read_record()
+
+
+    def timestamp_of(self, record: PcapRecord) -> float:
+        """
+        记录的浮点时间戳
+        :param record: PcapRecord
+        :return: 秒
+        """
+        if self.nano:
+            return record.ts_sec + record.ts_frac / 1e9
+        return record.ts_sec + record.ts_frac / 1e6
+
+
+    def pack_record_header(self, record: PcapRecord, caplen: int = None) -> bytes:
+        """
+        按本文件的字节序重新打包记录头
+        :param record: PcapRecord
+        :param caplen: 截断后保存的长度(为None时不变, 原始长度始终保留)
+        :return: 16 字节记录头
+        """
+        if caplen is None:
+            caplen = record.caplen
+        return self._record_header_struct.pack(record.ts_sec, record.ts_frac, caplen, record.wirelen)
+
+
+    def __iter__(self):
+        while True:
+            record = self.read_record()
+            if record is None:
+                return
+            yield record
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        关闭文件
+        :return:
+        """
+        if not self._file.closed:
+            self._file.close()
@@ -0,0 +1,130 @@
+__doc__ = "检测并修复末尾被截断的 pcap/pcapng"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-22"
+
+import os
+import struct
+
+from core.util.io.log_util import LogUtil
+from core.util.pcap.pcap_codec import PcapCodecUtil
+from core.util.pcap.pcap_record_reader import PcapRecordReader, PCAP_GLOBAL_HEADER_LEN, PCAP_RECORD_HEADER_LEN
+from core.util.pcap.pcapng_block_reader import PcapngBlockReader, PCAPNG_BLOCK_SHB
+
+
+class PcapRepairUtil:
+    """
+    检测并修复末尾被截断的 pcap/pcapng
+        tcpdump 等被 terminate() 结束时, 最后一条记录可能只写了一半, rdpcap 会抛异常或悄悄丢数据
+        这里只读每条记录(块)的头, 按长度 seek 跳过数据, 不解析包内容, 耗时与记录数成正比, 可以放在每次过滤之前
+        找到最后一条完整记录后, 把文件截断到该位置
+    """
+
+    MAX_RECORD_LEN = 256 * 1024 * 1024  # 单条记录长度上限, 超过视为数据损坏(从这里截断)
+    READ_BUFFER_SIZE = 1024 * 1024
+
+
+    @staticmethod
+    def find_valid_length(file_path: str):
+        """
+        遍历记录头, 找到最后一条完整记录的结束位置
+        :param file_path: 文件路径(不支持压缩文件)
+        :return: (完整记录数, 有效长度), 不是 pcap/pcapng 返回 None
+        """
+        if PcapRecordReader.is_pcap_file(file_path):
+            return PcapRepairUtil._find_pcap_valid_length(file_path)
+        if PcapngBlockReader.is_pcapng_file(file_path):
+            return PcapRepairUtil._find_pcapng_valid_length(file_path)
+        return None
+
+
+    @staticmethod
+    def _find_pcap_valid_length(file_path: str):
+        """
+        经典 pcap: 依次读 16 字节记录头, 跳过 caplen 字节数据
+        :param file_path: 文件路径
+        :return: (完整记录数, 有效长度)
+        """
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb', buffering=PcapRepairUtil.READ_BUFFER_SIZE) as f:
+            parsed = PcapRecordReader.parse_global_header(f.read(PCAP_GLOBAL_HEADER_LEN))
+            if parsed is None:
+                # 全局头都不完整, 不处理
+                return 0, file_size
+            caplen_struct = struct.Struct(parsed[0] + 'I')
+
+            count = 0
+            valid_length = PCAP_GLOBAL_HEADER_LEN
+            while valid_length + PCAP_RECORD_HEADER_LEN <= file_size:
+                header = f.read(PCAP_RECORD_HEADER_LEN)
+                caplen = caplen_struct.unpack_from(header, 8)[0]
+                end = valid_length + PCAP_RECORD_HEADER_LEN + caplen
+                if caplen > PcapRepairUtil.MAX_RECORD_LEN or end > file_size:
+                    break
+                f.seek(caplen, os.SEEK_CUR)
+                count += 1
+                valid_length = end
+
+        return count, valid_length
+
+
+    @staticmethod
+    def _find_pcapng_valid_length(file_path: str):
+        """
+        pcapng: 依次读块头(块类型、块长度, 以及 SHB 的字节序魔数位置), 跳过块内容并核对块尾的长度
+        :param file_path: 文件路径
+        :return: (完整块数, 有效长度)
+        """
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb', buffering=PcapRepairUtil.READ_BUFFER_SIZE) as f:
+            endian = None
+            count = 0
+            valid_length = 0
+            while valid_length + 12 <= file_size:
+                header = f.read(12)
+                if struct.unpack_from('<I', header)[0] == PCAPNG_BLOCK_SHB:
+                    # 每个 section 的字节序由 SHB 的魔数决定
+                    endian = PcapngBlockReader._parse_byte_order(header[8:12])
+                if endian is None:
+                    break
+
+                total_length = struct.unpack_from(endian + 'I', header, 4)[0]
+                end = valid_length + total_length
+                if total_length < 12 or total_length % 4 != 0 or total_length > PcapRepairUtil.MAX_RECORD_LEN \
+                        or end > file_size:
+                    break
+
+                # 块尾重复了块长度, 不一致说明块没有写完整
+                f.seek(total_length - 16, os.SEEK_CUR)
+                if struct.unpack(endian + 'I', f.read(4))[0] != total_length:
+                    break
+                count += 1
+                valid_length = end
+
+        return count, valid_length
+
+
+    @staticmethod
+    def repair(file_path: str, logger_name: str = 'main'):
+        """
+        检测并截断末尾不完整的记录
+        :param file_path: 文件路径
+        :param logger_name: 日志记录器名称
+        :return: (完整记录数, 丢弃的字节数), 压缩文件或无法识别的格式返回 None
+        """
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            return None
+        if PcapCodecUtil.detect_codec(file_path) is not None:
+            # 压缩文件不能原地截断(一般由过滤写出, 不会被截断)
+            return None
+
+        result = PcapRepairUtil.find_valid_length(file_path)
+        if result is None:
+            return None
+
+        count, valid_length = result
+        discarded = os.path.getsize(file_path) - valid_length
+        if discarded > 0:
+            os.truncate(file_path, valid_length)
+            LogUtil().warning(logger_name,
+                              f"[PcapRepairUtil] {file_path} 末尾有不完整的记录, 已截断 {discarded} 字节 (完整记录数: {count})")
+        return count, discarded
@@ -0,0 +1,237 @@
+__doc__ = "pcapng 原始块读取器"
+__author__ = "Li Qingyun"
+__date__ = "2025-12-18"
+
+import struct
+from dataclasses import dataclass
+from typing import List
+
+from core.util.pcap.pcap_codec import PcapCodecUtil
+
+
+# 块类型
+PCAPNG_BLOCK_SHB = 0x0A0D0D0A   # Section Header Block
+PCAPNG_BLOCK_IDB = 0x00000001   # Interface Description Block
+PCAPNG_BLOCK_OPB = 0x00000002   # Packet Block(已废弃, 但老文件里还会出现)
+PCAPNG_BLOCK_SPB = 0x00000003   # Simple Packet Block
+PCAPNG_BLOCK_EPB = 0x00000006   # Enhanced Packet Block
+
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+# IDB 选项
+PCAPNG_OPTION_END = 0
+PCAPNG_OPTION_IF_TSRESOL = 9    # 时间戳精度
+PCAPNG_OPTION_IF_TSOFFSET = 14  # 时间戳偏移(秒)
+
+
+@dataclass
+class PcapngInterface:
+    """pcapng 中的一个接口(来自 IDB)"""
+    link_type: int                  # 链路层类型
+    snaplen: int                    # 快照长度
+    ts_units_per_sec: int = 1000000 # 时间戳每秒的单位数(默认微秒)
+    ts_offset: int = 0              # 时间戳偏移(秒)
+
+
+@dataclass
+class PcapngBlock:
+    """pcapng 中的一个块(数据包块会解析出接口/时间戳/数据, 其他块只记录位置)"""
+    offset: int                     # 块在文件中的偏移
+    block_type: int                 # 块类型
+    length: int                     # 块总长度(含块头尾)
+    interface_id: int = None        # 数据包所属接口
+    link_type: int = None           # 数据包的链路层类型(来自接口)
+    timestamp: float = None         # 数据包时间戳(秒), SPB 没有时间戳
+    caplen: int = None              # 实际保存的长度
+    wirelen: int = None             # 线上原始长度
+    data: bytes = None              # 数据包数据(链路层开始)
+
+    @property
+    def is_packet(self) -> bool:
+        """是否是数据包块"""
+        return self.data is not None
+
+
+class PcapngBlockReader:
+    """
+    pcapng 原始块读取器
+        按顺序返回每个块的位置, 数据包块(EPB/SPB/OPB)额外解析出接口、链路层类型、时间戳和数据, 不做任何协议解析
+        支持多个 section(字节序可以不同)、多个接口, 每个接口有自己的链路层类型和时间戳精度
+        块本身不解码也不重新编码, 配合 PcapRangeWriter 可以按字节区间原样复制
+        压缩文件(.pcapng.gz/.pcapng.xz 等)自动解压读取, 此时块偏移是解压后的偏移
+    """
+
+    def __init__(self, file_path: str, buffer_size: int = 1024 * 1024):
+        """
+        :param file_path: pcapng 文件路径
+        :param buffer_size: 读缓冲区大小(字节)
+        """
+        self.file_path = file_path
+        self._file = PcapCodecUtil.open_file(file_path, buffer_size)
+
+        self.endian = None                              # 当前 section 的字节序
+        self.interfaces: List[PcapngInterface] = []     # 当前 section 的接口
+        self.truncated = False                          # 文件末尾是否有不完整的块
+
+        self._offset = 0
+
+        if not PcapngBlockReader.is_pcapng_file(file_path):
+            self._file.close()
+            raise ValueError(f"[PcapngBlockReader] 不是有效的 pcapng 文件: {self.file_path}")
+
+
+    @staticmethod
+    def is_pcapng_file(file_path: str) -> bool:
+        """
+        判断文件是否是 pcapng 格式(以 SHB 开头, 压缩文件按解压后的内容判断)
+        :param file_path: 文件路径
+        :return: bool
+        """
+        with PcapCodecUtil.open_file(file_path) as f:
+            header = f.read(12)
+        if len(header) < 12:
+            return False
+        block_type = struct.unpack('<I', header[:4])[0]
+        return block_type == PCAPNG_BLOCK_SHB and PcapngBlockReader._parse_byte_order(header[8:12]) is not None
+
+
+    @staticmethod
+    def _parse_byte_order(magic: bytes):
+        """
+        根据 SHB 中的字节序魔数确定字节序
+        :param magic: 4 字节
+        :return: '<' 或 '>', 无法识别返回 None
+        """
+        for endian in ('<', '>'):
+            if struct.unpack(endian + 'I', magic)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                return endian
+        return None
+
+
+    def read_block(self):
+        """
+        读取下一个块
+        :return: PcapngBlock, 读到文件末尾(或遇到不完整的块)时返回 None
+        """
+        offset = self._offset
+        header = self._file.read(8)
+        if len(header) < 8:
+            if len(header) > 0:
+                self.truncated = True
+            return None
+
+        # SHB 的块类型是回文, 字节序要从块内的魔数判断
+        if struct.unpack('<I', header[:4])[0] == PCAPNG_BLOCK_SHB:
+            magic = self._file.read(4)
+            endian = PcapngBlockReader._parse_byte_order(magic) if len(magic) == 4 else None
+            if endian is None:
+                self.truncated = True
+                return None
+            self.endian = endian
+            self.interfaces = []
+            block_type = PCAPNG_BLOCK_SHB
+            total_length = struct.unpack(endian + 'I', header[4:8])[0]
+            rest = magic + self._file.read(total_length - 12) if total_length >= 12 else b''
+        else:
+            block_type, total_length = struct.unpack(self.endian + 'II', header)
+            rest = self._file.read(total_length - 8) if total_length >= 12 else b''
+
+        if total_length < 12 or total_length % 4 != 0 or len(rest) < total_length - 8:
+            self.truncated = True
+            return None
+
+        self._offset = offset + total_length
+        block = PcapngBlock(offset=offset, block_type=block_type, length=total_length)
+        body = memoryview(rest)[:total_length - 12]     # 去掉结尾的块长度
+
+        # 内容长度不足的块不解析, 当作普通块原样保留
+        if block_type == PCAPNG_BLOCK_IDB and len(body) >= 8:
+            self.interfaces.append(self._parse_interface(body))
+        elif block_type == PCAPNG_BLOCK_EPB and len(body) >= 20:
+            interface_id, ts_high, ts_low, caplen, wirelen = struct.unpack_from(self.endian + 'IIIII', body)
+            self._fill_packet(block, interface_id, (ts_high << 32) | ts_low, caplen, wirelen, body[20:20 + caplen])
+        elif block_type == PCAPNG_BLOCK_OPB and len(body) >= 20:
+            interface_id, _, ts_high, ts_low, caplen, wirelen = struct.unpack_from(self.endian + 'HHIIII', body)
+            self._fill_packet(block, interface_id, (ts_high << 32) | ts_low, caplen, wirelen, body[20:20 + caplen])
+        elif block_type == PCAPNG_BLOCK_SPB and len(body) >= 4:
+            wirelen = struct.unpack_from(self.endian + 'I', body)[0]
+            caplen = min(wirelen, len(body) - 4)
+            if len(self.interfaces) > 0 and self.interfaces[0].snaplen > 0:
+                caplen = min(caplen, self.interfaces[0].snaplen)
+            self._fill_packet(block, 0, None, caplen, wirelen, body[4:4 + caplen])
+
+        return block
+
+
+    def _fill_packet(self, block: PcapngBlock, interface_id: int, ticks, caplen: int, wirelen: int, data):
+        """
+        填充数据包块的字段
+        :param block: PcapngBlock
+        :param interface_id: 接口编号
+        :param ticks: 原始时间戳(接口精度的单位数), SPB 为 None
+        :param caplen: 实际保存的长度
+        :param wirelen: 线上原始长度
+        :param data: 数据
+        :return:
+        """
+        block.interface_id = interface_id
+        block.caplen = caplen
+        block.wirelen = wirelen
+        block.data = bytes(data)
+        if interface_id < len(self.interfaces):
+            interface = self.interfaces[interface_id]
+            block.link_type = interface.link_type
+            if ticks is not None:
+                block.timestamp = ticks / interface.ts_units_per_sec + interface.ts_offset
+
+
+    def _parse_interface(self, body) -> PcapngInterface:
+        """
+        解析 IDB
+        :param body: 块内容(不含块头尾)
+        :return: PcapngInterface
+        """
+        link_type, _, snaplen = struct.unpack_from(self.endian + 'HHI', body)
+        interface = PcapngInterface(link_type=link_type, snaplen=snaplen)
+
+        # 解析选项
+        position = 8
+        while position + 4 <= len(body):
+            code, length = struct.unpack_from(self.endian + 'HH', body, position)
+            value = body[position + 4:position + 4 + length]
+            if code == PCAPNG_OPTION_END:
+                break
+            if code == PCAPNG_OPTION_IF_TSRESOL and length >= 1:
+                resolution = value[0]
+                if resolution & 0x80:
+                    interface.ts_units_per_sec = 2 ** (resolution & 0x7F)
+                else:
+                    interface.ts_units_per_sec = 10 ** resolution
+            elif code == PCAPNG_OPTION_IF_TSOFFSET and length >= 8:
+                interface.ts_offset = struct.unpack_from(self.endian + 'q', value)[0]
+            position += 4 + ((length + 3) & ~3)
+
+        return interface
+
+
+    def __iter__(self):
+        while True:
+            block = self.read_block()
+            if block is None:
+                return
+            yield block
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        关闭文件
+        :return:
+        """
+        if not self._file.closed:
+            self._file.close()